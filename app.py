@@ -1,4 +1,4 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, Response, stream_with_context
 import os
 import secrets
 from datetime import datetime, timedelta
@@ -7,17 +7,24 @@ from werkzeug.utils import secure_filename
 from functools import wraps
 from dotenv import load_dotenv
 import logging
+import json
+import re
 import time
-import base64
-import cv2
 from celery.result import AsyncResult
-from ultralytics import YOLO
 
-# Import the Celery task
-from celery_worker import process_video_task
+# Tasks are sent by name through the lightweight Celery client; the web app
+# never imports celery_worker, and so never loads torch or the model.
+from celery_app import celery, BULK_QUEUE, PROCESS_VIDEO_TASK, PROCESS_VIDEO_PARALLEL_TASK
+from extraction_config import extraction_settings
+from batch_jobs import BatchJobs
 
 # Import the S3 utility functions
-from s3_utils import upload_file_to_s3, download_file_from_s3, delete_file_from_s3, check_file_exists, generate_presigned_url, get_s3_client
+from s3_utils import upload_file_to_s3, download_file_from_s3, delete_file_from_s3, check_file_exists, generate_presigned_url, get_s3_client, get_file_metadata, make_s3_uri
+from system_status import SystemStatusCache
+from video_catalog import VideoCatalog, CAMERAS, VIDEO_TYPES, parse_video_key
+from task_events import subscribe, get_last_event, FINAL_STATES
+from result_cache import ResultCache, RESULT_CACHE_ENABLED, save_and_hash, file_sha256, make_cache_key
+from chunked_upload import ChunkedUploads, UploadError, UPLOAD_CHUNK_SIZE
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -35,6 +42,12 @@ app.permanent_session_lifetime = timedelta(minutes=30)
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['FRAME_EXTRACTION_OUTPUT'] = 'static/extracted_frames'
 app.config['YOLO_MODEL_PATH'] = 'models/best_weights.pt'
+# Number of chunks a video is split into and processed in parallel (1 = one task).
+app.config['PARALLEL_CHUNKS'] = int(os.getenv('PARALLEL_CHUNKS', 1))
+# Task event streams send a keep-alive comment this often and are closed
+# after TASK_STREAM_TIMEOUT seconds; the browser then reconnects by itself.
+app.config['TASK_STREAM_KEEPALIVE'] = int(os.getenv('TASK_STREAM_KEEPALIVE', 15))
+app.config['TASK_STREAM_TIMEOUT'] = int(os.getenv('TASK_STREAM_TIMEOUT', 600))
 
 # Create folders if they don't exist
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
@@ -59,39 +72,27 @@ else:
 
 # --- Optimized Functions ---
 
+# The status is refreshed in the background and cached in Redis, so rendering
+# a page never waits for a scan of the bucket.
+system_status_cache = SystemStatusCache(S3_BUCKET, S3_UPLOAD_FOLDER)
+
+# Videos are looked up by date and camera in a local index instead of listing
+# S3 on each request. Run `python video_catalog.py backfill` to build it.
+video_catalog = VideoCatalog(S3_BUCKET, S3_UPLOAD_FOLDER)
+
+# Resumable uploads write chunks straight into the upload folder or into an
+# S3 multipart upload, without spooling the whole request first.
+chunked_uploads = ChunkedUploads(app.config['UPLOAD_FOLDER'], S3_BUCKET, S3_UPLOAD_FOLDER)
+
+result_cache = ResultCache() if RESULT_CACHE_ENABLED else None
+batch_jobs = BatchJobs(celery, BULK_QUEUE)
+
 def get_system_status():
     """
-    Optimized function to get system status with a single S3 paginator call.
+    Get the cached system status. Never blocks on S3.
     """
     try:
-        total_videos_count = 0
-        storage_bytes = 0
-        
-        paginator = s3_client.get_paginator('list_objects_v2')
-        pages = paginator.paginate(Bucket=S3_BUCKET, Prefix=S3_UPLOAD_FOLDER)
-
-        for page in pages:
-            if 'Contents' in page:
-                for item in page['Contents']:
-                    storage_bytes += item.get('Size', 0)
-                    if item['Key'].lower().endswith(('.mp4', '.avi', '.mov')):
-                        total_videos_count += 1
-        
-        if storage_bytes < 1024:
-            storage_usage = f"{storage_bytes} B"
-        elif storage_bytes < 1024**2:
-            storage_usage = f"{storage_bytes/1024:.1f} KB"
-        elif storage_bytes < 1024**3:
-            storage_usage = f"{storage_bytes/(1024**2):.1f} MB"
-        else:
-            storage_usage = f"{storage_bytes/(1024**3):.1f} GB"
-
-        return {
-            "last_upload_time": None, "processing_speed": "Optimal",
-            "system_status": "Online" if s3_client else "Offline",
-            "storage_usage": storage_usage, "total_videos": total_videos_count,
-            "total_detections": 0
-        }
+        return system_status_cache.get()
     except Exception as e:
         logger.error(f"Error getting system status: {str(e)}")
         return {"last_upload_time": None, "processing_speed": "Unknown", "system_status": "Error",
@@ -111,8 +112,29 @@ ADMIN_ROLES = {
 
 ALLOWED_EXTENSIONS = {'mp4', 'avi', 'mov'}
 
+# Sub-folders uploads may be stored in: '<date>' or '<date>/<camera>_<type>',
+# the layout the video catalog reads recordings from.
+UPLOAD_SUBFOLDER_PATTERN = re.compile(
+    rf"^\d{{4}}-\d{{2}}-\d{{2}}(/({'|'.join(CAMERAS)})_({'|'.join(VIDEO_TYPES)}))?$")
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+
+def parse_pagination(values, default_per_page=50, max_per_page=500):
+    """Reads page/per_page from request args or form data, clamped to sane values."""
+    try:
+        page = max(1, int(values.get('page', 1)))
+        per_page = min(max_per_page, max(1, int(values.get('per_page', default_per_page))))
+    except ValueError:
+        page, per_page = 1, default_per_page
+    return page, per_page
+
+def valid_date(value):
+    try:
+        datetime.strptime(value, '%Y-%m-%d')
+        return True
+    except (TypeError, ValueError):
+        return False
     
 # --- Decorators ---
 def login_required(f):
@@ -186,12 +208,103 @@ def upload():
 @login_required
 @admin_standard_required
 def retrieve_videos():
-    # This function would contain the logic to retrieve video lists from S3
-    # based on form data (date, camera, etc.)
-    # For now, it returns an empty list as a placeholder.
-    return jsonify({"success": True, "folders": []})
+    # Videos for the date/camera/type from the form, grouped by S3 folder
+    recorded_date = request.form.get('retrieve_date')
+    if not valid_date(recorded_date):
+        return jsonify({"success": False, "error": "Invalid date", "folders": []}), 400
+    camera = request.form.get('camera_angle') or None
+    video_type = request.form.get('video_type') or None
+    page, per_page = parse_pagination(request.form)
+
+    videos, total = video_catalog.find(recorded_date, camera=camera, video_type=video_type,
+                                       page=page, per_page=per_page)
+    folders = {}
+    for video in videos:
+        folder = folders.setdefault(video['folder'], {
+            "id": len(folders) + 1,
+            "name": video['folder'] or '/',
+            "s3_prefix": '/'.join(part for part in (S3_UPLOAD_FOLDER, video['folder']) if part),
+            "videos": []
+        })
+        folder['videos'].append(video['filename'])
+    return jsonify({"success": True, "folders": list(folders.values()),
+                    "page": page, "per_page": per_page, "total": total})
+
+@app.route('/api/videos/<date>')
+@login_required
+@admin_standard_required
+def api_videos(date):
+    if not valid_date(date):
+        return jsonify({"error": "Invalid date", "videos": []}), 400
+    camera = request.args.get('camera')
+    if camera is not None and camera not in CAMERAS:
+        return jsonify({"error": f"Unknown camera '{camera}'", "videos": []}), 400
+    page, per_page = parse_pagination(request.args)
+
+    videos, total = video_catalog.find(date, camera=camera, page=page, per_page=per_page)
+    return jsonify({"videos": [video['filename'] for video in videos], "items": videos,
+                    "page": page, "per_page": per_page, "total": total})
 
 
+def s3_camera_id(s3_key):
+    """Returns the camera an S3 video was recorded by, from its key, or None."""
+    return parse_video_key(s3_key, S3_UPLOAD_FOLDER)['camera']
+
+def lookup_cached_result(video_digest, camera_id=None):
+    """
+    Looks a video up in the result cache: identical video, weights and
+    settings (including those of `camera_id`) give the same result. The
+    weights digest is the one published by the workers, so the web host
+    does not need the weights file.
+
+    Returns:
+        tuple: (cache key or None when caching is off, cached result or None)
+    """
+    if result_cache is None:
+        return None, None
+    weights_digest = result_cache.weights_digest(app.config['YOLO_MODEL_PATH'])
+    if weights_digest is None:
+        logger.warning(f"Result cache skipped: {app.config['YOLO_MODEL_PATH']} is not on this host "
+                       f"and no worker has published its digest yet.")
+        return None, None
+    cache_key = make_cache_key(video_digest, weights_digest, extraction_settings(camera_id=camera_id))
+    return cache_key, result_cache.get(cache_key)
+
+def start_extraction(video_path, video_digest, camera_id=None):
+    """
+    Answers from the result cache or dispatches the extraction of a saved
+    video to the Celery worker. `video_path` is a local path or an
+    s3://bucket/key URI, which the worker decodes from S3 directly.
+    `camera_id` selects the camera's ROI and inference size.
+
+    Returns:
+        dict: {'success', 'task_id'} or, on a cache hit, {'success', 'cached', 'result'}
+    """
+    cache_key, cached_result = lookup_cached_result(video_digest, camera_id)
+    if cached_result is not None:
+        logger.info(f"Result cache hit for {video_path} ({video_digest[:12]}).")
+        return {'success': True, 'cached': True, 'result': cached_result}
+    
+    logger.info(f"Video saved to {video_path}, dispatching to Celery worker.")
+    
+    kwargs = {'cache_key': cache_key, 'camera_id': camera_id}
+    if app.config['PARALLEL_CHUNKS'] > 1:
+        task = celery.send_task(PROCESS_VIDEO_PARALLEL_TASK,
+                                args=[video_path, app.config['YOLO_MODEL_PATH'], app.config['PARALLEL_CHUNKS']],
+                                kwargs=kwargs)
+    else:
+        task = celery.send_task(PROCESS_VIDEO_TASK, args=[video_path, app.config['YOLO_MODEL_PATH']],
+                                kwargs=kwargs)
+    
+    return {'success': True, 'task_id': task.id}
+
+def s3_video_digest(metadata):
+    """
+    Identifies the content of an S3 video for the result cache by its ETag,
+    so the video does not have to be read to be hashed.
+    """
+    return 's3-etag:' + metadata['etag'].strip('"')
+
 @app.route('/frame_extraction', methods=['GET', 'POST'])
 @login_required
 @admin_standard_required
@@ -204,31 +317,235 @@ def frame_extraction():
         if file and allowed_file(file.filename):
             filename = secure_filename(file.filename)
             video_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(video_path)
-            
-            logger.info(f"Video saved to {video_path}, dispatching to Celery worker.")
-            
-            task = process_video_task.delay(video_path, app.config['YOLO_MODEL_PATH'])
-            
-            return jsonify({'success': True, 'task_id': task.id})
+            video_digest = save_and_hash(file.stream, video_path)
+            return jsonify(start_extraction(video_path, video_digest))
         else:
             return jsonify({'success': False, 'error': 'Invalid file type'})
     
     return render_template('frame_extraction.html', frames=None)
 
-@app.route('/task-status/<task_id>')
+@app.route('/process_s3_video', methods=['POST'])
 @login_required
-def task_status(task_id):
-    task = AsyncResult(task_id, app=process_video_task.app)
+@admin_standard_required
+def process_s3_video():
+    """Starts the extraction of a video already in S3. JSON body: s3_key."""
+    data = request.get_json(silent=True) or {}
+    s3_key = data.get('s3_key', '')
+    if not s3_key.startswith(S3_UPLOAD_FOLDER + '/') or not allowed_file(s3_key):
+        return jsonify({'success': False, 'error': 'Invalid video key'}), 400
+    metadata = get_file_metadata(S3_BUCKET, s3_key)
+    if metadata is None:
+        return jsonify({'success': False, 'error': 'Video not found'}), 404
+    return jsonify(start_extraction(make_s3_uri(S3_BUCKET, s3_key), s3_video_digest(metadata),
+                                    s3_camera_id(s3_key)))
+
+@app.route('/process_videos', methods=['POST'])
+@login_required
+@admin_standard_required
+def process_videos():
+    """
+    Starts a batch job processing many videos on the bulk queue. Takes the
+    retrieve form (s3_prefix and selected_videos[]) or a JSON body with
+    s3_keys and/or videos (files in the upload folder).
+    """
+    data = request.get_json(silent=True)
+    if data is None:
+        prefix = request.form.get('s3_prefix', '').rstrip('/')
+        s3_keys = [f"{prefix}/{name}" for name in request.form.getlist('selected_videos[]')]
+        local_videos = []
+    else:
+        s3_keys = data.get('s3_keys') or []
+        local_videos = data.get('videos') or []
+
+    videos, processed_videos = [], []
+    for s3_key in s3_keys:
+        name = s3_key.rsplit('/', 1)[-1]
+        metadata = None
+        if s3_key.startswith(S3_UPLOAD_FOLDER + '/') and allowed_file(s3_key):
+            metadata = get_file_metadata(S3_BUCKET, s3_key)
+        if metadata is None:
+            processed_videos.append({'name': name, 'status': 'not found'})
+            continue
+        camera_id = s3_camera_id(s3_key)
+        cache_key, cached_result = lookup_cached_result(s3_video_digest(metadata), camera_id)
+        videos.append({'video': make_s3_uri(S3_BUCKET, s3_key), 'cache_key': cache_key, 'camera_id': camera_id,
+                       'result': cached_result})
+        processed_videos.append({'name': name, 'status': 'cached' if cached_result is not None else 'queued'})
+    for name in local_videos:
+        video_path = os.path.join(app.config['UPLOAD_FOLDER'], secure_filename(name))
+        if not allowed_file(video_path) or not os.path.exists(video_path):
+            processed_videos.append({'name': name, 'status': 'not found'})
+            continue
+        videos.append({'video': video_path, 'cache_key': None})
+        processed_videos.append({'name': name, 'status': 'queued'})
+
+    if not videos:
+        return jsonify({'success': False, 'error': 'No videos to process',
+                        'processed_videos': processed_videos}), 400
+    job_id = batch_jobs.create(session['username'], app.config['YOLO_MODEL_PATH'], videos)
+    return jsonify({'success': True, 'job_id': job_id, 'processed_videos': processed_videos})
+
+@app.route('/batch-jobs/<job_id>')
+@login_required
+@admin_standard_required
+def batch_job_status(job_id):
+    """Aggregated progress of a batch job and the state of each of its videos."""
+    job = batch_jobs.status(job_id)
+    if job is None or job['user'] != session.get('username'):
+        return jsonify({'success': False, 'error': 'Unknown batch job'}), 404
+    return jsonify(dict(job, success=True))
+
+# --- Resumable chunked uploads ---
+@app.errorhandler(UploadError)
+def handle_upload_error(e):
+    response = {'success': False, 'error': str(e)}
+    if e.offset is not None:
+        response['offset'] = e.offset
+    return jsonify(response), e.status
+
+def get_own_upload(upload_id):
+    """Returns an upload session of the logged-in user; other users' uploads are reported as unknown."""
+    upload = chunked_uploads.get(upload_id)
+    if upload is None or upload['metadata'].get('user') != session.get('username'):
+        raise UploadError("Unknown or expired upload", status=404)
+    return upload
+
+@app.route('/uploads', methods=['POST'])
+@login_required
+def create_upload():
+    """
+    Starts a resumable upload. JSON body: filename, size, optional target
+    ('local' or 's3'), folder ('<date>' or '<date>/<camera>_<type>') and
+    process (start the extraction when complete; by default only for the
+    local target). S3 uploaders may only upload to S3 without processing;
+    the upload folder and extractions are for standard users, as with
+    /frame_extraction.
+    """
+    data = request.get_json(silent=True) or {}
+    filename = data.get('filename', '')
+    if not allowed_file(filename):
+        return jsonify({'success': False, 'error': 'Invalid file type'}), 400
+    try:
+        size = int(data.get('size', 0))
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'error': 'Invalid size'}), 400
+    folder = (data.get('folder') or '').strip('/')
+    if folder and not UPLOAD_SUBFOLDER_PATTERN.match(folder):
+        return jsonify({'success': False, 'error': 'Invalid folder'}), 400
+
+    extension = filename.rsplit('.', 1)[1].lower()
+    target = data.get('target', 'local')
+    process = bool(data.get('process', target == 'local'))
+    if (target == 'local' or process) and session.get('role') == 's3_uploader':
+        return jsonify({'success': False, 'error': 'Only standard users can upload for processing'}), 403
+    upload = chunked_uploads.create(filename, size, target=target,
+                                    folder=folder, content_type=f'video/{extension}',
+                                    metadata={'process': process, 'user': session['username']})
+    return jsonify({'success': True, 'upload_id': upload['upload_id'], 'offset': 0,
+                    'chunk_size': UPLOAD_CHUNK_SIZE}), 201
+
+@app.route('/uploads/<upload_id>', methods=['GET'])
+@login_required
+def upload_status(upload_id):
+    upload = get_own_upload(upload_id)
+    return jsonify({'success': True, 'upload_id': upload_id, 'offset': upload['offset'],
+                    'size': upload['size'], 'status': upload['status']})
+
+@app.route('/uploads/<upload_id>', methods=['PUT'])
+@login_required
+def upload_chunk(upload_id):
+    """Receives one chunk as the raw request body, at ?offset= (the current offset)."""
+    offset = request.args.get('offset', type=int)
+    if offset is None:
+        return jsonify({'success': False, 'error': 'Missing offset'}), 400
+    get_own_upload(upload_id)
+    new_offset = chunked_uploads.write_chunk(upload_id, offset, request.stream, request.content_length)
+    return jsonify({'success': True, 'offset': new_offset})
+
+@app.route('/uploads/<upload_id>/complete', methods=['POST'])
+@login_required
+def complete_upload(upload_id):
+    if get_own_upload(upload_id)['metadata'].get('process') and session.get('role') == 's3_uploader':
+        return jsonify({'success': False, 'error': 'Only standard users can upload for processing'}), 403
+    upload = chunked_uploads.complete(upload_id)
+    if upload['target'] == 's3':
+        if not upload['metadata'].get('process'):
+            return jsonify({'success': True, 's3_key': upload['s3_key']})
+        metadata = get_file_metadata(upload['bucket'], upload['s3_key'])
+        if metadata is None:
+            return jsonify({'success': False, 'error': 'Uploaded video not found'}), 502
+        response = start_extraction(make_s3_uri(upload['bucket'], upload['s3_key']), s3_video_digest(metadata),
+                                    s3_camera_id(upload['s3_key']))
+        return jsonify(dict(response, s3_key=upload['s3_key']))
+    if not upload['metadata'].get('process'):
+        return jsonify({'success': True, 'path': upload['path']})
+    # Hashing reads the finished file once; it is never copied.
+    return jsonify(start_extraction(upload['path'], file_sha256(upload['path'])))
+
+@app.route('/uploads/<upload_id>', methods=['DELETE'])
+@login_required
+def abort_upload(upload_id):
+    get_own_upload(upload_id)
+    chunked_uploads.abort(upload_id)
+    return jsonify({'success': True})
+
+def get_task_status(task):
     if task.state == 'PENDING':
         response = {'state': task.state, 'status': 'Pending...', 'progress': 0}
     elif task.state != 'FAILURE':
-        response = {'state': task.state, 'status': task.info.get('status', ''), 'progress': task.info.get('progress', 0)}
+        info = task.info if isinstance(task.info, dict) else {}
+        response = {'state': task.state, 'status': info.get('status', ''), 'progress': info.get('progress', 0)}
         if task.state == 'SUCCESS':
+            response['progress'] = 100
             response['result'] = task.result
     else:
         response = {'state': task.state, 'status': str(task.info), 'error': True}
-    return jsonify(response)
+    return response
+
+@app.route('/task-status/<task_id>')
+@login_required
+def task_status(task_id):
+    task = AsyncResult(task_id, app=celery)
+    return jsonify(get_task_status(task))
+
+@app.route('/task-events/<task_id>')
+@login_required
+def task_events(task_id):
+    """
+    Streams the progress of a task as Server-Sent Events, relayed from the
+    worker through Redis pub/sub. The final result is sent once and the
+    stream then ends.
+    """
+    keepalive = app.config['TASK_STREAM_KEEPALIVE']
+    timeout = app.config['TASK_STREAM_TIMEOUT']
+
+    def event_stream():
+        # Subscribe before reading the current state so no update is missed.
+        pubsub = subscribe(task_id)
+        try:
+            task = AsyncResult(task_id, app=celery)
+            if task.ready():
+                yield f"data: {json.dumps(get_task_status(task))}\n\n"
+                return
+            last_event = get_last_event(task_id)
+            if last_event is not None:
+                yield f"data: {json.dumps(last_event)}\n\n"
+
+            deadline = time.time() + timeout
+            while time.time() < deadline:
+                message = pubsub.get_message(timeout=keepalive)
+                if message is None:
+                    yield ": keep-alive\n\n"
+                    continue
+                data = message['data'].decode()
+                yield f"data: {data}\n\n"
+                if json.loads(data).get('state') in FINAL_STATES:
+                    return
+        finally:
+            pubsub.close()
+
+    return Response(stream_with_context(event_stream()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @app.route('/damage_detection', methods=['GET', 'POST'])
 @login_required
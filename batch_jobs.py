@@ -0,0 +1,224 @@
+"""
+Batch extraction jobs.
+
+A batch job processes many videos, typically a day's recordings picked from
+the S3 catalog, as one parent job with one child process_video_task per video.
+Children are sent to the bulk queue, so they never hold up the interactive
+single-video extractions on the interactive queue (see celery_app).
+
+Each user has at most BATCH_USER_CONCURRENCY children queued or running at a
+time. The remaining videos wait in the job's pending list in Redis and are
+sent as earlier children finish, taking turns between the user's jobs. A big
+batch therefore neither floods the bulk queue nor delays another user's batch
+by more than a few videos.
+
+Slots are leases: the slot of a child whose worker died is freed after
+BATCH_SLOT_LEASE seconds, and the next status request sends the video that
+was waiting for it.
+"""
+
+import json
+import logging
+import os
+import time
+import uuid
+
+import redis
+
+from celery_app import PROCESS_VIDEO_TASK
+from task_events import get_last_event
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+BATCH_USER_CONCURRENCY = int(os.getenv('BATCH_USER_CONCURRENCY', 2))
+# Longest a child may hold its slot; must exceed the longest extraction.
+BATCH_SLOT_LEASE = int(os.getenv('BATCH_SLOT_LEASE', 4 * 3600))
+BATCH_JOB_TTL = int(os.getenv('BATCH_JOB_TTL', 7 * 24 * 3600))
+
+# Drops expired leases and takes a slot if fewer than ARGV[2] are held.
+_ACQUIRE_SLOT = """
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+if redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[2]) then
+    return 0
+end
+redis.call('ZADD', KEYS[1], ARGV[3], ARGV[4])
+return 1
+"""
+
+
+def _job_key(job_id):
+    return f"wagon:batch:{job_id}"
+
+
+def _slots_key(user):
+    return f"wagon:batch:user:{user}:slots"
+
+
+def _user_jobs_key(user):
+    return f"wagon:batch:user:{user}:jobs"
+
+
+class BatchJobs:
+    """Creates batch jobs, feeds their children to the bulk queue and reports their progress."""
+
+    def __init__(self, celery_app, queue, redis_url=REDIS_URL, user_concurrency=BATCH_USER_CONCURRENCY):
+        self.celery_app = celery_app
+        self.queue = queue
+        self.user_concurrency = user_concurrency
+        self._redis = redis.Redis.from_url(redis_url, socket_timeout=5, socket_connect_timeout=2)
+        self._acquire_slot = self._redis.register_script(_ACQUIRE_SLOT)
+
+    def create(self, user, model_path, videos):
+        """
+        Creates a job and sends the first children.
+
+        Args:
+            user: User the job counts against
+            model_path: Model weights passed to every child
+            videos: List of dicts with 'video' (local path or s3:// URI),
+                'cache_key', optionally 'camera_id' and, for videos answered
+                from the result cache, 'result'
+
+        Returns:
+            str: The job id
+        """
+        job_id = uuid.uuid4().hex
+        key = _job_key(job_id)
+        children = {}
+        pending = []
+        for item in videos:
+            if item['video'] in children:
+                continue
+            if item.get('result') is not None:
+                children[item['video']] = {'state': 'SUCCESS', 'cached': True,
+                                           'count': item['result'].get('count', 0)}
+            else:
+                children[item['video']] = {'state': 'QUEUED'}
+                pending.append(json.dumps({'video': item['video'], 'cache_key': item.get('cache_key'),
+                                           'camera_id': item.get('camera_id')}))
+        cached = len(children) - len(pending)
+
+        with self._redis.pipeline() as pipe:
+            pipe.hset(key, mapping={'user': user, 'model_path': model_path, 'total': len(children),
+                                    'completed': cached, 'failed': 0, 'created_at': time.time()})
+            pipe.hset(key + ':children', mapping={video: json.dumps(child) for video, child in children.items()})
+            if pending:
+                pipe.rpush(key + ':pending', *pending)
+                pipe.rpush(_user_jobs_key(user), job_id)
+            for suffix in ('', ':children', ':pending'):
+                pipe.expire(key + suffix, BATCH_JOB_TTL)
+            pipe.execute()
+
+        logger.info(f"Created batch job {job_id} for {user}: {len(children)} videos, {cached} cached")
+        self.dispatch(user)
+        return job_id
+
+    def dispatch(self, user):
+        """
+        Sends pending children of the user's jobs while the user has free
+        slots, one job after the other.
+
+        Returns:
+            int: Number of children sent
+        """
+        sent = 0
+        jobs_key = _user_jobs_key(user)
+        while self._redis.llen(jobs_key):
+            task_id = str(uuid.uuid4())
+            if not self._acquire_slot(keys=[_slots_key(user)],
+                                      args=[time.time(), self.user_concurrency,
+                                            time.time() + BATCH_SLOT_LEASE, task_id]):
+                break
+            # Rotating the list gives every job of the user its turn.
+            job_id = self._redis.rpoplpush(jobs_key, jobs_key)
+            payload = self._redis.lpop(_job_key(job_id.decode()) + ':pending') if job_id else None
+            if payload is None:
+                # Nothing left to send for this job
+                self._redis.zrem(_slots_key(user), task_id)
+                if job_id:
+                    self._redis.lrem(jobs_key, 0, job_id)
+                continue
+            self._send(job_id.decode(), task_id, json.loads(payload))
+            sent += 1
+        return sent
+
+    def child_finished(self, job_id, task_id, video, result=None, error=None):
+        """Records the outcome of a child, frees its slot and sends the next pending child."""
+        key = _job_key(job_id)
+        child = {'state': 'FAILURE' if error else 'SUCCESS', 'task_id': task_id}
+        if error:
+            child['error'] = error
+        else:
+            child['count'] = (result or {}).get('count', 0)
+        try:
+            user = self._redis.hget(key, 'user')
+            if user is None:
+                logger.warning(f"Child {task_id} finished for unknown batch job {job_id}")
+                return
+            user = user.decode()
+            with self._redis.pipeline() as pipe:
+                pipe.zrem(_slots_key(user), task_id)
+                pipe.hset(key + ':children', video, json.dumps(child))
+                pipe.hincrby(key, 'failed' if error else 'completed', 1)
+                pipe.execute()
+            self.dispatch(user)
+        except redis.RedisError as e:
+            # The slot lease runs out and the next status request resumes the job.
+            logger.error(f"Could not record child {task_id} of batch job {job_id}: {e}")
+
+    def status(self, job_id):
+        """
+        Returns the aggregated progress of a job, or None if it is unknown.
+        Also sends pending children whose slots were freed by expired leases.
+        """
+        key = _job_key(job_id)
+        job = {name.decode(): value.decode() for name, value in self._redis.hgetall(key).items()}
+        if not job:
+            return None
+        self.dispatch(job['user'])
+
+        children = []
+        running_progress = 0.0
+        for video, payload in self._redis.hgetall(key + ':children').items():
+            child = json.loads(payload)
+            child['video'] = video.decode()
+            if child['state'] == 'QUEUED' and child.get('task_id'):
+                event = get_last_event(child['task_id'])
+                if event is not None:
+                    child['state'] = 'PROGRESS'
+                    child['progress'] = event.get('progress', 0)
+                    running_progress += child['progress'] / 100
+            children.append(child)
+        children.sort(key=lambda child: child['video'])
+
+        total = int(job['total'])
+        completed = int(job['completed'])
+        failed = int(job['failed'])
+        finished = completed + failed
+        progress = 100 if total == 0 else round(100 * (finished + running_progress) / total)
+        return {
+            'job_id': job_id,
+            'user': job['user'],
+            'state': 'SUCCESS' if finished >= total else 'PROGRESS',
+            'total': total,
+            'completed': completed,
+            'failed': failed,
+            'pending': self._redis.llen(key + ':pending'),
+            'running': sum(1 for child in children if child['state'] == 'PROGRESS'),
+            'progress': progress,
+            'status': f"{finished} of {total} videos processed" + (f", {failed} failed" if failed else ''),
+            'children': children,
+        }
+
+    def _send(self, job_id, task_id, item):
+        key = _job_key(job_id)
+        model_path = self._redis.hget(key, 'model_path').decode()
+        self._redis.hset(key + ':children', item['video'], json.dumps({'state': 'QUEUED', 'task_id': task_id}))
+        self.celery_app.send_task(PROCESS_VIDEO_TASK, args=[item['video'], model_path],
+                                  kwargs={'cache_key': item['cache_key'], 'camera_id': item.get('camera_id'),
+                                          'batch_id': job_id},
+                                  task_id=task_id, queue=self.queue)
+        logger.info(f"Sent {item['video']} of batch job {job_id} to the {self.queue} queue as {task_id}")
@@ -0,0 +1,175 @@
+"""
+Decode-only throughput of the video decoders (see video_decoders).
+
+Encodes synthetic H.264 and H.265 clips at 1080p and 4K with PyAV, or takes
+real camera recordings given with --videos, and decodes every clip with:
+
+- opencv read / grab: cv2.VideoCapture, converting every frame to BGR or
+  only advancing past it;
+- pyav read (1 thread) / read / grab: PyAV with a single decoding thread,
+  with FFmpeg's frame and slice threads, and advancing without conversion;
+- opencv / pyav read x0.5: frames downscaled to half size, by cv2.resize
+  after the BGR conversion and in YUV before it respectively.
+
+Grab is what the extractor does for frames skipped by the search stride.
+The script also reports how long an exact seek to the middle of the clip
+takes, and the throughput of whole extractions (with a model that finds
+nothing, so every stride window is skipped) per decoder:
+
+- extract defaults: the worker configuration from extraction_config;
+- extract stride N sequential: search stride N without pipelining, where
+  skipped frames are grabbed without conversion;
+- extract stride N pipelined: the same with the decoder thread, which
+  converts every frame.
+
+Usage:
+    python benchmarks/bench_decoders.py [--frames 150] [--codecs h264 hevc] [--videos rec1.mp4 ...]
+                                        [--search-stride 8]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import extraction_config as config
+from video_decoders import open_video
+
+RESOLUTIONS = {'1080p': (1920, 1080), '4K': (3840, 2160)}
+ENCODERS = {'h264': 'libx264', 'hevc': 'libx265'}
+
+MODES = {
+    'opencv read': ('opencv', 'read', 0, 1.0),
+    'opencv grab': ('opencv', 'grab', 0, 1.0),
+    'opencv read x0.5': ('opencv', 'read', 0, 0.5),
+    'pyav read (1 thread)': ('pyav', 'read', 1, 1.0),
+    'pyav read': ('pyav', 'read', 0, 1.0),
+    'pyav grab': ('pyav', 'grab', 0, 1.0),
+    'pyav read x0.5': ('pyav', 'read', 0, 0.5),
+}
+
+
+def make_clip(path, codec, size, frame_count, fps=25, gop=50):
+    import av
+
+    width, height = size
+    with av.open(path, 'w') as container:
+        stream = container.add_stream(ENCODERS[codec], rate=fps)
+        stream.width, stream.height, stream.pix_fmt = width, height, 'yuv420p'
+        stream.options = {'g': str(gop), 'preset': 'ultrafast', 'crf': '23'}
+        if codec == 'hevc':
+            stream.options['x265-params'] = 'log-level=error'
+        frame = np.zeros((height, width, 3), dtype=np.uint8)
+        for i in range(frame_count):
+            frame[:] = (i * 3) % 255
+            x = i * width // 100 % width
+            frame[height // 4:height * 3 // 4, x:x + width // 3] = (40, 80, 200)
+            for packet in stream.encode(av.VideoFrame.from_ndarray(frame, format='bgr24')):
+                container.mux(packet)
+        for packet in stream.encode():
+            container.mux(packet)
+
+
+class _NoDetections:
+    boxes = []
+
+
+class NullModel:
+    """Stands in for YOLO so the extraction numbers reflect decoding."""
+
+    def __call__(self, frames, **kwargs):
+        return [_NoDetections() for _ in frames]
+
+
+def extraction_settings(decoder, **overrides):
+    """The extractor arguments of the worker defaults, with `overrides`."""
+    settings = {
+        'batch_size': config.YOLO_BATCH_SIZE,
+        'pipelined': config.PIPELINED_EXTRACTION,
+        'queue_size': config.PIPELINE_QUEUE_SIZE,
+        'search_stride': config.SEARCH_STRIDE,
+        'reuse_frame_buffers': config.REUSE_FRAME_BUFFERS,
+        'decoder': decoder,
+        'decoder_threads': config.DECODER_THREADS,
+        'decode_scale': config.DECODE_SCALE,
+    }
+    settings.update(overrides)
+    return settings
+
+
+def extract_fps(path, decoder, **overrides):
+    from frame_extractor import extract_and_annotate_wagons
+
+    start = time.perf_counter()
+    _, _, stats = extract_and_annotate_wagons(path, None, NullModel(), **extraction_settings(decoder, **overrides))
+    elapsed = time.perf_counter() - start
+    return stats['frames_processed'] / elapsed if elapsed > 0 else 0.0, stats['frames_grabbed']
+
+
+def decode_fps(path, decoder, method, threads, scale):
+    video = open_video(path, decoder, scale=scale, threads=threads)
+    frames = 0
+    start = time.perf_counter()
+    if method == 'grab':
+        while video.grab():
+            frames += 1
+    else:
+        while video.read()[0]:
+            frames += 1
+    elapsed = time.perf_counter() - start
+    video.release()
+    return frames / elapsed if elapsed > 0 else 0.0
+
+
+def seek_ms(path, decoder):
+    video = open_video(path, decoder)
+    start = time.perf_counter()
+    video.seek(video.frame_count // 2)
+    video.read()
+    elapsed = time.perf_counter() - start
+    video.release()
+    return elapsed * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--frames', type=int, default=150)
+    parser.add_argument('--codecs', nargs='+', default=list(ENCODERS), choices=list(ENCODERS))
+    parser.add_argument('--resolutions', nargs='+', default=list(RESOLUTIONS), choices=list(RESOLUTIONS))
+    parser.add_argument('--videos', nargs='+', help='Decode these recordings instead of synthetic clips')
+    parser.add_argument('--search-stride', type=int, default=8, help='Search stride of the extraction runs')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        clips = [(os.path.basename(path), path) for path in args.videos or []]
+        if not clips:
+            for codec in args.codecs:
+                for label in args.resolutions:
+                    path = os.path.join(workdir, f'{codec}_{label}.mp4')
+                    make_clip(path, codec, RESOLUTIONS[label], args.frames)
+                    clips.append((f'{codec} {label}', path))
+
+        stride = args.search_stride
+        print(f"{'clip':<20}{'mode':<36}{'fps':>10}{'grabbed':>10}")
+        for clip, path in clips:
+            for mode, (decoder, method, threads, scale) in MODES.items():
+                print(f"{clip:<20}{mode:<36}{decode_fps(path, decoder, method, threads, scale):>10.1f}")
+            for decoder in ('opencv', 'pyav'):
+                print(f"{clip:<20}{decoder + ' seek to middle':<36}{seek_ms(path, decoder):>8.1f}ms")
+            for decoder in ('opencv', 'pyav'):
+                for mode, overrides in ((f'{decoder} extract defaults', {}),
+                                        (f'{decoder} extract stride {stride} sequential',
+                                         {'search_stride': stride, 'pipelined': False}),
+                                        (f'{decoder} extract stride {stride} pipelined',
+                                         {'search_stride': stride, 'pipelined': True})):
+                    fps, grabbed = extract_fps(path, decoder, **overrides)
+                    print(f"{clip:<20}{mode:<36}{fps:>10.1f}{grabbed:>10}")
+
+
+if __name__ == '__main__':
+    main()
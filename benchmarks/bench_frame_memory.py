@@ -0,0 +1,130 @@
+"""
+Memory/throughput benchmark for the frame handling in extract_and_annotate_wagons.
+
+Generates synthetic 1080p and 4K clips and runs the extractor on each of them
+with per-frame allocation and with the preallocated frame ring
+(`reuse_frame_buffers=True`). A stub model that returns no detections is used
+so the numbers reflect decoding, buffering and encoding only; `--inference-ms`
+makes it sleep per frame like a model running on another device. Every run
+happens in a fresh process so peak RSS is measured independently.
+
+With `--baseline REV` the frame_extractor.py of git revision REV (e.g. the
+commit before the extractor changes) runs on the same clips first, so every
+mode is compared against the original extractor. It processes one frame at a
+time and always writes the annotated video.
+
+Usage:
+    python benchmarks/bench_frame_memory.py [--frames 300] [--batch-size 8] [--pipelined] [--no-video]
+                                            [--inference-ms 0] [--baseline REV]
+"""
+
+import argparse
+import importlib
+import multiprocessing
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+RESOLUTIONS = {'1080p': (1920, 1080), '4K': (3840, 2160)}
+
+
+class _NoDetections:
+    boxes = []
+
+
+class NullModel:
+    """Stands in for YOLO so inference cost does not hide allocation cost."""
+
+    def __init__(self, inference_ms=0.0):
+        self.inference_ms = inference_ms
+
+    def __call__(self, frames, **kwargs):
+        frames = frames if isinstance(frames, list) else [frames]
+        if self.inference_ms:
+            time.sleep(self.inference_ms * len(frames) / 1000)
+        return [_NoDetections() for _ in frames]
+
+
+def make_clip(path, size, frame_count, fps=25):
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, size)
+    frame = np.zeros((size[1], size[0], 3), dtype=np.uint8)
+    for i in range(frame_count):
+        frame[:] = (i * 3) % 255
+        cv2.rectangle(frame, (i * 8 % size[0], 100), (i * 8 % size[0] + 400, 600), (0, 255, 0), -1)
+        writer.write(frame)
+    writer.release()
+
+
+def export_baseline(revision, directory):
+    """Writes frame_extractor.py of `revision` to `directory` as baseline_frame_extractor.py."""
+    source = subprocess.run(['git', 'show', f'{revision}:frame_extractor.py'], cwd=ROOT,
+                            capture_output=True, check=True).stdout
+    with open(os.path.join(directory, 'baseline_frame_extractor.py'), 'wb') as f:
+        f.write(source)
+
+
+def _run(module_name, video_path, output_path, inference_ms, kwargs, results):
+    sys.path.insert(0, os.path.dirname(video_path))
+    extractor = importlib.import_module(module_name)
+
+    start = time.perf_counter()
+    outcome = extractor.extract_and_annotate_wagons(video_path, output_path, NullModel(inference_ms), **kwargs)
+    elapsed = time.perf_counter() - start
+    # The original extractor returns no stats
+    frames = outcome[2]['frames_processed'] if len(outcome) > 2 else int(
+        cv2.VideoCapture(video_path).get(cv2.CAP_PROP_FRAME_COUNT))
+    peak_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results.put((frames / elapsed, peak_rss_kb / 1024))
+
+
+def measure(module_name, video_path, output_path, inference_ms, **kwargs):
+    results = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_run,
+                                      args=(module_name, video_path, output_path, inference_ms, kwargs, results))
+    process.start()
+    fps, peak_rss_mb = results.get()
+    process.join()
+    return fps, peak_rss_mb
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--frames', type=int, default=300)
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--pipelined', action='store_true')
+    parser.add_argument('--no-video', action='store_true', help='Do not write the annotated video')
+    parser.add_argument('--inference-ms', type=float, default=0.0, help='Simulated inference time per frame')
+    parser.add_argument('--baseline', metavar='REV', help='Git revision of the extractor to compare against')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        output_path = os.path.join(workdir, 'annotated.mp4')
+        if args.baseline:
+            export_baseline(args.baseline, workdir)
+
+        print(f"{'input':<8}{'mode':<22}{'fps':>10}{'peak RSS (MB)':>16}")
+        for label, size in RESOLUTIONS.items():
+            video_path = os.path.join(workdir, f'{label}.mp4')
+            make_clip(video_path, size, args.frames)
+            if args.baseline:
+                fps, peak_rss_mb = measure('baseline_frame_extractor', video_path, output_path, args.inference_ms)
+                print(f"{label:<8}{'baseline ' + args.baseline:<22}{fps:>10.1f}{peak_rss_mb:>16.1f}")
+            for mode, reuse in (('per-frame alloc', False), ('frame ring', True)):
+                fps, peak_rss_mb = measure('frame_extractor', video_path,
+                                           None if args.no_video else output_path, args.inference_ms,
+                                           batch_size=args.batch_size, pipelined=args.pipelined,
+                                           reuse_frame_buffers=reuse)
+                print(f"{label:<8}{mode:<22}{fps:>10.1f}{peak_rss_mb:>16.1f}")
+
+
+if __name__ == '__main__':
+    main()
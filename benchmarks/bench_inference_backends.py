@@ -0,0 +1,104 @@
+"""
+Compares the inference backends in inference_backends.py on real footage.
+
+Frames are sampled from a recording and run through every backend at a few
+batch sizes. The script reports throughput and checks that the wagon boxes of
+each backend agree with native PyTorch: the same number of wagons per frame,
+each matched to a torch box with IoU >= --iou.
+
+Usage:
+    python benchmarks/bench_inference_backends.py --video uploads/train.mp4 \
+        [--weights models/best_weights.pt] [--frames 200] [--batch-sizes 1 8]
+"""
+
+import argparse
+import importlib.util
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from frame_extractor import detect_wagon_boxes  # noqa: E402
+from inference_backends import BACKENDS, BACKEND_REQUIREMENTS, load_model, warm_up  # noqa: E402
+
+CONFIDENCE_THRESHOLD = 0.6
+WAGON_CLASS_ID = 1
+
+
+def sample_frames(video_path, frame_count):
+    cap = cv2.VideoCapture(video_path)
+    total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) or frame_count
+    step = max(1, total // frame_count)
+    frames = []
+    for index in range(0, total, step):
+        cap.set(cv2.CAP_PROP_POS_FRAMES, index)
+        ret, frame = cap.read()
+        if not ret or len(frames) == frame_count:
+            break
+        frames.append(frame)
+    cap.release()
+    return frames
+
+
+def iou(a, b):
+    x1, y1 = max(a[0], b[0]), max(a[1], b[1])
+    x2, y2 = min(a[2], b[2]), min(a[3], b[3])
+    intersection = max(0.0, x2 - x1) * max(0.0, y2 - y1)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - intersection
+    return intersection / union if union > 0 else 0.0
+
+
+def frames_agree(reference_boxes, candidate_boxes, iou_threshold):
+    if len(reference_boxes) != len(candidate_boxes):
+        return False
+    return all(max((iou(box, other) for other in reference_boxes), default=0.0) >= iou_threshold
+               for box in candidate_boxes)
+
+
+def run(model, frames, batch_size):
+    start = time.perf_counter()
+    boxes = []
+    for i in range(0, len(frames), batch_size):
+        boxes.extend(detect_wagon_boxes(model, frames[i:i + batch_size], WAGON_CLASS_ID, CONFIDENCE_THRESHOLD))
+    return boxes, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--video', required=True)
+    parser.add_argument('--weights', default='models/best_weights.pt')
+    parser.add_argument('--frames', type=int, default=200)
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 8])
+    parser.add_argument('--imgsz', type=int, default=640)
+    parser.add_argument('--iou', type=float, default=0.9)
+    args = parser.parse_args()
+
+    frames = sample_frames(args.video, args.frames)
+    print(f"{len(frames)} frames from {args.video}")
+
+    reference = None
+    print(f"{'backend':<10}{'batch':>6}{'warm-up (s)':>13}{'ms/frame':>10}{'fps':>8}{'agreement':>11}")
+    for backend in BACKENDS:
+        if backend in BACKEND_REQUIREMENTS and importlib.util.find_spec(BACKEND_REQUIREMENTS[backend]) is None:
+            print(f"{backend:<10}  skipped (not installed)")
+            continue
+        model = load_model(args.weights, backend, imgsz=args.imgsz)
+        for batch_size in args.batch_sizes:
+            start = time.perf_counter()
+            warm_up(model, imgsz=args.imgsz, batch_size=batch_size)
+            warm_up_seconds = time.perf_counter() - start
+
+            boxes, elapsed = run(model, frames, batch_size)
+            if reference is None:
+                reference = boxes
+            agreement = np.mean([frames_agree(ref, got, args.iou) for ref, got in zip(reference, boxes)])
+            print(f"{backend:<10}{batch_size:>6}{warm_up_seconds:>13.2f}{1000 * elapsed / len(frames):>10.1f}"
+                  f"{len(frames) / elapsed:>8.1f}{agreement:>10.1%}")
+
+
+if __name__ == '__main__':
+    main()
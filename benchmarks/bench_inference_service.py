@@ -0,0 +1,123 @@
+"""
+Node throughput with per-process models and with the micro-batching inference service.
+
+N jobs run at the same time, each in its own fresh process, like N
+extractions on one node. Every job runs `--frames` frames through
+frame_extractor.detect_wagon_boxes in requests of `--request-size` frames.
+With 'per-process' each job loads its own model and gets cpu_count / N
+threads. With 'service' the jobs are clients of one inference_service
+process, which batches the frames of all jobs together.
+
+The script reports the aggregate frames/sec and the median and 95th
+percentile latency of a request.
+
+Run from the repository root, so models/best_weights.pt is found:
+
+Usage:
+    python benchmarks/bench_inference_service.py [--concurrency 1 2 4] [--frames 128] [--request-size 1]
+"""
+
+import argparse
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def _job(mode, concurrency, args, socket_path, barrier, results):
+    os.chdir(ROOT)
+    from extraction_config import INFERENCE_BACKEND, INFERENCE_IMGSZ
+    from frame_extractor import detect_wagon_boxes
+    from inference_backends import load_model, warm_up
+    from inference_service import InferenceClient
+
+    frames = [np.zeros((args.height, args.width, 3), dtype=np.uint8) for _ in range(args.request_size)]
+    if mode == 'service':
+        model = InferenceClient(socket_path)
+    else:
+        import torch
+
+        torch.set_num_threads(max(1, (os.cpu_count() or 1) // concurrency))
+        model = load_model(args.model, INFERENCE_BACKEND, imgsz=INFERENCE_IMGSZ)
+        warm_up(model, imgsz=INFERENCE_IMGSZ, batch_size=args.request_size)
+    detect_wagon_boxes(model, frames, 1, 0.6, imgsz=INFERENCE_IMGSZ)
+
+    barrier.wait()
+    latencies = []
+    started_at = time.perf_counter()
+    for _ in range(max(1, args.frames // args.request_size)):
+        start = time.perf_counter()
+        detect_wagon_boxes(model, frames, 1, 0.6, imgsz=INFERENCE_IMGSZ)
+        latencies.append(time.perf_counter() - start)
+    results.put((started_at, time.perf_counter(), latencies))
+
+
+def start_service(args, socket_path):
+    service = subprocess.Popen([sys.executable, os.path.join(ROOT, 'inference_service.py'),
+                                '--socket', socket_path, '--model', args.model,
+                                '--max-batch-size', str(args.max_batch_size),
+                                '--max-wait-ms', str(args.max_wait_ms)], cwd=ROOT)
+    # The socket appears once the model is loaded and warmed up.
+    while not os.path.exists(socket_path):
+        if service.poll() is not None:
+            raise RuntimeError("The inference service exited during start-up")
+        time.sleep(0.1)
+    return service
+
+
+def measure(mode, concurrency, args, socket_path):
+    context = multiprocessing.get_context('spawn')
+    barrier = context.Barrier(concurrency)
+    results = context.Queue()
+    jobs = [context.Process(target=_job, args=(mode, concurrency, args, socket_path, barrier, results))
+            for _ in range(concurrency)]
+    for job in jobs:
+        job.start()
+    measurements = [results.get() for _ in jobs]
+    for job in jobs:
+        job.join()
+
+    wall = max(end for _, end, _ in measurements) - min(start for start, _, _ in measurements)
+    latencies = np.concatenate([latencies for _, _, latencies in measurements]) * 1000
+    total_frames = concurrency * max(1, args.frames // args.request_size) * args.request_size
+    return total_frames / wall, np.percentile(latencies, 50), np.percentile(latencies, 95)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--frames', type=int, default=128, help='Frames per job')
+    parser.add_argument('--request-size', type=int, default=1, help='Frames per request of a job')
+    parser.add_argument('--width', type=int, default=1280)
+    parser.add_argument('--height', type=int, default=720)
+    parser.add_argument('--model', default='models/best_weights.pt')
+    parser.add_argument('--max-batch-size', type=int, default=16)
+    parser.add_argument('--max-wait-ms', type=float, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        socket_path = os.path.join(workdir, 'inference.sock')
+        rows = [('per-process', concurrency, measure('per-process', concurrency, args, socket_path))
+                for concurrency in args.concurrency]
+        service = start_service(args, socket_path)
+        try:
+            rows += [('service', concurrency, measure('service', concurrency, args, socket_path))
+                     for concurrency in args.concurrency]
+        finally:
+            service.terminate()
+            service.wait()
+
+    print(f"{'mode':<14}{'jobs':>6}{'frames/sec':>12}{'p50 ms':>10}{'p95 ms':>10}")
+    for mode, concurrency, (fps, p50, p95) in rows:
+        print(f"{mode:<14}{concurrency:>6}{fps:>12.1f}{p50:>10.1f}{p95:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+"""
+Inference saved by the motion gate on recordings with idle stretches.
+
+Generates a synthetic trackside clip: a static, slightly noisy scene with
+stretches of empty track between trains of wagons passing the camera. The
+extractor runs on it with the motion gate off and at several thresholds
+(`motion_threshold`). A stand-in detector finds the wagons by their colour
+and sleeps for a fixed time per frame, like a CPU-bound YOLO call, so the
+wall time follows the number of frames sent to the model.
+
+For every run the script reports the wagons captured, which must match the
+ungated run, the frames inferred, the fraction gated out, the time spent in
+the gate itself and the throughput.
+
+Usage:
+    python benchmarks/bench_motion_gate.py [--idle-seconds 60] [--trains 3] [--model-ms 30]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+WAGON_COLOR = (180, 70, 30)
+WAGON_CLASS_ID = 1
+
+
+class _Value:
+    def __init__(self, value):
+        self.value = value
+
+    def item(self):
+        return self.value
+
+
+class _Coords:
+    def __init__(self, coords):
+        self.coords = np.array([coords], dtype=np.float32)
+
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return self.coords
+
+
+class _Box:
+    def __init__(self, x1, y1, x2, y2):
+        self.conf = _Value(0.9)
+        self.cls = _Value(WAGON_CLASS_ID)
+        self.xyxy = _Coords([x1, y1, x2, y2])
+
+
+class _Result:
+    def __init__(self, boxes):
+        self.boxes = boxes
+
+
+class ColorModel:
+    """Detects the synthetic wagons by colour, taking `seconds_per_frame` per frame."""
+
+    def __init__(self, seconds_per_frame):
+        self.seconds_per_frame = seconds_per_frame
+
+    def __call__(self, frames, **kwargs):
+        time.sleep(self.seconds_per_frame * len(frames))
+        return [_Result(self._detect(frame)) for frame in frames]
+
+    @staticmethod
+    def _detect(frame):
+        mask = cv2.inRange(frame, np.array(WAGON_COLOR) - 40, np.array(WAGON_COLOR) + 40)
+        columns = np.flatnonzero(mask.sum(axis=0) > mask.shape[0] * 0.2 * 255)
+        if columns.size == 0:
+            return []
+        # Runs of consecutive wagon columns are separate wagons
+        splits = np.flatnonzero(np.diff(columns) > 1) + 1
+        return [_Box(run[0], 0, run[-1] + 1, frame.shape[0]) for run in np.split(columns, splits)]
+
+
+def make_clip(path, size, fps, idle_seconds, trains, wagons_per_train):
+    """Writes idle track, then a passing train, `trains` times, then idle track again."""
+    width, height = size
+    rng = np.random.default_rng(0)
+    background = cv2.GaussianBlur(rng.integers(60, 160, (height, width, 3), dtype=np.uint8), (15, 15), 0)
+    cv2.line(background, (0, height * 3 // 4), (width, height * 3 // 4), (90, 90, 90), 8)
+    wagon_width, gap = int(width * 0.6), int(width * 0.25)
+    speed = max(1, width // 40)
+    idle_frames = int(idle_seconds * fps)
+
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, size)
+
+    def write(frame):
+        noise = rng.normal(0, 3, frame.shape)
+        writer.write(np.clip(frame + noise, 0, 255).astype(np.uint8))
+
+    for _ in range(trains):
+        for _ in range(idle_frames):
+            write(background)
+        train_length = wagons_per_train * (wagon_width + gap)
+        for shift in range(0, train_length + width, speed):
+            frame = background.copy()
+            for wagon in range(wagons_per_train):
+                x1 = width - shift + wagon * (wagon_width + gap)
+                cv2.rectangle(frame, (x1, height // 6), (x1 + wagon_width, height * 3 // 4), WAGON_COLOR, -1)
+            write(frame)
+    for _ in range(idle_frames):
+        write(background)
+    writer.release()
+
+
+def measure(video_path, model, motion_threshold, batch_size):
+    from frame_extractor import extract_and_annotate_wagons
+
+    start = time.perf_counter()
+    count, _, stats = extract_and_annotate_wagons(video_path, None, model, batch_size=batch_size,
+                                                  motion_threshold=motion_threshold)
+    elapsed = time.perf_counter() - start
+    return count, stats, stats['frames_processed'] / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--width', type=int, default=1280)
+    parser.add_argument('--height', type=int, default=720)
+    parser.add_argument('--fps', type=int, default=25)
+    parser.add_argument('--idle-seconds', type=float, default=60)
+    parser.add_argument('--trains', type=int, default=3)
+    parser.add_argument('--wagons', type=int, default=4, help='Wagons per train')
+    parser.add_argument('--model-ms', type=float, default=30, help='Simulated inference time per frame')
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--thresholds', type=float, nargs='+', default=[0.001, 0.005, 0.02])
+    args = parser.parse_args()
+
+    model = ColorModel(args.model_ms / 1000)
+    with tempfile.TemporaryDirectory() as workdir:
+        video_path = os.path.join(workdir, 'trackside.mp4')
+        make_clip(video_path, (args.width, args.height), args.fps, args.idle_seconds, args.trains, args.wagons)
+
+        print(f"{'motion gate':<14}{'wagons':>8}{'inferred':>10}{'gated':>8}{'gate ms/frame':>15}{'fps':>9}")
+        baseline = None
+        for threshold in [None] + args.thresholds:
+            count, stats, fps = measure(video_path, model, threshold, args.batch_size)
+            baseline = count if baseline is None else baseline
+            gate_ms = 1000 * stats['stage_timings'].get('motion_gate', 0.0) / stats['frames_processed']
+            label = 'off' if threshold is None else f'{threshold:g}'
+            missed = '' if count == baseline else f'  ({count - baseline:+d} vs. ungated)'
+            print(f"{label:<14}{count:>8}{stats['frames_inferred']:>10}{stats['gated_fraction']:>8.0%}"
+                  f"{gate_ms:>15.2f}{fps:>9.1f}{missed}")
+
+
+if __name__ == '__main__':
+    main()
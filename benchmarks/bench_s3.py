@@ -0,0 +1,167 @@
+"""
+Benchmarks s3_utils against a local S3 stand-in.
+
+Compares the old behaviour (a fresh boto3 client per call, a single
+put_object / get_object().read() per file) with the pooled client and the
+transfer manager now used by s3_utils:
+
+- small objects: mean latency of upload / exists / download per call
+- large objects: upload and download throughput in MB/s, and the peak
+  Python memory allocated while downloading (a full read, a single streamed
+  GET and parallel ranged GETs)
+
+By default a moto server is started in a subprocess, so its memory does not
+show up in the measurements. Pass --endpoint-url to run against MinIO or
+another S3-compatible store instead.
+
+Usage:
+    python benchmarks/bench_s3.py [--small-count 100] [--large-mb 256 1024]
+    python benchmarks/bench_s3.py --endpoint-url http://localhost:9000 --bucket bench
+"""
+
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import boto3
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def fresh_client():
+    return boto3.client('s3', endpoint_url=os.environ['S3_ENDPOINT_URL'],
+                        region_name=os.getenv('AWS_REGION', 'us-east-1'))
+
+
+def naive_upload(bucket, key, path):
+    with open(path, 'rb') as f:
+        fresh_client().put_object(Bucket=bucket, Key=key, Body=f)
+
+
+def naive_download(bucket, key, path):
+    body = fresh_client().get_object(Bucket=bucket, Key=key)['Body'].read()
+    with open(path, 'wb') as f:
+        f.write(body)
+
+
+def naive_exists(bucket, key):
+    fresh_client().get_object(Bucket=bucket, Key=key)
+    return True
+
+
+def start_moto_server():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    server = subprocess.Popen([sys.executable, '-m', 'moto.server', '-p', str(port)],
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            break
+        except OSError:
+            time.sleep(0.1)
+    return server, f"http://127.0.0.1:{port}"
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
+
+
+def timed_peak_memory(fn, *args):
+    tracemalloc.start()
+    elapsed = timed(fn, *args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak / (1024 * 1024)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--endpoint-url')
+    parser.add_argument('--bucket', default='wagon-bench')
+    parser.add_argument('--small-count', type=int, default=100)
+    parser.add_argument('--small-kb', type=int, default=64)
+    parser.add_argument('--large-mb', type=int, nargs='+', default=[256])
+    args = parser.parse_args()
+
+    server = None
+    if args.endpoint_url is None:
+        server, args.endpoint_url = start_moto_server()
+        os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+        os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+    os.environ['S3_ENDPOINT_URL'] = args.endpoint_url
+
+    import s3_utils
+
+    client = s3_utils.get_s3_client()
+    try:
+        client.create_bucket(Bucket=args.bucket)
+    except client.exceptions.BucketAlreadyOwnedByYou:
+        pass
+
+    with tempfile.TemporaryDirectory() as workdir:
+        small_path = os.path.join(workdir, 'small.bin')
+        with open(small_path, 'wb') as f:
+            f.write(os.urandom(args.small_kb * 1024))
+
+        def pooled_upload(bucket, key, path):
+            with open(path, 'rb') as f:
+                name = os.path.basename(key)
+                success, message, _ = s3_utils.upload_file_to_s3(f, bucket, os.path.dirname(key), filename=name)
+            assert success, message
+
+        def pooled_download(bucket, key, path):
+            success, message, _ = s3_utils.download_file_from_s3(bucket, key, path)
+            assert success, message
+
+        def streamed_download(bucket, key, path):
+            success, message, _ = s3_utils.download_file_from_s3(bucket, key, path, parallel=False)
+            assert success, message
+
+        print(f"small objects ({args.small_kb} KB x {args.small_count}), mean latency in ms")
+        print(f"{'':<20}{'upload':>10}{'exists':>10}{'download':>10}")
+        for label, upload, exists, download in (
+                ('client per call', naive_upload, naive_exists, naive_download),
+                ('pooled client', pooled_upload, s3_utils.check_file_exists, pooled_download)):
+            totals = [0.0, 0.0, 0.0]
+            for i in range(args.small_count):
+                key = f"small/{label.replace(' ', '_')}/{i}.bin"
+                totals[0] += timed(upload, args.bucket, key, small_path)
+                totals[1] += timed(exists, args.bucket, key)
+                totals[2] += timed(download, args.bucket, key, os.path.join(workdir, 'small.out'))
+            print(f"{label:<20}" + ''.join(f"{1000 * total / args.small_count:>10.1f}" for total in totals))
+
+        print("\nlarge objects, throughput in MB/s")
+        print(f"{'':<20}{'size (MB)':>10}{'upload':>10}{'download':>10}{'peak (MB)':>11}")
+        for size_mb in args.large_mb:
+            large_path = os.path.join(workdir, 'large.bin')
+            with open(large_path, 'wb') as f:
+                block = os.urandom(1024 * 1024)
+                for _ in range(size_mb):
+                    f.write(block)
+            for label, upload, download in (('single request', naive_upload, naive_download),
+                                            ('streamed GET', pooled_upload, streamed_download),
+                                            ('transfer manager', pooled_upload, pooled_download)):
+                key = f"large/{label.replace(' ', '_')}/{size_mb}.bin"
+                upload_seconds = timed(upload, args.bucket, key, large_path)
+                download_seconds, peak_mb = timed_peak_memory(
+                    download, args.bucket, key, os.path.join(workdir, 'large.out'))
+                print(f"{label:<20}{size_mb:>10}{size_mb / upload_seconds:>10.1f}"
+                      f"{size_mb / download_seconds:>10.1f}{peak_mb:>11.1f}")
+            os.remove(large_path)
+
+    if server is not None:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""
+Memory and throughput of N worker processes with per-process and shared model weights.
+
+For every concurrency level, a fresh driver process forks N children the way
+a prefork Celery worker does. With 'per-process' each child loads its own
+copy of the weights; with 'shared' the driver loads them once before forking
+(celery_worker.prepare_model_for_fork) and the children inherit them. Every
+child sets its thread count with celery_worker.configure_threads, warms up,
+then runs the model on blank frames at the same time as the others.
+
+The script reports the total proportional set size (PSS, Linux only) of the
+children, which counts shared pages once, and the aggregate frames/sec.
+
+Usage:
+    python benchmarks/bench_shared_model.py [--concurrency 1 2 4] [--frames 64] [--batch-size 8]
+"""
+
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def pss_mb():
+    with open('/proc/self/smaps_rollup') as f:
+        for line in f:
+            if line.startswith('Pss:'):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def _child(frames, batch_size, imgsz, barrier, results):
+    import celery_worker
+
+    celery_worker.configure_threads()
+    if celery_worker.yolo_model is None:
+        celery_worker.load_worker_model()
+    model = celery_worker.yolo_model
+    batch = [np.zeros((imgsz, imgsz, 3), dtype=np.uint8) for _ in range(batch_size)]
+    model(batch, verbose=False, imgsz=imgsz)
+
+    barrier.wait()
+    start = time.perf_counter()
+    for _ in range(max(1, frames // batch_size)):
+        model(batch, verbose=False, imgsz=imgsz)
+    results.put((time.perf_counter() - start, pss_mb()))
+
+
+def _driver(mode, concurrency, frames, batch_size, imgsz, output):
+    import torch
+    import celery_worker
+
+    os.chdir(ROOT)
+    celery_worker.worker_concurrency = concurrency
+    if mode == 'shared':
+        torch.set_num_threads(1)
+        celery_worker.load_worker_model()
+        celery_worker.prepare_model_for_fork(celery_worker.yolo_model)
+
+    context = multiprocessing.get_context('fork')
+    barrier = context.Barrier(concurrency)
+    results = context.Queue()
+    children = [context.Process(target=_child, args=(frames, batch_size, imgsz, barrier, results))
+                for _ in range(concurrency)]
+    for child in children:
+        child.start()
+    measurements = [results.get() for _ in children]
+    for child in children:
+        child.join()
+
+    wall = max(seconds for seconds, _ in measurements)
+    total_frames = concurrency * max(1, frames // batch_size) * batch_size
+    output.put((sum(pss for _, pss in measurements), total_frames / wall))
+
+
+def measure(mode, concurrency, frames, batch_size, imgsz):
+    # A fresh interpreter per run, so one run's loaded model can't leak into the next
+    context = multiprocessing.get_context('spawn')
+    output = context.Queue()
+    driver = context.Process(target=_driver, args=(mode, concurrency, frames, batch_size, imgsz, output))
+    driver.start()
+    result = output.get()
+    driver.join()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--frames', type=int, default=64)
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--imgsz', type=int, default=640)
+    args = parser.parse_args()
+
+    print(f"{'mode':<14}{'processes':>10}{'total PSS (MB)':>16}{'frames/sec':>12}")
+    for mode in ('per-process', 'shared'):
+        for concurrency in args.concurrency:
+            total_pss, fps = measure(mode, concurrency, args.frames, args.batch_size, args.imgsz)
+            print(f"{mode:<14}{concurrency:>10}{total_pss:>16.1f}{fps:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+Start-up cost of the web app and the Celery worker.
+
+Each target is imported in a fresh interpreter, so nothing is shared between
+runs. The script reports the import time, the peak RSS and which of the heavy
+libraries (torch, ultralytics, OpenCV) the process ended up loading. The web
+app should load none of them; the worker pays for them once, and for the
+model weights when its processes start.
+
+Run from the repository root, so models/best_weights.pt is found:
+
+Usage:
+    python benchmarks/bench_startup.py [--repeat 3]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = ('torch', 'ultralytics', 'cv2')
+
+TARGETS = {
+    'web (import app)': 'import app',
+    'worker (import celery_worker)': 'import celery_worker',
+    'worker process (+ model load)': 'import celery_worker\ncelery_worker.init_worker_process()',
+}
+
+_PROBE = """
+import json, resource, sys, time
+start = time.perf_counter()
+{code}
+elapsed = time.perf_counter() - start
+print(json.dumps({{
+    'seconds': elapsed,
+    'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    'heavy': [name for name in {heavy!r} if name in sys.modules],
+}}))
+"""
+
+
+def measure(code):
+    probe = _PROBE.format(code=code, heavy=HEAVY_MODULES)
+    completed = subprocess.run([sys.executable, '-c', probe], cwd=ROOT, capture_output=True, text=True,
+                               env=dict(os.environ, PYTHONPATH=ROOT))
+    if completed.returncode != 0:
+        raise RuntimeError(completed.stderr.strip().splitlines()[-1])
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'process':<32}{'start-up (s)':>14}{'peak RSS (MB)':>16}  heavy modules")
+    for label, code in TARGETS.items():
+        try:
+            runs = [measure(code) for _ in range(args.repeat)]
+        except RuntimeError as e:
+            print(f"{label:<32}  failed: {e}")
+            continue
+        seconds = statistics.median(run['seconds'] for run in runs)
+        peak_rss_mb = statistics.median(run['peak_rss_mb'] for run in runs)
+        heavy = ', '.join(runs[0]['heavy']) or '-'
+        print(f"{label:<32}{seconds:>14.2f}{peak_rss_mb:>16.1f}  {heavy}")
+
+
+if __name__ == '__main__':
+    main()
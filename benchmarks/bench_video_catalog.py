@@ -0,0 +1,70 @@
+"""
+Lookup latency of the video catalog (see video_catalog).
+
+Fills a temporary catalog with synthetic keys laid out like the upload
+folder, `<date>/<camera>_<type>/<video>.mp4`, for `--days` days, every camera
+and video type and `--videos` videos per folder, then times the page lookups
+/retrieve_videos and /api/videos make: by date, by date and camera, and by
+date, camera and type.
+
+Usage:
+    python benchmarks/bench_video_catalog.py [--days 90] [--videos 10] [--repeat 1000]
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from video_catalog import CAMERAS, VIDEO_TYPES, VideoCatalog
+
+PREFIX = 'videos'
+
+
+def fill(catalog, days, videos_per_folder):
+    first_day = date(2024, 1, 1)
+    keys = [f"{PREFIX}/{first_day + timedelta(days=day)}/{camera}_{video_type}/train_{index:03d}.mp4"
+            for day in range(days) for camera in CAMERAS for video_type in VIDEO_TYPES
+            for index in range(videos_per_folder)]
+    return catalog.add_many([(key, 100 * 1024 * 1024, None) for key in keys])
+
+
+def lookup_ms(catalog, days, repeat, **filters):
+    first_day = date(2024, 1, 1)
+    timings = []
+    for _ in range(repeat):
+        recorded_date = str(first_day + timedelta(days=random.randrange(days)))
+        start = time.perf_counter()
+        catalog.find(recorded_date, **filters)
+        timings.append((time.perf_counter() - start) * 1000)
+    return np.percentile(timings, 50), np.percentile(timings, 95)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--days', type=int, default=90)
+    parser.add_argument('--videos', type=int, default=10, help='Videos per date/camera/type folder')
+    parser.add_argument('--repeat', type=int, default=1000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        catalog = VideoCatalog('bench-bucket', PREFIX, db_path=os.path.join(workdir, 'catalog.db'))
+        indexed = fill(catalog, args.days, args.videos)
+        print(f"{indexed} videos indexed")
+        print(f"{'lookup':<28}{'p50 ms':>10}{'p95 ms':>10}")
+        for label, filters in (('date', {}),
+                               ('date + camera', {'camera': 'left'}),
+                               ('date + camera + type', {'camera': 'left', 'video_type': 'entry'})):
+            p50, p95 = lookup_ms(catalog, args.days, args.repeat, **filters)
+            print(f"{label:<28}{p50:>10.3f}{p95:>10.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+"""
+Celery application shared by the web app and the workers.
+
+Only the client side is configured here: broker, result backend, queues and
+the names of the tasks. Nothing in this module imports the model or video
+code, so the web app sends tasks by name and reads their results without
+loading torch, ultralytics or OpenCV. The tasks are registered on this app
+by celery_worker, which only the workers import.
+"""
+
+import os
+
+from celery import Celery
+
+# --- Celery Configuration ---
+CELERY_BROKER_URL = os.environ.get('CELERY_BROKER_URL', 'redis://localhost:6379/0')
+CELERY_RESULT_BACKEND = os.environ.get('CELERY_RESULT_BACKEND', 'redis://localhost:6379/0')
+
+celery = Celery(
+    'tasks',
+    broker=CELERY_BROKER_URL,
+    backend=CELERY_RESULT_BACKEND
+)
+
+# --- Queues ---
+# Single-video extractions go to the interactive queue and the children of
+# batch jobs to the bulk queue. Workers consuming both (`-Q interactive,bulk`)
+# always take interactive work first; running one worker on `-Q interactive`
+# alone keeps interactive extractions fast even while every other worker is
+# busy with a long bulk video.
+INTERACTIVE_QUEUE = os.environ.get('INTERACTIVE_QUEUE', 'interactive')
+BULK_QUEUE = os.environ.get('BULK_QUEUE', 'bulk')
+
+celery.conf.update(
+    task_default_queue=INTERACTIVE_QUEUE,
+    # Reserve one task at a time, so queued interactive work is not stuck
+    # behind bulk tasks already prefetched by a busy worker.
+    worker_prefetch_multiplier=1,
+    broker_transport_options={'queue_order_strategy': 'priority'},
+)
+
+# --- Task names ---
+PROCESS_VIDEO_TASK = 'celery_worker.process_video_task'
+PROCESS_VIDEO_PARALLEL_TASK = 'celery_worker.process_video_parallel_task'
+PROCESS_VIDEO_CHUNK_TASK = 'celery_worker.process_video_chunk_task'
+MERGE_VIDEO_CHUNKS_TASK = 'celery_worker.merge_video_chunks_task'
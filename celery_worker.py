@@ -1,90 +1,507 @@
 import os
-from celery import Celery, Task
+import gc
+import cv2
+import torch
+from celery import Task, chord
+from celery.concurrency import get_implementation
+from celery.concurrency.prefork import TaskPool as PreforkPool
+from celery.concurrency.solo import TaskPool as SoloPool
+from celery.signals import worker_init, worker_process_init
 import logging
 import time
-import base64
-import cv2
-from frame_extractor import extract_and_annotate_wagons
-from ultralytics import YOLO
+from celery_app import (celery, BULK_QUEUE, PROCESS_VIDEO_TASK, PROCESS_VIDEO_PARALLEL_TASK,
+                        PROCESS_VIDEO_CHUNK_TASK, MERGE_VIDEO_CHUNKS_TASK)
+from extraction_config import (
+    INFERENCE_BACKEND, INFERENCE_IMGSZ, INFERENCE_SERVICE_SOCKET, YOLO_BATCH_SIZE, PIPELINED_EXTRACTION,
+    PIPELINE_QUEUE_SIZE, REUSE_FRAME_BUFFERS, SEARCH_STRIDE, MOTION_GATE, MOTION_THRESHOLD, VIDEO_DECODER,
+    DECODER_THREADS, DECODE_SCALE, PROGRESS_INTERVAL, FRAME_STORAGE, FRAME_JPEG_QUALITY, S3_BUCKET,
+    S3_FRAMES_FOLDER, S3_VIDEO_URL_EXPIRATION, ANNOTATE_VIDEO, VIDEO_CODEC, VIDEO_SCALE, VIDEO_FRAME_STEP,
+    VIDEO_QUALITY, CHUNK_OVERLAP_SECONDS, MIN_CHUNK_SECONDS, get_camera_settings
+)
+from frame_extractor import extract_and_annotate_wagons, get_video_info, concatenate_videos
+from frame_storage import LocalFrameStore, S3FrameStore
+from inference_backends import load_model, warm_up
+from inference_service import InferenceClient
+from task_events import publish_task_event, record_chunk_progress
+from result_cache import ResultCache, RESULT_CACHE_ENABLED
+from s3_utils import generate_presigned_url, parse_s3_uri
+from batch_jobs import BatchJobs
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-# --- Celery Configuration ---
-CELERY_BROKER_URL = os.environ.get('CELERY_BROKER_URL', 'redis://localhost:6379/0')
-CELERY_RESULT_BACKEND = os.environ.get('CELERY_RESULT_BACKEND', 'redis://localhost:6379/0')
+batch_jobs = BatchJobs(celery, BULK_QUEUE)
 
-celery = Celery(
-    'tasks',
-    broker=CELERY_BROKER_URL,
-    backend=CELERY_RESULT_BACKEND
-)
 
-# --- Global Model Loading for Celery Worker ---
-# The model is loaded once per worker process. This is the most efficient approach.
+class ProgressTask(Task):
+    """
+    Task that also publishes its progress updates, and its final result or
+    failure, as task events so the web app can stream them to the browser.
+    Children of batch jobs (called with `batch_id`) also report to their job.
+    """
+
+    def update_state(self, task_id=None, state=None, meta=None, **kwargs):
+        super().update_state(task_id=task_id, state=state, meta=meta, **kwargs)
+        publish_task_event(task_id or self.request.id, dict(meta or {}, state=state))
+
+    def on_success(self, retval, task_id, args, kwargs):
+        publish_task_event(task_id, {'state': 'SUCCESS', 'status': 'Completed', 'progress': 100, 'result': retval})
+        if kwargs.get('batch_id'):
+            batch_jobs.child_finished(kwargs['batch_id'], task_id, args[0], result=retval)
+
+    def on_failure(self, exc, task_id, args, kwargs, einfo):
+        publish_task_event(task_id, {'state': 'FAILURE', 'status': str(exc), 'error': True})
+        if kwargs.get('batch_id'):
+            batch_jobs.child_finished(kwargs['batch_id'], task_id, args[0], error=str(exc))
+
+
+class ChunkProgress:
+    """
+    Reports the progress of one chunk of `process_video_parallel_task`. It
+    stands in for the chunk task in the extractor: updates go to the chunk
+    task and, combined with those of the other chunks, to the parent task,
+    which is the one the browser follows.
+    """
+
+    def __init__(self, task, parent_task_id, start_frame, end_frame, total_frames, chunks):
+        self.task = task
+        # Read on the task thread; updates arrive from the progress reporter's.
+        self.request = task.request
+        self.parent_task_id = parent_task_id
+        self.start_frame = start_frame
+        self.end_frame = end_frame
+        self.total_frames = total_frames
+        self.chunks = chunks
+
+    def update_state(self, task_id=None, state=None, meta=None, **kwargs):
+        self.task.update_state(task_id=task_id, state=state, meta=meta, **kwargs)
+        if state != 'PROGRESS' or 'frame' not in (meta or {}):
+            return
+        # Overlap frames decoded outside the chunk's own range are not counted.
+        frames_done = min(max(0, meta['frame'] - self.start_frame), self.end_frame - self.start_frame)
+        totals = record_chunk_progress(self.parent_task_id, self.request.id, frames_done,
+                                       meta.get('wagons_captured', 0))
+        if totals is None:
+            return
+        frames_done, wagons_captured = totals
+        progress = {
+            'frame': frames_done,
+            'total_frames': self.total_frames,
+            'wagons_captured': wagons_captured,
+            'chunks': self.chunks,
+            'progress': 10 + int(80 * min(1.0, frames_done / max(1, self.total_frames))),
+            'status': f'Processing frame {frames_done}/{self.total_frames} in {self.chunks} chunks '
+                      f'- {wagons_captured} wagons',
+        }
+        try:
+            self.task.update_state(task_id=self.parent_task_id, state='PROGRESS', meta=progress)
+        except Exception as e:
+            logger.warning(f"Could not update the progress of task {self.parent_task_id}: {e}")
+        publish_task_event(self.parent_task_id, dict(progress, state='PROGRESS'))
+
+# --- Model Loading for Celery Worker ---
+# The model is loaded when the worker starts, never when this module is
+# imported. With SHARED_MODEL=1 (the default) the main process of a prefork
+# worker loads it once before forking its pool, and the pool processes share
+# the weights copy-on-write, so memory stays flat as concurrency grows. With
+# SHARED_MODEL=0 every pool process loads its own copy (see init_worker_process).
+# With INFERENCE_SERVICE_SOCKET set, `yolo_model` is a client of the node's
+# inference service instead, and no process of the worker loads the weights.
 YOLO_MODEL_PATH = 'models/best_weights.pt'
 yolo_model = None
+SHARED_MODEL = os.environ.get('SHARED_MODEL', '1') == '1'
 
-try:
-    if os.path.exists(YOLO_MODEL_PATH):
-        yolo_model = YOLO(YOLO_MODEL_PATH)
-        logger.info(f"YOLO model loaded successfully in Celery worker from {YOLO_MODEL_PATH}")
-    else:
-        logger.error(f"YOLO model file not found at {YOLO_MODEL_PATH}")
-except Exception as e:
-    logger.error(f"Error loading YOLO model in Celery worker: {e}", exc_info=True)
+# Intra-op threads (torch and OpenCV) per pool process. By default the cores
+# are split between the tasks the worker runs at once, so N pool processes
+# don't each start a thread per core and oversubscribe the node.
+WORKER_THREADS = int(os.environ.get('WORKER_THREADS', 0))
 
+# Tasks this worker runs at the same time; set when the worker starts.
+worker_concurrency = 1
 
-# --- Celery Task Definition ---
-@celery.task(bind=True)
-def process_video_task(self: Task, video_path: str, model_path: str):
+
+def load_yolo_model(model_path):
+    """Loads the model with INFERENCE_BACKEND, falling back to PyTorch."""
+    try:
+        return load_model(model_path, INFERENCE_BACKEND, imgsz=INFERENCE_IMGSZ)
+    except Exception as e:
+        if INFERENCE_BACKEND == 'torch':
+            raise
+        logger.error(f"Could not load the {INFERENCE_BACKEND} backend ({e}); falling back to torch.")
+        return load_model(model_path, 'torch')
+
+
+def load_worker_model():
     """
-    Celery task to process a video for frame extraction and wagon annotation.
-    It uses the globally pre-loaded YOLO model for efficiency.
+    Loads YOLO_MODEL_PATH into `yolo_model`, logging instead of raising on
+    failure, or sets it to a client of the inference service if one is configured.
     """
     global yolo_model
-    if yolo_model is None:
-        # This is a fallback in case the initial loading failed.
+    if INFERENCE_SERVICE_SOCKET:
+        yolo_model = InferenceClient(INFERENCE_SERVICE_SOCKET)
+        logger.info(f"Using the inference service at {INFERENCE_SERVICE_SOCKET}")
+        return
+    try:
+        if not os.path.exists(YOLO_MODEL_PATH):
+            logger.error(f"YOLO model file not found at {YOLO_MODEL_PATH}")
+            return
+        yolo_model = load_yolo_model(YOLO_MODEL_PATH)
+        logger.info(f"YOLO model loaded successfully in Celery worker from {YOLO_MODEL_PATH}")
+    except Exception as e:
+        logger.error(f"Error loading YOLO model in Celery worker: {e}", exc_info=True)
+
+
+def prepare_model_for_fork(model):
+    """
+    Gets a model loaded in the prefork parent ready to be shared by its pool
+    processes. Conv/BatchNorm layers are fused once here; left to the first
+    prediction, every process would fuse them into a private copy of the
+    weights. The objects created so far are then frozen out of the garbage
+    collector, so collections in the children don't write to, and so copy,
+    the pages that hold them.
+    """
+    if INFERENCE_BACKEND == 'torch':
         try:
-            logger.warning("YOLO model not pre-loaded. Attempting to load within the task.")
-            yolo_model = YOLO(model_path)
-            logger.info("YOLO model reloaded successfully within the task.")
+            model.fuse()
         except Exception as e:
-            logger.error(f"Failed to reload YOLO model within task: {e}")
-            self.update_state(state='FAILURE', meta={'status': 'Model could not be loaded.'})
-            return # Exit the task if model loading fails
+            logger.warning(f"Could not fuse the model before forking: {e}")
+    gc.freeze()
+
+
+def configure_threads():
+    """Sets the torch and OpenCV thread counts of this process from the worker concurrency."""
+    threads = WORKER_THREADS or max(1, (os.cpu_count() or 1) // worker_concurrency)
+    torch.set_num_threads(threads)
+    cv2.setNumThreads(threads)
+    return threads
+
+
+def make_run_id(task_id):
+    """
+    Names the output of one extraction: the start time followed by the task
+    id, so tasks started in the same second never share frames or videos.
+    """
+    return f"{time.strftime('%Y%m%d-%H%M%S')}-{task_id[:8]}"
+
+
+def create_frame_store(run_id, output_dir):
+    """Returns the store captured frames of one run are written to."""
+    if FRAME_STORAGE == 's3':
+        return S3FrameStore(S3_BUCKET, f"{S3_FRAMES_FOLDER}/{run_id}", jpeg_quality=FRAME_JPEG_QUALITY)
+    return LocalFrameStore(os.path.join(output_dir, 'frames'), jpeg_quality=FRAME_JPEG_QUALITY)
+
+
+def resolve_video_source(video_path):
+    """
+    Returns what OpenCV should open for `video_path`: the path itself, or a
+    presigned URL for an s3://bucket/key URI. FFmpeg reads the URL with
+    ranged requests, so decoding starts without downloading the video.
+    """
+    location = parse_s3_uri(video_path)
+    if location is None:
+        return video_path
+    success, url = generate_presigned_url(*location, expiration=S3_VIDEO_URL_EXPIRATION)
+    if not success:
+        raise RuntimeError(f"Could not create a URL for {video_path}: {url}")
+    return url
+
+
+def ensure_model_loaded(model_path):
+    """Returns the worker's YOLO model, loading it from `model_path` if needed."""
+    global yolo_model
+    if yolo_model is None:
+        # Pools without child processes (solo, threads) and processes whose
+        # loading failed at start-up load the model on their first task.
+        logger.info("YOLO model not pre-loaded. Loading it within the task.")
+        yolo_model = load_yolo_model(model_path)
+        logger.info("YOLO model loaded successfully within the task.")
+    return yolo_model
+
+
+def run_extraction(task, video_path, output_dir, run_id, model, output_video_path,
+                   batch_size=None, pipelined=None, search_stride=None, annotate_video=None, camera_id=None,
+                   **range_kwargs):
+    """
+    Runs `extract_and_annotate_wagons` with the worker defaults and the
+    settings of `camera_id`, writing the captured frames through a frame store.
+    `video_path` may be a local path or an s3://bucket/key URI.
+    `output_video_path` is ignored unless the annotated video is enabled.
+
+    Returns:
+        tuple: (int saved frame count, list frame records, dict stats)
+    """
+    video_source = resolve_video_source(video_path)
+    frame_store = create_frame_store(run_id, output_dir)
+    if not (ANNOTATE_VIDEO if annotate_video is None else annotate_video):
+        output_video_path = None
+
+    # Captured frames are written out by the frame store as soon as they are
+    # committed; only their references are kept for the task result.
+    try:
+        return extract_and_annotate_wagons(
+            video_path=video_source,
+            output_video_path=output_video_path,
+            model=model, # Pass the loaded model object
+            task=task,
+            batch_size=batch_size or YOLO_BATCH_SIZE,
+            pipelined=PIPELINED_EXTRACTION if pipelined is None else pipelined,
+            queue_size=PIPELINE_QUEUE_SIZE,
+            search_stride=search_stride or SEARCH_STRIDE,
+            reuse_frame_buffers=REUSE_FRAME_BUFFERS,
+            on_capture=frame_store,
+            video_codec=VIDEO_CODEC,
+            video_scale=VIDEO_SCALE,
+            video_frame_step=VIDEO_FRAME_STEP,
+            video_quality=VIDEO_QUALITY,
+            progress_interval=PROGRESS_INTERVAL,
+            motion_threshold=MOTION_THRESHOLD if MOTION_GATE else None,
+            decoder=VIDEO_DECODER,
+            decoder_threads=DECODER_THREADS,
+            decode_scale=DECODE_SCALE,
+            **get_camera_settings(camera_id),
+            **range_kwargs
+        )
+    finally:
+        frame_store.close()
+
+
+@worker_init.connect
+def init_worker(sender=None, **kwargs):
+    """
+    Runs in the main worker process before the pool starts. A prefork worker
+    with SHARED_MODEL loads the model here for its pool processes to inherit;
+    other pools run tasks in this process, which is set up right away.
+    """
+    global worker_concurrency
+    if result_cache is not None and os.path.exists(YOLO_MODEL_PATH):
+        # Lets web processes without the weights file build result cache keys.
+        result_cache.publish_weights_digest(YOLO_MODEL_PATH)
+    pool_cls = get_implementation(sender.pool_cls) if sender is not None else SoloPool
+    worker_concurrency = 1 if issubclass(pool_cls, SoloPool) else max(1, sender.concurrency or 1)
+    if not issubclass(pool_cls, PreforkPool):
+        init_worker_process()
+        return
+    if SHARED_MODEL and not INFERENCE_SERVICE_SOCKET:
+        # No inference here: the parent must not start an intra-op thread
+        # pool that the forked children would inherit in a broken state.
+        torch.set_num_threads(1)
+        load_worker_model()
+        if yolo_model is not None:
+            prepare_model_for_fork(yolo_model)
+            logger.info(f"YOLO model shared by {worker_concurrency} pool processes")
+
+
+@worker_process_init.connect
+def init_worker_process(**kwargs):
+    """
+    Sets the thread counts, loads the model unless it was inherited from the
+    parent, and runs a warm-up pass in every worker process before it takes jobs.
+    """
+    threads = configure_threads()
+    if yolo_model is None:
+        load_worker_model()
+    if yolo_model is None or isinstance(yolo_model, InferenceClient):
+        # The inference service warms up its own model.
+        return
+    logger.info(f"Worker process {os.getpid()} uses {threads} threads")
+    try:
+        start = time.perf_counter()
+        warm_up(yolo_model, imgsz=INFERENCE_IMGSZ, batch_size=YOLO_BATCH_SIZE)
+        logger.info(f"YOLO model warmed up in {time.perf_counter() - start:.2f}s")
+    except Exception as e:
+        logger.warning(f"YOLO model warm-up failed: {e}")
+
+
+result_cache = ResultCache() if RESULT_CACHE_ENABLED else None
+
+
+# --- Celery Task Definition ---
+@celery.task(bind=True, base=ProgressTask, name=PROCESS_VIDEO_TASK)
+def process_video_task(self: Task, video_path: str, model_path: str, batch_size: int = None,
+                       pipelined: bool = None, search_stride: int = None, annotate_video: bool = None,
+                       camera_id: str = None, cache_key: str = None, batch_id: str = None):
+    """
+    Celery task to process a video for frame extraction and wagon annotation.
+    It uses the YOLO model loaded when the worker process started.
+    `video_path` is a local path or an s3://bucket/key URI, which is decoded
+    from S3 directly.
+    `batch_size`, `pipelined`, `search_stride` and `annotate_video` override
+    the worker defaults; `camera_id` selects the ROI and inference size.
+    The result is stored in the result cache under `cache_key`, if given.
+    `batch_id` is the batch job the task is a child of.
+    """
+    try:
+        model = ensure_model_loaded(model_path)
+    except Exception as e:
+        logger.error(f"Failed to reload YOLO model within task: {e}")
+        # Raising (not returning) makes the task, and its batch job, record a failure.
+        raise RuntimeError('Model could not be loaded') from e
 
     try:
         logger.info(f"Starting video processing task for: {video_path}")
         self.update_state(state='PROGRESS', meta={'status': 'Processing started...', 'progress': 5})
 
-        output_dir = os.path.join('static/extracted_frames', time.strftime("%Y%m%d-%H%M%S"))
+        run_id = make_run_id(self.request.id)
+        output_dir = os.path.join('static/extracted_frames', run_id)
         output_video_path = os.path.join(output_dir, 'annotated_video.mp4')
         os.makedirs(output_dir, exist_ok=True)
-        
-        # The `extract_and_annotate_wagons` function now uses the pre-loaded model.
-        saved_count, frame_images = extract_and_annotate_wagons(
-            video_path=video_path,
-            output_video_path=output_video_path,
-            model=yolo_model, # Pass the loaded model object
-            task=self
-        )
 
-        logger.info(f"Frame extraction complete. Found {saved_count} frames.")
-        self.update_state(state='PROGRESS', meta={'status': 'Encoding frames...', 'progress': 95})
+        saved_count, frame_records, stats = run_extraction(
+            self, video_path, output_dir, run_id, model, output_video_path,
+            batch_size=batch_size, pipelined=pipelined, search_stride=search_stride,
+            annotate_video=annotate_video, camera_id=camera_id
+        )
 
-        encoded_frames = []
-        for frame in frame_images:
-            _, buffer = cv2.imencode('.jpg', frame)
-            encoded_frame = base64.b64encode(buffer).decode('utf-8')
-            encoded_frames.append(f"data:image/jpeg;base64,{encoded_frame}")
+        logger.info(f"Frame extraction complete. Found {saved_count} frames "
+                    f"({stats.get('frames_inferred', 0)} frames inferred, {stats.get('frames_skipped', 0)} skipped, "
+                    f"{stats.get('frames_gated', 0)} gated).")
 
         logger.info("Task finished successfully.")
-        return {'status': 'Completed', 'result': encoded_frames, 'count': saved_count}
+        result = {
+            'status': 'Completed',
+            'result': [record['url'] for record in frame_records],
+            'frames': frame_records,
+            'count': saved_count,
+            'annotated_video': '/' + output_video_path if stats.get('annotated_video') else None,
+            'stats': stats
+        }
+        if cache_key and result_cache is not None:
+            result_cache.put(cache_key, result)
+        return result
 
     except Exception as e:
         logger.error(f"Error during video processing task: {str(e)}", exc_info=True)
         self.update_state(state='FAILURE', meta={'status': 'Task failed', 'error': str(e)})
         raise
 
+
+@celery.task(bind=True, base=ProgressTask, name=PROCESS_VIDEO_PARALLEL_TASK)
+def process_video_parallel_task(self: Task, video_path: str, model_path: str, chunks: int = 4, **options):
+    """
+    Celery task that splits one long video into frame ranges, processes the
+    ranges in parallel as a chord of `process_video_chunk_task` and merges the
+    results with `merge_video_chunks_task`. The task is replaced by the chord,
+    so its result is the merged result. `options` are the keyword arguments
+    of `process_video_task`; `cache_key` is passed on to the merge step.
+
+    Chunk workers write their video segments and (with local frame storage)
+    captured frames into the same output directory, so they must share the
+    static folder.
+    """
+    cache_key = options.pop('cache_key', None)
+    logger.info(f"Starting parallel video processing task for: {video_path}")
+    self.update_state(state='PROGRESS', meta={'status': 'Splitting video...', 'progress': 5})
+
+    video_info = get_video_info(resolve_video_source(video_path))
+    if video_info is None or video_info['frame_count'] <= 0:
+        logger.warning(f"Could not read the frame count of {video_path}; processing it as a single chunk.")
+        return self.replace(process_video_task.si(video_path, model_path, cache_key=cache_key, **options))
+
+    fps = video_info['fps'] or 25
+    total_frames = video_info['frame_count']
+    max_chunks = max(1, int(total_frames // (fps * MIN_CHUNK_SECONDS)))
+    chunks = max(1, min(int(chunks), max_chunks))
+    overlap_frames = int(fps * CHUNK_OVERLAP_SECONDS)
+
+    run_id = make_run_id(self.request.id)
+    output_dir = os.path.join('static/extracted_frames', run_id)
+    os.makedirs(output_dir, exist_ok=True)
+
+    # The chord callback takes over this task's id, so the merged result and
+    # the chunks' combined progress are reported under the id the client has.
+    bounds = [round(total_frames * i / chunks) for i in range(chunks + 1)]
+    header = [
+        process_video_chunk_task.s(video_path, model_path, start, end, overlap_frames, output_dir, run_id,
+                                   parent_task_id=self.request.id, total_frames=total_frames, chunks=chunks,
+                                   **options)
+        for start, end in zip(bounds, bounds[1:])
+    ]
+    logger.info(f"Processing {total_frames} frames of {video_path} in {chunks} chunks "
+                f"with {overlap_frames} frames of overlap.")
+    return self.replace(chord(header, merge_video_chunks_task.s(output_dir, time.time(), cache_key)))
+
+
+@celery.task(bind=True, name=PROCESS_VIDEO_CHUNK_TASK)
+def process_video_chunk_task(self: Task, video_path: str, model_path: str, start_frame: int, end_frame: int,
+                             overlap_frames: int, output_dir: str, run_id: str, parent_task_id: str = None,
+                             total_frames: int = None, chunks: int = 1, **options):
+    """
+    Celery task processing the frames [start_frame, end_frame) of a video as
+    one chunk of `process_video_parallel_task`. Its progress is also combined
+    into that of `parent_task_id`, whose video has `total_frames` frames split
+    into `chunks` chunks.
+    """
+    model = ensure_model_loaded(model_path)
+    segment_path = os.path.join(output_dir, 'segments', f'segment_{start_frame:07d}.mp4')
+    progress = self
+    if parent_task_id:
+        progress = ChunkProgress(self, parent_task_id, start_frame, end_frame, total_frames or end_frame, chunks)
+
+    saved_count, frame_records, stats = run_extraction(
+        progress, video_path, output_dir, run_id, model, segment_path,
+        start_frame=start_frame, end_frame=end_frame, overlap_frames=overlap_frames, **options
+    )
+    logger.info(f"Chunk {start_frame}-{end_frame} of {video_path} complete. Found {saved_count} frames.")
+    return {'start_frame': start_frame, 'end_frame': end_frame,
+            'segment': segment_path if stats.get('annotated_video') else None,
+            'frames': frame_records, 'stats': stats}
+
+
+@celery.task(bind=True, base=ProgressTask, name=MERGE_VIDEO_CHUNKS_TASK)
+def merge_video_chunks_task(self: Task, chunk_results: list, output_dir: str, started_at: float,
+                            cache_key: str = None):
+    """
+    Chord callback merging the chunk results of `process_video_parallel_task`
+    into the same result shape as `process_video_task`.
+    """
+    chunk_results = sorted(chunk_results, key=lambda chunk: chunk['start_frame'])
+    self.update_state(state='PROGRESS', meta={'status': f'Merging {len(chunk_results)} chunks...', 'progress': 90})
+
+    output_video_path = None
+    segment_paths = [chunk['segment'] for chunk in chunk_results if chunk['segment']]
+    if segment_paths:
+        output_video_path = os.path.join(output_dir, 'annotated_video.mp4')
+        concatenate_videos(segment_paths, output_video_path)
+        for path in segment_paths:
+            if os.path.exists(path):
+                os.remove(path)
+
+    # Each chunk only keeps wagons captured inside its own range, so frame
+    # indices are unique; deduplicate anyway in case chunks were retried.
+    frame_records = {}
+    for chunk in chunk_results:
+        for record in chunk['frames']:
+            frame_records.setdefault(record['frame_index'], record)
+    frame_records = [frame_records[index] for index in sorted(frame_records)]
+
+    stats = {
+        'chunks': len(chunk_results),
+        'frames_processed': 0,
+        'frames_inferred': 0,
+        'frames_skipped': 0,
+        'frames_gated': 0,
+        'frames_grabbed': 0,
+        'stage_timings': {},
+    }
+    for chunk in chunk_results:
+        for key in ('frames_processed', 'frames_inferred', 'frames_skipped', 'frames_gated', 'frames_grabbed'):
+            stats[key] += chunk['stats'].get(key, 0)
+        for stage, seconds in chunk['stats'].get('stage_timings', {}).items():
+            stats['stage_timings'][stage] = round(stats['stage_timings'].get(stage, 0.0) + seconds, 3)
+    stats['gated_fraction'] = (round(stats['frames_gated'] / stats['frames_processed'], 3)
+                               if stats['frames_processed'] else 0.0)
+    stats['wall_time'] = round(time.time() - started_at, 3)
+
+    logger.info(f"Merged {len(chunk_results)} chunks into {len(frame_records)} frames.")
+    result = {
+        'status': 'Completed',
+        'result': [record['url'] for record in frame_records],
+        'frames': frame_records,
+        'count': len(frame_records),
+        'annotated_video': '/' + output_video_path if output_video_path else None,
+        'stats': stats
+    }
+    if cache_key and result_cache is not None:
+        result_cache.put(cache_key, result)
+    return result
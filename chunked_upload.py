@@ -0,0 +1,288 @@
+"""
+Resumable, chunked video uploads.
+
+A client creates an upload, sends the file as a sequence of chunks (each one
+a plain PUT body at a given offset) and finalizes it. If the connection drops
+the client asks for the current offset and continues from there.
+
+Chunks are written straight to their final location, so nothing is spooled
+or copied: for the 'local' target they are appended to a `.part` file next to
+the final path, which is renamed on completion; for the 's3' target every
+chunk becomes one part of an S3 multipart upload made through s3_utils.
+
+Upload sessions are kept in Redis so any web process can accept the next
+chunk. With the 'local' target the upload folder must be shared by them.
+Sessions expire after UPLOAD_SESSION_TTL seconds without a chunk; the
+`.part` files they leave behind are deleted by a sweep of the upload folder
+that runs at most every UPLOAD_SWEEP_INTERVAL seconds when uploads are
+created. Incomplete S3 multipart uploads are left to the bucket's
+lifecycle rules.
+"""
+
+import json
+import logging
+import os
+import time
+import uuid
+from contextlib import contextmanager
+
+import redis
+from werkzeug.utils import secure_filename
+
+from s3_utils import create_multipart_upload, upload_part, complete_multipart_upload, abort_multipart_upload
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+# Chunk size suggested to clients, and the largest chunk accepted. S3 chunks
+# are buffered in memory for upload_part, so the maximum bounds memory use.
+UPLOAD_CHUNK_SIZE = int(os.getenv('UPLOAD_CHUNK_SIZE_MB', 8)) * 1024 * 1024
+UPLOAD_MAX_CHUNK_SIZE = int(os.getenv('UPLOAD_MAX_CHUNK_SIZE_MB', 64)) * 1024 * 1024
+# Unfinished uploads are forgotten after this many seconds without a chunk.
+UPLOAD_SESSION_TTL = int(os.getenv('UPLOAD_SESSION_TTL', 24 * 3600))
+UPLOAD_SWEEP_INTERVAL = int(os.getenv('UPLOAD_SWEEP_INTERVAL', 3600))
+
+S3_MIN_PART_SIZE = 5 * 1024 * 1024
+COPY_BUFFER_SIZE = 1024 * 1024
+
+UPLOAD_TARGETS = ('local', 's3')
+
+
+class UploadError(Exception):
+    """An upload request that cannot be served; `status` is the HTTP status."""
+
+    def __init__(self, message, status=400, offset=None):
+        super().__init__(message)
+        self.status = status
+        self.offset = offset
+
+
+class ChunkedUploads:
+    """Creates, fills and finalizes resumable uploads."""
+
+    def __init__(self, upload_folder, bucket_name, s3_folder, redis_url=REDIS_URL):
+        self.upload_folder = upload_folder
+        self.bucket_name = bucket_name
+        self.s3_folder = s3_folder
+        self._redis = redis.Redis.from_url(redis_url, socket_timeout=5, socket_connect_timeout=2)
+        self._last_sweep = 0.0
+
+    def create(self, filename, size, target='local', folder=None, content_type='application/octet-stream',
+               metadata=None):
+        """
+        Starts an upload of `size` bytes.
+
+        Args:
+            filename: Original name of the file
+            size: Total size in bytes
+            target: 'local' (upload folder) or 's3' (S3 upload folder)
+            folder: Sub-folder of the target, e.g. '2024-10-05/left_entry'
+            content_type: Content type of the stored object (S3 only)
+            metadata: JSON-serializable data kept with the session for the caller
+
+        Returns:
+            dict: The upload session
+        """
+        if target not in UPLOAD_TARGETS:
+            raise UploadError(f"Unknown upload target '{target}'")
+        if size <= 0:
+            raise UploadError("Upload size must be positive")
+
+        if time.time() - self._last_sweep >= UPLOAD_SWEEP_INTERVAL:
+            self.sweep_expired_parts()
+
+        upload_id = uuid.uuid4().hex
+        filename = secure_filename(filename)
+        folder_parts = [secure_filename(part) for part in (folder or '').split('/') if secure_filename(part)]
+        session = {'upload_id': upload_id, 'filename': filename, 'size': size, 'target': target,
+                   'status': 'uploading', 'metadata': metadata or {}}
+
+        if target == 'local':
+            directory = os.path.join(self.upload_folder, *folder_parts)
+            os.makedirs(directory, exist_ok=True)
+            session['path'] = os.path.join(directory, f"{upload_id[:8]}_{filename}")
+            open(session['path'] + '.part', 'wb').close()
+        else:
+            s3_key = '/'.join([self.s3_folder, *folder_parts, filename]) if self.s3_folder \
+                else '/'.join([*folder_parts, filename])
+            success, message, s3_upload_id = create_multipart_upload(self.bucket_name, s3_key, content_type)
+            if not success:
+                raise UploadError(message, status=502)
+            session.update(bucket=self.bucket_name, s3_key=s3_key, s3_upload_id=s3_upload_id, parts=[])
+
+        self._save(session)
+        logger.info(f"Created {target} upload {upload_id} for {filename} ({size} bytes)")
+        return session
+
+    def get(self, upload_id):
+        """Returns the upload session with its current offset, or None."""
+        payload = self._redis.get(self._key(upload_id))
+        if payload is None:
+            return None
+        session = json.loads(payload)
+        session['offset'] = self._offset(session)
+        return session
+
+    def write_chunk(self, upload_id, offset, stream, length):
+        """
+        Writes `length` bytes read from `stream` at `offset`, which must be
+        the current offset of the upload.
+
+        Returns:
+            int: The new offset
+        """
+        if length is None:
+            raise UploadError("Chunks need a Content-Length", status=411)
+        if length > UPLOAD_MAX_CHUNK_SIZE:
+            raise UploadError(f"Chunks may be at most {UPLOAD_MAX_CHUNK_SIZE} bytes", status=413)
+
+        with self._locked(upload_id):
+            session = self._require(upload_id)
+            if session['status'] != 'uploading':
+                raise UploadError("Upload is already complete", status=409, offset=session['offset'])
+            if offset != session['offset']:
+                raise UploadError("Offset does not match the upload", status=409, offset=session['offset'])
+            if offset + length > session['size']:
+                raise UploadError("Chunk goes past the end of the upload", offset=offset)
+
+            if session['target'] == 'local':
+                self._append_local(session, stream, length)
+            else:
+                self._upload_s3_part(session, stream, length)
+            self._save(session)
+            return self._offset(session)
+
+    def complete(self, upload_id):
+        """
+        Finalizes an upload once every byte has been received.
+
+        Returns:
+            dict: The upload session, with 'path' (local) or 's3_key' (S3)
+        """
+        with self._locked(upload_id):
+            session = self._require(upload_id)
+            if session['status'] == 'complete':
+                raise UploadError("Upload is already complete", status=409, offset=session['offset'])
+            if session['offset'] != session['size']:
+                raise UploadError("Upload is not complete", status=409, offset=session['offset'])
+
+            if session['target'] == 'local':
+                os.replace(session['path'] + '.part', session['path'])
+            else:
+                parts = [(number, etag) for number, etag, _ in session['parts']]
+                success, message = complete_multipart_upload(session['bucket'], session['s3_key'],
+                                                             session['s3_upload_id'], parts, size=session['size'])
+                if not success:
+                    raise UploadError(message, status=502)
+
+            session['status'] = 'complete'
+            self._save(session)
+            logger.info(f"Completed upload {upload_id} of {session['filename']}")
+            return session
+
+    def abort(self, upload_id):
+        """Discards an unfinished upload and the data received so far."""
+        with self._locked(upload_id):
+            session = self._require(upload_id)
+            if session['status'] == 'uploading':
+                if session['target'] == 'local':
+                    part_path = session['path'] + '.part'
+                    if os.path.exists(part_path):
+                        os.remove(part_path)
+                else:
+                    abort_multipart_upload(session['bucket'], session['s3_key'], session['s3_upload_id'])
+            self._redis.delete(self._key(upload_id))
+
+    def sweep_expired_parts(self, max_age=UPLOAD_SESSION_TTL):
+        """
+        Deletes the `.part` files of local uploads whose sessions have expired.
+        Every chunk both appends to the file and renews the session, so a file
+        untouched for longer than the session TTL has no session left.
+
+        Returns:
+            int: Number of files deleted
+        """
+        self._last_sweep = time.time()
+        cutoff = self._last_sweep - max_age
+        removed = 0
+        for directory, _, filenames in os.walk(self.upload_folder):
+            for filename in filenames:
+                if not filename.endswith('.part'):
+                    continue
+                path = os.path.join(directory, filename)
+                try:
+                    if os.path.getmtime(path) < cutoff:
+                        os.remove(path)
+                        removed += 1
+                except FileNotFoundError:
+                    continue  # Completed or swept by another process meanwhile
+        if removed:
+            logger.info(f"Deleted {removed} expired partial uploads from {self.upload_folder}")
+        return removed
+
+    def _append_local(self, session, stream, length):
+        # Appending at the current size; a dropped connection leaves the bytes
+        # received so far, and the offset reported to the client covers them.
+        remaining = length
+        with open(session['path'] + '.part', 'ab') as f:
+            while remaining > 0:
+                data = stream.read(min(COPY_BUFFER_SIZE, remaining))
+                if not data:
+                    break
+                f.write(data)
+                remaining -= len(data)
+        if remaining:
+            raise UploadError("Chunk ended early", offset=self._offset(session))
+
+    def _upload_s3_part(self, session, stream, length):
+        if session['offset'] + length < session['size'] and length < S3_MIN_PART_SIZE:
+            raise UploadError(f"Chunks other than the last must be at least {S3_MIN_PART_SIZE} bytes",
+                              offset=session['offset'])
+        data = bytearray()
+        while len(data) < length:
+            block = stream.read(min(COPY_BUFFER_SIZE, length - len(data)))
+            if not block:
+                raise UploadError("Chunk ended early", offset=session['offset'])
+            data.extend(block)
+
+        part_number = len(session['parts']) + 1
+        success, message, etag = upload_part(session['bucket'], session['s3_key'], session['s3_upload_id'],
+                                             part_number, bytes(data))
+        if not success:
+            raise UploadError(message, status=502, offset=session['offset'])
+        session['parts'].append([part_number, etag, length])
+
+    def _offset(self, session):
+        if session['status'] == 'complete':
+            return session['size']
+        if session['target'] == 'local':
+            part_path = session['path'] + '.part'
+            return os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        return sum(size for _, _, size in session['parts'])
+
+    def _require(self, upload_id):
+        session = self.get(upload_id)
+        if session is None:
+            raise UploadError("Unknown or expired upload", status=404)
+        return session
+
+    def _save(self, session):
+        stored = {key: value for key, value in session.items() if key != 'offset'}
+        self._redis.set(self._key(session['upload_id']), json.dumps(stored), ex=UPLOAD_SESSION_TTL)
+
+    @contextmanager
+    def _locked(self, upload_id):
+        # One request at a time per upload, so two chunks cannot both claim an offset.
+        lock_key = self._key(upload_id) + ':lock'
+        if not self._redis.set(lock_key, 1, nx=True, ex=300):
+            raise UploadError("Another request for this upload is in progress", status=409)
+        try:
+            yield
+        finally:
+            self._redis.delete(lock_key)
+
+    @staticmethod
+    def _key(upload_id):
+        return f"wagon:upload:{upload_id}"
@@ -0,0 +1,151 @@
+"""
+Extraction settings shared by the web app and the workers.
+
+Every setting comes from the environment. The web app needs them to build
+result cache keys (extraction_settings) without importing celery_worker and,
+through it, the model and video code.
+"""
+
+import json
+import logging
+import os
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# --- Inference ---
+# 'torch', 'onnx' or 'openvino'. Exported models are cached next to the weights.
+INFERENCE_BACKEND = os.environ.get('INFERENCE_BACKEND', 'torch')
+INFERENCE_IMGSZ = int(os.environ.get('INFERENCE_IMGSZ', 640))
+
+# Unix socket of the node's inference service (see inference_service). When
+# set, workers send their frames there to be batched with those of the other
+# jobs on the node, and load no model of their own.
+INFERENCE_SERVICE_SOCKET = os.environ.get('INFERENCE_SERVICE_SOCKET', '')
+
+# --- Extraction Settings ---
+# Number of frames sent through the model per call. Larger batches amortise
+# the per-call pre/post-processing overhead on CPU-only workers.
+YOLO_BATCH_SIZE = int(os.environ.get('YOLO_BATCH_SIZE', 8))
+
+# Overlap decoding and MP4 encoding with inference using bounded queues of
+# PIPELINE_QUEUE_SIZE frames each. Off by default: it only pays off when
+# inference leaves CPU time for the other stages (GPU, inference service),
+# and every queued frame is held in memory. With a model that does not use
+# the CPU, 1080p ran at 64 instead of 39 fps for 211 instead of 173 MB peak
+# RSS; with torch using every core it gains nothing unless an annotated
+# video is written.
+PIPELINED_EXTRACTION = os.environ.get('PIPELINED_EXTRACTION', '0') == '1'
+PIPELINE_QUEUE_SIZE = int(os.environ.get('PIPELINE_QUEUE_SIZE', 8))
+
+# Decode into a preallocated ring of frame arrays instead of a new array per
+# frame. Off by default: the allocator already recycles freed frames, while
+# the ring keeps every slot resident. On 200 frames at batch 8 without an
+# annotated video, 1080p peaked at 159 MB with per-frame arrays (163 MB for
+# the original extractor) and at 188 MB with the ring, which was also slower;
+# see benchmarks/bench_frame_memory.py.
+REUSE_FRAME_BUFFERS = os.environ.get('REUSE_FRAME_BUFFERS', '0') == '1'
+
+# While no wagon is in view, run the model only on every N-th frame. Without
+# pipelining or an annotated video the frames in between are only grabbed,
+# not converted, and decoded again only if the next probe shows a change.
+SEARCH_STRIDE = int(os.environ.get('SEARCH_STRIDE', 1))
+
+# Skip the model on frames where the scene has not changed since the last
+# inferred frame (empty track, standing train) and reuse its detections.
+# MOTION_THRESHOLD is the fraction of the downscaled region of interest that
+# must change for a frame to be inferred; lower is more sensitive.
+MOTION_GATE = os.environ.get('MOTION_GATE', '0') == '1'
+MOTION_THRESHOLD = float(os.environ.get('MOTION_THRESHOLD', 0.005))
+
+# 'opencv' or 'pyav' (multi-threaded FFmpeg decoding, needs the 'av' package).
+# DECODER_THREADS=0 lets FFmpeg choose. DECODE_SCALE < 1 decodes frames at a
+# lower resolution, e.g. 0.5 for 4K cameras, which also shrinks the captured
+# frames.
+VIDEO_DECODER = os.environ.get('VIDEO_DECODER', 'opencv')
+DECODER_THREADS = int(os.environ.get('DECODER_THREADS', 0))
+DECODE_SCALE = float(os.environ.get('DECODE_SCALE', 1.0))
+
+# Minimum seconds between progress updates of a running extraction.
+PROGRESS_INTERVAL = float(os.environ.get('PROGRESS_INTERVAL', 1.0))
+
+# Where captured wagon frames are written: 'local' (static folder) or 's3'.
+FRAME_STORAGE = os.environ.get('FRAME_STORAGE', 'local')
+FRAME_JPEG_QUALITY = int(os.environ.get('FRAME_JPEG_QUALITY', 95))
+S3_BUCKET = os.environ.get('S3_BUCKET_NAME', 'aispry-project')
+S3_FRAMES_FOLDER = os.environ.get('S3_FRAMES_FOLDER', 'extracted_frames')
+
+# Videos given as s3://bucket/key are decoded straight from a presigned URL,
+# which must stay valid for the whole extraction of a chunk.
+S3_VIDEO_URL_EXPIRATION = int(os.environ.get('S3_VIDEO_URL_EXPIRATION', 6 * 3600))
+
+# The annotated video is optional (off by default) since it costs a full
+# re-encode of the input. VIDEO_SCALE < 1 writes a lower-resolution preview
+# and VIDEO_FRAME_STEP > 1 writes only every n-th frame.
+ANNOTATE_VIDEO = os.environ.get('ANNOTATE_VIDEO', '0') == '1'
+VIDEO_CODEC = os.environ.get('VIDEO_CODEC', 'mp4v')
+VIDEO_SCALE = float(os.environ.get('VIDEO_SCALE', 1.0))
+VIDEO_FRAME_STEP = int(os.environ.get('VIDEO_FRAME_STEP', 1))
+VIDEO_QUALITY = int(os.environ['VIDEO_QUALITY']) if os.environ.get('VIDEO_QUALITY') else None
+
+# Per-camera inference settings: a region of interest (fractions of the frame,
+# [x1, y1, x2, y2]) that contains the whole wagon path, and an inference image
+# size. Entries are keyed by camera id; "default" applies to unknown cameras.
+CAMERA_CONFIG_PATH = os.environ.get('CAMERA_CONFIG_PATH', 'cameras.json')
+
+
+def load_camera_settings(path=CAMERA_CONFIG_PATH):
+    """Reads the per-camera settings file, returning {} if it is missing or invalid."""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logger.error(f"Could not read camera settings from {path}: {e}")
+        return {}
+
+
+CAMERA_SETTINGS = load_camera_settings()
+
+
+def get_camera_settings(camera_id=None):
+    """Returns the ROI/imgsz settings of a camera, or the default ones."""
+    settings = CAMERA_SETTINGS.get(camera_id) or CAMERA_SETTINGS.get('default') or {}
+    return {'roi': settings.get('roi'), 'imgsz': settings.get('imgsz')}
+
+
+# Split/merge processing of one video: seconds decoded on either side of a
+# chunk so wagons crossing a chunk boundary are still captured exactly once.
+CHUNK_OVERLAP_SECONDS = float(os.environ.get('CHUNK_OVERLAP_SECONDS', 20))
+MIN_CHUNK_SECONDS = float(os.environ.get('MIN_CHUNK_SECONDS', 60))
+
+
+def extraction_settings(batch_size=None, pipelined=None, search_stride=None, annotate_video=None,
+                        camera_id=None):
+    """
+    Returns the effective settings that change the result of an extraction,
+    used as part of the result cache key: everything that changes the model,
+    the decoded frames or the outputs, including the ROI and inference size
+    of `camera_id`. Batch size, pipelining and decoder threads do not change
+    the captured frames, so they are left out.
+    """
+    annotate_video = ANNOTATE_VIDEO if annotate_video is None else annotate_video
+    settings = {
+        'inference_backend': INFERENCE_BACKEND,
+        'inference_imgsz': INFERENCE_IMGSZ,
+        'video_decoder': VIDEO_DECODER,
+        'search_stride': search_stride or SEARCH_STRIDE,
+        'frame_storage': FRAME_STORAGE,
+        'jpeg_quality': FRAME_JPEG_QUALITY,
+        'annotate_video': bool(annotate_video),
+        **get_camera_settings(camera_id),
+    }
+    if MOTION_GATE:
+        settings['motion_threshold'] = MOTION_THRESHOLD
+    if DECODE_SCALE != 1.0:
+        settings['decode_scale'] = DECODE_SCALE
+    if annotate_video:
+        settings.update(video_codec=VIDEO_CODEC, video_scale=VIDEO_SCALE,
+                        video_frame_step=VIDEO_FRAME_STEP, video_quality=VIDEO_QUALITY)
+    return settings
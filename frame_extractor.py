@@ -1,13 +1,23 @@
 import cv2
+import numpy as np
 import os
 from ultralytics import YOLO
 import collections
+import itertools
 import logging
+import queue
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
 import torch
 import torch.nn as nn
 from ultralytics.nn.tasks import DetectionModel, SegmentationModel
 from ultralytics.nn.modules import Conv, C2f, Concat
 from ultralytics.nn.modules.block import Bottleneck
+from inference_service import InferenceClient, result_boxes
+from video_decoders import open_video
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -32,111 +42,838 @@ except AttributeError:
     logger.warning("Could not set safe globals for torch.serialization.")
 
 
-def extract_and_annotate_wagons(video_path, output_video_path, model, task=None):
+WAGON_STATE_SEARCHING = "SEARCHING_FOR_WAGON"
+WAGON_STATE_PASSING = "SINGLE_WAGON_PASSING"
+
+# Marks captures that fall outside the frame range an extraction call owns.
+_OUT_OF_RANGE = object()
+
+
+class WagonCaptureStateMachine:
+    """
+    Decides which frame to keep for every single wagon passing the camera.
+
+    Frames must be pushed in decode order together with the wagon boxes
+    detected on them. The frame kept for a wagon is the one seen
+    `capture_delay` frames before the last frame where exactly one wagon
+    was still visible.
+
+    If `on_capture` is given it is called as `on_capture(frame_img, frame_idx)`
+    as soon as a wagon frame is committed, and its return value is stored in
+    `saved_frames` instead of the image itself.
+    """
+
+    def __init__(self, capture_delay, on_capture=None):
+        self.frame_buffer = collections.deque(maxlen=capture_delay + 1)
+        self.state = WAGON_STATE_SEARCHING
+        self.potential_capture_frame_img = None
+        self.potential_capture_frame_idx = None
+        self.on_capture = on_capture
+        self.saved_frames = []
+
+    def push(self, frame, wagon_boxes, frame_idx=None):
+        """Feeds the next frame and its wagon boxes through the state machine."""
+        self.frame_buffer.append((frame, wagon_boxes, frame_idx))
+        if len(self.frame_buffer) < self.frame_buffer.maxlen:
+            return
+
+        num_current_wagon_boxes = len(wagon_boxes)
+        oldest_frame_img_in_buf, oldest_wagon_boxes_in_buf_coords, oldest_frame_idx = self.frame_buffer[0]
+        num_oldest_wagon_boxes_in_buf = len(oldest_wagon_boxes_in_buf_coords)
+
+        if self.state == WAGON_STATE_SEARCHING:
+            if num_current_wagon_boxes == 1:
+                self.state = WAGON_STATE_PASSING
+                self.potential_capture_frame_img = None
+        elif self.state == WAGON_STATE_PASSING:
+            if num_current_wagon_boxes == 1:
+                if num_oldest_wagon_boxes_in_buf == 1:
+                    self.potential_capture_frame_img = oldest_frame_img_in_buf.copy()
+                    self.potential_capture_frame_idx = oldest_frame_idx
+            else:
+                self._commit()
+                self.state = WAGON_STATE_SEARCHING
+
+    def finish(self):
+        """Commits the wagon still passing when the video ends, if any."""
+        if self.state == WAGON_STATE_PASSING:
+            self._commit()
+
+    def _commit(self):
+        if self.potential_capture_frame_img is not None:
+            if self.on_capture is not None:
+                self.saved_frames.append(self.on_capture(self.potential_capture_frame_img,
+                                                         self.potential_capture_frame_idx))
+            else:
+                self.saved_frames.append(self.potential_capture_frame_img)
+        self.potential_capture_frame_img = None
+        self.potential_capture_frame_idx = None
+
+
+def detect_wagon_boxes(model, frames, wagon_class_id, confidence_threshold, imgsz=None, offset=(0, 0)):
+    """
+    Runs the model once over a batch of frames.
+
+    Args:
+        model (YOLO or InferenceClient): A local model, or a client of the
+            node's inference service.
+        imgsz (int, optional): Inference image size; the model default if None.
+        offset (tuple, optional): (x, y) added to every box, to map boxes found
+            on cropped frames back to full-frame coordinates.
+
+    Returns:
+        list: One list of wagon box coordinates (xyxy) per input frame.
+    """
+    if isinstance(model, InferenceClient):
+        boxes_per_frame = model.predict_boxes(frames, confidence_threshold, imgsz=imgsz)
+    else:
+        if imgsz:
+            results = model(frames, verbose=False, conf=confidence_threshold, imgsz=imgsz)
+        else:
+            results = model(frames, verbose=False, conf=confidence_threshold)
+        boxes_per_frame = [result_boxes(result) for result in results]
+    offset_x, offset_y = offset
+
+    wagon_boxes_per_frame = []
+    for boxes in boxes_per_frame:
+        current_detected_wagon_boxes_coords = []
+        for cls_id, conf, x1, y1, x2, y2 in boxes:
+            if cls_id == wagon_class_id and conf >= confidence_threshold:
+                current_detected_wagon_boxes_coords.append([x1 + offset_x, y1 + offset_y,
+                                                           x2 + offset_x, y2 + offset_y])
+        wagon_boxes_per_frame.append(current_detected_wagon_boxes_coords)
+    return wagon_boxes_per_frame
+
+
+class FrameRing:
+    """
+    A ring of preallocated frame arrays that the decoder reads into.
+
+    Slots are handed out in rotation, so a slot is only overwritten after
+    `size - 1` further frames have been decoded. The ring must therefore be
+    larger than the number of frames any stage holds on to at the same time.
+    """
+
+    def __init__(self, size, frame_height, frame_width, channels=3):
+        self.slots = [np.empty((frame_height, frame_width, channels), dtype=np.uint8) for _ in range(size)]
+        self.position = 0
+
+    def read(self, cap):
+        """Decodes the next frame into the next slot, like `cap.read()`."""
+        slot = self.position
+        self.position = (self.position + 1) % len(self.slots)
+        ret, frame = cap.read(self.slots[slot])
+        if ret and frame is not self.slots[slot]:
+            # The decoder allocated a new array (unexpected frame size); keep
+            # reusing that one from now on.
+            self.slots[slot] = frame
+        return ret, frame
+
+
+class MotionGate:
+    """
+    Tells whether a frame changed enough since the last inferred frame to be
+    worth running the model on.
+
+    Frames are compared as small grayscale thumbnails against a reference:
+    the last frame that needed inference. A frame is static when fewer than
+    `threshold` (a fraction of the thumbnail) of its pixels differ from the
+    reference by more than `pixel_delta` grey levels; it can then reuse the
+    reference's detections. Since the reference only moves on inferred
+    frames, slow changes add up until they trigger inference.
+
+    `threshold` is the sensitivity: a wagon entering the view changes a large
+    part of it, so small values never miss one, and 0 sends every frame to
+    the model.
+    """
+
+    def __init__(self, threshold, pixel_delta=20, width=160, region=None):
+        self.threshold = threshold
+        self.pixel_delta = pixel_delta
+        self.width = width
+        self.region = region
+        self.size = None
+        self.reference = None
+
+    def _thumbnail(self, frame):
+        if self.region is not None:
+            x1, y1, x2, y2 = self.region
+            frame = frame[y1:y2, x1:x2]
+        if self.size is None:
+            height, width = frame.shape[:2]
+            scale = min(1.0, self.width / width)
+            self.size = (max(1, int(width * scale)), max(1, int(height * scale)))
+        # Averaging down to a thumbnail also smooths out sensor and compression noise.
+        thumbnail = cv2.resize(frame, self.size, interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(thumbnail, cv2.COLOR_BGR2GRAY)
+
+    def needs_inference(self, frame):
+        """
+        Returns False if `frame` is static. Otherwise returns True and makes
+        it the new reference, as it is about to be inferred.
+        """
+        thumbnail = self._thumbnail(frame)
+        if self.reference is not None:
+            changed = np.count_nonzero(cv2.absdiff(thumbnail, self.reference) > self.pixel_delta)
+            if changed < self.threshold * thumbnail.size:
+                return False
+        self.reference = thumbnail
+        return True
+
+
+def get_video_info(video_path):
+    """
+    Reads the basic properties of a video without decoding it.
+
+    Returns:
+        dict: frame_count, fps, width and height, or None if it can't be opened.
+    """
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        return None
+    try:
+        return {
+            'frame_count': int(cap.get(cv2.CAP_PROP_FRAME_COUNT)),
+            'fps': cap.get(cv2.CAP_PROP_FPS),
+            'width': int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            'height': int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+        }
+    finally:
+        cap.release()
+
+
+def concatenate_videos(segment_paths, output_path):
+    """
+    Joins video segments, in the given order, into a single file.
+
+    Uses the ffmpeg concat demuxer (stream copy, no re-encode) when ffmpeg is
+    installed and falls back to re-encoding through OpenCV otherwise.
+    """
+    segment_paths = [path for path in segment_paths if os.path.exists(path)]
+    if not segment_paths:
+        logger.warning(f"No video segments to concatenate into {output_path}")
+        return False
+
+    if shutil.which('ffmpeg'):
+        with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False) as list_file:
+            for path in segment_paths:
+                list_file.write(f"file '{os.path.abspath(path)}'\n")
+        try:
+            subprocess.run(['ffmpeg', '-y', '-loglevel', 'error', '-f', 'concat', '-safe', '0',
+                            '-i', list_file.name, '-c', 'copy', output_path], check=True)
+            return True
+        except subprocess.CalledProcessError as e:
+            logger.warning(f"ffmpeg concat failed ({e}); re-encoding segments with OpenCV.")
+        finally:
+            os.remove(list_file.name)
+
+    video_writer = None
+    try:
+        for path in segment_paths:
+            cap = cv2.VideoCapture(path)
+            if video_writer is None:
+                size = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+                video_writer = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*'mp4v'),
+                                               cap.get(cv2.CAP_PROP_FPS), size)
+            while True:
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                video_writer.write(frame)
+            cap.release()
+    finally:
+        if video_writer is not None:
+            video_writer.release()
+    return True
+
+
+def _read_batches(cap, batch_size, timings, ring=None):
+    """Yields lists of up to `batch_size` decoded frames until the video ends."""
+    while cap.isOpened():
+        batch = []
+        start = time.perf_counter()
+        while len(batch) < batch_size:
+            ret, frame = ring.read(cap) if ring is not None else cap.read()
+            if not ret:
+                break
+            batch.append(frame)
+        timings['decode'] += time.perf_counter() - start
+        if not batch:
+            return
+        yield batch
+        if len(batch) < batch_size:
+            return
+
+
+class _DecoderThread(threading.Thread):
+    """
+    Decodes frames ahead of the inference stage into a bounded queue. When
+    the queue is full the thread blocks, so it never runs further ahead than
+    `queue_size` frames, whatever the inference batch size.
+    """
+
+    def __init__(self, cap, queue_size, timings, ring=None):
+        super().__init__(name='frame-decoder', daemon=True)
+        self.cap = cap
+        self.ring = ring
+        self.timings = timings
+        self.frames = queue.Queue(maxsize=queue_size)
+        self.stop_event = threading.Event()
+        self.error = None
+
+    def run(self):
+        try:
+            for batch in _read_batches(self.cap, 1, self.timings, self.ring):
+                if not self._put(batch[0]):
+                    return
+        except Exception as e:
+            self.error = e
+        self._put(None)
+
+    def _put(self, item):
+        while not self.stop_event.is_set():
+            try:
+                self.frames.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def __iter__(self):
+        while True:
+            frame = self.frames.get()
+            if frame is None:
+                if self.error is not None:
+                    raise self.error
+                return
+            yield frame
+
+    def stop(self):
+        self.stop_event.set()
+        self.join()
+
+
+class _VideoAnnotator:
+    """
+    Draws wagon boxes on frames and encodes them into the output video.
+
+    Frames are drawn on a private canvas (optionally downscaled) so the decoded
+    frames, which are shared with the capture buffer, are never modified.
+    """
+
+    BOX_COLOR = (0, 255, 0)
+
+    def __init__(self, video_writer, size, scale, timings):
+        self.video_writer = video_writer
+        self.scale = scale
+        self.size = size
+        self.canvas = np.empty((self.size[1], self.size[0], 3), dtype=np.uint8)
+        self.timings = timings
+
+    def write(self, frame, wagon_boxes):
+        start = time.perf_counter()
+        if self.scale != 1.0:
+            cv2.resize(frame, self.size, dst=self.canvas, interpolation=cv2.INTER_AREA)
+        elif frame.shape == self.canvas.shape:
+            np.copyto(self.canvas, frame)
+        else:
+            self.canvas = frame.copy()
+        for x1, y1, x2, y2 in wagon_boxes:
+            cv2.rectangle(self.canvas, (int(x1 * self.scale), int(y1 * self.scale)),
+                          (int(x2 * self.scale), int(y2 * self.scale)), self.BOX_COLOR, 2)
+        self.video_writer.write(self.canvas)
+        self.timings['encode'] += time.perf_counter() - start
+
+
+class _WriterThread(threading.Thread):
+    """Annotates and encodes frames from a bounded queue, in order."""
+
+    def __init__(self, annotator, queue_size):
+        super().__init__(name='frame-writer', daemon=True)
+        self.annotator = annotator
+        self.frames = queue.Queue(maxsize=queue_size)
+        self.error = None
+
+    def run(self):
+        while True:
+            item = self.frames.get()
+            if item is None:
+                return
+            if self.error is not None:
+                continue  # Keep draining so the producer never blocks.
+            try:
+                self.annotator.write(*item)
+            except Exception as e:
+                self.error = e
+
+    def write(self, frame, wagon_boxes):
+        self.frames.put((frame, wagon_boxes))
+
+    def close(self):
+        self.frames.put(None)
+        self.join()
+        if self.error is not None:
+            raise self.error
+
+
+class _ProgressReporter(threading.Thread):
+    """
+    Sends task progress updates from a background thread.
+
+    The extraction loop only checks `due()` (a clock read) and, at most once
+    per `interval` seconds, hands over the latest progress with `report()`.
+    Updates are sent by this thread, so a slow result backend never stalls
+    the loop; if it falls behind, older updates are replaced by newer ones.
+    """
+
+    def __init__(self, task, first_frame, last_frame, interval=1.0):
+        super().__init__(name='progress-reporter', daemon=True)
+        self.task = task
+        # Celery keeps the request of a task local to the thread running it,
+        # so the id is read here and passed explicitly from this thread.
+        self.task_id = getattr(getattr(task, 'request', None), 'id', None)
+        self.first_frame = first_frame
+        self.last_frame = last_frame
+        self.interval = interval
+        self.started_at = time.perf_counter()
+        self.next_report_at = self.started_at + interval
+        self.pending = None
+        self.closed = False
+        self.condition = threading.Condition()
+
+    def due(self):
+        return time.perf_counter() >= self.next_report_at
+
+    def report(self, frame_idx, wagons_captured, timings, frames_gated=None):
+        now = time.perf_counter()
+        self.next_report_at = now + self.interval
+        elapsed = now - self.started_at
+        frames_done = frame_idx - self.first_frame
+        fps = frames_done / elapsed if elapsed > 0 else 0.0
+
+        meta = {'frame': frame_idx, 'total_frames': self.last_frame, 'fps': round(fps, 1),
+                'wagons_captured': wagons_captured,
+                'stage_timings': {stage: round(seconds, 3) for stage, seconds in timings.items()}}
+        if frames_gated is not None:
+            meta['frames_gated'] = frames_gated
+            meta['gated_fraction'] = round(frames_gated / frames_done, 3) if frames_done > 0 else 0.0
+        status = f'Processing frame {frame_idx}/{self.last_frame}'
+        if self.last_frame > self.first_frame:
+            done = min(1.0, max(0.0, frames_done / (self.last_frame - self.first_frame)))
+            meta['progress'] = 10 + int(done * 80)
+            if fps > 0:
+                meta['eta_seconds'] = round(max(0, self.last_frame - frame_idx) / fps)
+                status += f" - {fps:.0f} fps, {meta['eta_seconds'] // 60}m {meta['eta_seconds'] % 60:02d}s left"
+        meta['status'] = f'{status} - {wagons_captured} wagons'
+
+        with self.condition:
+            self.pending = meta
+            self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.pending is None and not self.closed:
+                    self.condition.wait()
+                meta, self.pending = self.pending, None
+            if meta is None:
+                return
+            try:
+                self.task.update_state(task_id=self.task_id, state='PROGRESS', meta=meta)
+            except Exception as e:
+                logger.warning(f"Could not send progress update: {e}")
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.join()
+
+
+def extract_and_annotate_wagons(video_path, output_video_path, model, task=None, batch_size=1,
+                                pipelined=False, queue_size=8, search_stride=1, on_capture=None,
+                                reuse_frame_buffers=False, start_frame=0, end_frame=None, overlap_frames=0,
+                                video_codec='mp4v', video_scale=1.0, video_frame_step=1, video_quality=None,
+                                roi=None, imgsz=None, progress_interval=1.0, motion_threshold=None,
+                                decoder='opencv', decoder_threads=0, decode_scale=1.0):
     """
     Processes a video to detect wagons using a pre-loaded YOLO model,
-    returns annotated frames, and creates an annotated video, while updating
+    returns annotated frames, and optionally creates an annotated video, while updating
     Celery task progress.
 
     Args:
         video_path (str): Path to the input video file.
-        output_video_path (str): Path to save the annotated output video.
+        output_video_path (str): Path to save the annotated output video, with
+            the detected wagon boxes drawn on it. None skips the video.
         model (YOLO): The pre-loaded YOLO model instance.
         task (celery.Task, optional): Celery task instance for progress updates.
+        batch_size (int, optional): Number of decoded frames sent through the
+            model in a single call. Captured frames do not depend on it.
+        pipelined (bool, optional): Decode and encode on their own threads,
+            connected to the inference stage by bounded queues.
+        queue_size (int, optional): Capacity of each pipeline queue, in frames.
+        search_stride (int, optional): While searching for a wagon, infer only
+            every `search_stride`-th frame and fall back to dense detection
+            around wagon count changes. 1 infers every frame.
+        on_capture (callable, optional): Called with `(frame_img, frame_idx)`
+            for every captured wagon frame as soon as it is committed. Its
+            return value (e.g. a file reference) replaces the image in the
+            returned list, so captured frames need not be held in memory.
+        reuse_frame_buffers (bool, optional): Decode into a preallocated ring
+            of frame arrays instead of allocating a new array per frame. A
+            frame is only copied when it becomes a capture candidate.
+        start_frame (int, optional): First frame (0-based) of the range this
+            call is responsible for.
+        end_frame (int, optional): End (exclusive) of that range; None means
+            the end of the video.
+        overlap_frames (int, optional): Frames decoded before `start_frame` to
+            settle the state machine, and the most frames decoded past
+            `end_frame` to finish a wagon that is still passing. Only frames
+            inside the range are written to the output video, and only wagons
+            whose captured frame lies inside it are kept, so adjacent ranges
+            processed independently produce each wagon exactly once.
+        video_codec (str, optional): FourCC of the annotated video encoder,
+            e.g. 'mp4v', 'avc1' or 'MJPG'.
+        video_scale (float, optional): Scale of the annotated video relative
+            to the input, e.g. 0.5 for a lower-resolution preview.
+        video_frame_step (int, optional): Write only every n-th frame to the
+            annotated video (at fps / n), e.g. for a keyframe-only preview.
+        video_quality (int, optional): Encoder quality (0-100) for codecs that
+            support it.
+        roi (tuple, optional): Region of interest (x1, y1, x2, y2) as fractions
+            of the frame size. Only this region is passed to the model; boxes
+            are mapped back to full-frame coordinates. It must contain the
+            whole area wagons pass through, or wagon counts will change.
+        imgsz (int, optional): Inference image size. Smaller sizes cut the
+            per-frame inference cost; the model default if None.
+        progress_interval (float, optional): Minimum seconds between task
+            progress updates. Updates (frame, fps, ETA, wagons captured so
+            far and stage timings) are sent from a background thread.
+        motion_threshold (float, optional): Enables the motion gate (see
+            MotionGate): frames where less than this fraction of the
+            downscaled region of interest changed since the last inferred
+            frame reuse its detections instead of running the model. Lower
+            values are more sensitive. None infers every frame.
+        decoder (str, optional): Video decoder, 'opencv' or 'pyav' (see
+            video_decoders). Falls back to 'opencv' if PyAV is not installed.
+        decoder_threads (int, optional): Decoding threads of the 'pyav'
+            decoder; 0 lets FFmpeg choose.
+        decode_scale (float, optional): Size of the decoded frames relative
+            to the video, e.g. 0.5 to decode 4K recordings at 1080p. Boxes,
+            captured frames and the annotated video all use the decoded size.
+
+    Returns:
+        tuple: (int saved frame count, list saved frames or `on_capture`
+        results, dict stats) where stats holds the number of processed,
+        inferred, skipped, gated and grabbed (never converted) frames and
+        per-stage timings. Frame indices
+        passed to `on_capture` are 1-based positions in the whole video.
     """
     # --- Configuration ---
     CONFIDENCE_THRESHOLD = 0.6
     WAGON_CLASS_ID = 1
     CAPTURE_DELAY = 5
-    FRAME_BUFFER_SIZE = CAPTURE_DELAY + 1
+    batch_size = max(1, int(batch_size))
+    queue_size = max(1, int(queue_size))
+    search_stride = max(1, int(search_stride))
+    start_frame = max(0, int(start_frame))
+    seek_frame = max(0, start_frame - int(overlap_frames))
 
     if model is None:
         logger.error("YOLO model is not loaded. Aborting extraction.")
         if task:
             task.update_state(state='FAILURE', meta={'status': 'Model not loaded.'})
-        return 0, []
+        return 0, [], {}
 
-    try:
-        output_video_dir = os.path.dirname(output_video_path)
-        os.makedirs(output_video_dir, exist_ok=True)
-    except Exception as e:
-        logger.error(f"Error creating output video directory: {e}")
-        return 0, []
+    if output_video_path:
+        try:
+            output_video_dir = os.path.dirname(output_video_path)
+            os.makedirs(output_video_dir, exist_ok=True)
+        except Exception as e:
+            logger.error(f"Error creating output video directory: {e}")
+            return 0, [], {}
 
-    cap = cv2.VideoCapture(video_path)
+    try:
+        cap = open_video(video_path, decoder, scale=decode_scale, threads=decoder_threads)
+    except ImportError as e:
+        logger.error(f"{e} Falling back to the OpenCV decoder.")
+        decoder = 'opencv'
+        cap = open_video(video_path, decoder, scale=decode_scale)
     if not cap.isOpened():
         logger.error(f"Error: Could not open video file {video_path}")
-        return 0, []
+        return 0, [], {}
 
-    frame_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-    frame_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-    fps = cap.get(cv2.CAP_PROP_FPS)
-    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    frame_width = cap.width
+    frame_height = cap.height
+    fps = cap.fps
+    total_frames = cap.frame_count
 
-    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-    video_writer = cv2.VideoWriter(output_video_path, fourcc, fps, (frame_width, frame_height))
+    if seek_frame > 0:
+        cap.seek(seek_frame)
+    last_frame = total_frames if end_frame is None else min(total_frames, end_frame)
+    if total_frames <= 0 and end_frame is not None:
+        last_frame = end_frame
 
-    frame_buffer = collections.deque(maxlen=FRAME_BUFFER_SIZE)
-    current_capture_state = "SEARCHING_FOR_WAGON"
-    potential_capture_frame_img = None
-    saved_frame_count = 0
-    saved_frames = []
-    frame_idx = 0
+    def in_range(idx):
+        return start_frame < idx and (end_frame is None or idx <= end_frame)
 
-    logger.info(f"Processing video: {video_path}...")
-    while cap.isOpened():
-        ret, frame = cap.read()
-        if not ret:
-            break
+    def commit_capture(frame_img, idx):
+        if not in_range(idx):
+            return _OUT_OF_RANGE
+        return on_capture(frame_img, idx) if on_capture is not None else frame_img
 
-        frame_idx += 1
-        
-        if task and total_frames > 0 and frame_idx % 20 == 0:
-            progress = 10 + int((frame_idx / total_frames) * 80)
-            task.update_state(state='PROGRESS', meta={'status': f'Processing frame {frame_idx}/{total_frames}', 'progress': progress})
+    timings = {'decode': 0.0, 'inference': 0.0, 'capture': 0.0, 'encode': 0.0}
 
-        original_frame_for_buffer = frame.copy()
-        annotated_frame_for_video = frame.copy()
+    video_frame_step = max(1, int(video_frame_step))
+    video_writer = annotator = None
+    if output_video_path:
+        video_size = (max(2, int(frame_width * video_scale)), max(2, int(frame_height * video_scale)))
+        fourcc = cv2.VideoWriter_fourcc(*video_codec)
+        video_writer = cv2.VideoWriter(output_video_path, fourcc, fps / video_frame_step, video_size)
+        if video_quality is not None:
+            video_writer.set(cv2.VIDEOWRITER_PROP_QUALITY, video_quality)
+        annotator = _VideoAnnotator(video_writer, video_size, video_scale, timings)
+    capture = WagonCaptureStateMachine(CAPTURE_DELAY, on_capture=commit_capture)
+    frame_idx = seek_frame
 
-        results = model(original_frame_for_buffer, verbose=False, conf=CONFIDENCE_THRESHOLD)
+    ring = None
+    if reuse_frame_buffers:
+        # Every frame that can be alive at once: the capture buffer, the window
+        # being inferred, the rest of the current decoded batch and, when
+        # pipelined, everything queued for or held by the decoder and, if an
+        # annotated video is written, the writer.
+        ring_size = CAPTURE_DELAY + 1 + max(batch_size, search_stride) + batch_size
+        if pipelined:
+            ring_size += queue_size + 1
+            if annotator is not None:
+                ring_size += queue_size + 1
+        ring = FrameRing(ring_size, frame_height, frame_width)
 
-        current_detected_wagon_boxes_coords = []
-        if results and results[0].boxes:
-            for box_obj in results[0].boxes:
-                conf = box_obj.conf.item()
-                cls_id = int(box_obj.cls.item())
-
-                if cls_id == WAGON_CLASS_ID and conf >= CONFIDENCE_THRESHOLD:
-                    current_detected_wagon_boxes_coords.append(box_obj.xyxy.cpu().numpy().flatten().tolist())
-
-        video_writer.write(annotated_frame_for_video)
-        frame_buffer.append((original_frame_for_buffer, current_detected_wagon_boxes_coords))
-
-        if len(frame_buffer) == FRAME_BUFFER_SIZE:
-            num_current_wagon_boxes = len(current_detected_wagon_boxes_coords)
-            oldest_frame_img_in_buf, oldest_wagon_boxes_in_buf_coords = frame_buffer[0]
-            num_oldest_wagon_boxes_in_buf = len(oldest_wagon_boxes_in_buf_coords)
-
-            if current_capture_state == "SEARCHING_FOR_WAGON":
-                if num_current_wagon_boxes == 1:
-                    current_capture_state = "SINGLE_WAGON_PASSING"
-                    potential_capture_frame_img = None
-            elif current_capture_state == "SINGLE_WAGON_PASSING":
-                if num_current_wagon_boxes == 1:
-                    if num_oldest_wagon_boxes_in_buf == 1:
-                        potential_capture_frame_img = oldest_frame_img_in_buf.copy()
+    # Without a decoder thread or an annotated video, the frames that the
+    # search stride skips are only needed when the probe after them shows a
+    # change. They are then grabbed without conversion and decoded again in
+    # that case only. Frames are read one at a time so the decoder never runs
+    # ahead of the window being processed.
+    grab_skipped_frames = search_stride > 1 and not pipelined and annotator is None
+
+    decoder_thread = writer = None
+    if pipelined:
+        decoder_thread = _DecoderThread(cap, queue_size, timings, ring)
+        decoder_thread.start()
+        frames = iter(decoder_thread)
+    else:
+        batches = _read_batches(cap, 1 if grab_skipped_frames else batch_size, timings, ring)
+        frames = itertools.chain.from_iterable(batches)
+
+    write_frame = None
+    if annotator is not None:
+        if pipelined:
+            writer = _WriterThread(annotator, queue_size)
+            writer.start()
+            write_frame = writer.write
+        else:
+            write_frame = annotator.write
+
+    frames_inferred = 0
+    frames_skipped = 0
+    frames_gated = 0
+    frames_grabbed = 0
+
+    roi_box = None
+    if roi is not None:
+        roi_box = (
+            min(max(int(roi[0] * frame_width), 0), frame_width - 1),
+            min(max(int(roi[1] * frame_height), 0), frame_height - 1),
+            min(max(int(round(roi[2] * frame_width)), 1), frame_width),
+            min(max(int(round(roi[3] * frame_height)), 1), frame_height),
+        )
+
+    motion_gate = None
+    if motion_threshold is not None:
+        motion_gate = MotionGate(motion_threshold, region=roi_box)
+        timings['motion_gate'] = 0.0
+
+    def gate(frames_to_check):
+        # Whether each frame changed enough since the last inferred one to need the model
+        start = time.perf_counter()
+        needed = [motion_gate.needs_inference(frame) for frame in frames_to_check]
+        timings['motion_gate'] += time.perf_counter() - start
+        return needed
+
+    def grab_window():
+        # The first search_stride - 1 frames of the window are grabbed, the
+        # last one (the probe) is decoded; grabbed frames are None.
+        nonlocal frames_grabbed
+        start = time.perf_counter()
+        grabbed = 0
+        while grabbed < search_stride - 1 and cap.grab():
+            grabbed += 1
+        timings['decode'] += time.perf_counter() - start
+        frames_grabbed += grabbed
+        probe = next(frames, None)
+        return [None] * grabbed + ([probe] if probe is not None else [])
+
+    def decode_grabbed(window, first_frame):
+        # Decodes the grabbed frames of a window that starts at `first_frame`
+        # after all, leaving the decoder where it was.
+        nonlocal frames_grabbed
+        grabbed = sum(frame is None for frame in window)
+        start = time.perf_counter()
+        cap.seek(first_frame)
+        decoded = []
+        for _ in range(grabbed):
+            ret, frame = ring.read(cap) if ring is not None else cap.read()
+            if not ret:
+                break
+            decoded.append(frame)
+        if len(decoded) < len(window):
+            cap.grab()
+        timings['decode'] += time.perf_counter() - start
+        frames_grabbed -= len(decoded)
+        if len(decoded) < grabbed:
+            raise RuntimeError(f"Could not decode frames {first_frame}-{first_frame + grabbed} again")
+        return decoded + window[grabbed:]
+
+    def infer(frames_to_infer):
+        nonlocal frames_inferred
+        start = time.perf_counter()
+        offset = (0, 0)
+        if roi_box is not None:
+            # Crops are views into the decoded frames, so cropping copies nothing.
+            x1, y1, x2, y2 = roi_box
+            frames_to_infer = [frame[y1:y2, x1:x2] for frame in frames_to_infer]
+            offset = (x1, y1)
+        wagon_boxes = []
+        for i in range(0, len(frames_to_infer), batch_size):
+            wagon_boxes.extend(detect_wagon_boxes(model, frames_to_infer[i:i + batch_size],
+                                                  WAGON_CLASS_ID, CONFIDENCE_THRESHOLD,
+                                                  imgsz=imgsz, offset=offset))
+        frames_inferred += len(frames_to_infer)
+        timings['inference'] += time.perf_counter() - start
+        return wagon_boxes
+
+    logger.info(f"Processing video: {video_path} (batch size {batch_size}, pipelined={pipelined}, "
+                f"search stride {search_stride}, motion threshold {motion_threshold})...")
+    started_at = time.perf_counter()
+    last_wagon_boxes = []
+    reporter = None
+    if task:
+        reporter = _ProgressReporter(task, seek_frame, last_frame, progress_interval)
+        reporter.start()
+    try:
+        while True:
+            if end_frame is not None and frame_idx >= end_frame:
+                # Past the range: keep going only while a wagon that may still
+                # be captured inside the range is passing.
+                settled = capture.state == WAGON_STATE_SEARCHING and frame_idx >= end_frame + CAPTURE_DELAY
+                if settled or frame_idx >= end_frame + overlap_frames:
+                    break
+
+            if search_stride > 1 and capture.state == WAGON_STATE_SEARCHING:
+                # Only the last frame of each stride window is inferred. If its
+                # wagon count differs from the previous result (or a single
+                # wagon shows up) the rest of the window is inferred as well,
+                # so the state machine sees the transition frame by frame.
+                window_start = frame_idx
+                if grab_skipped_frames:
+                    window = grab_window()
+                    if window and window[-1] is None:
+                        # The video ended before the probe
+                        window = decode_grabbed(window, window_start)
+                else:
+                    window = list(itertools.islice(frames, search_stride))
+                if not window:
+                    break
+                if motion_gate is not None and not gate(window[-1:])[0]:
+                    # Nothing moved since the last inferred frame
+                    window_wagon_boxes = [last_wagon_boxes] * len(window)
+                    frames_gated += len(window)
                 else:
-                    if potential_capture_frame_img is not None:
-                        saved_frames.append(potential_capture_frame_img)
-                        saved_frame_count += 1
-                    potential_capture_frame_img = None
-                    current_capture_state = "SEARCHING_FOR_WAGON"
-
-    if current_capture_state == "SINGLE_WAGON_PASSING" and potential_capture_frame_img is not None:
-        saved_frames.append(potential_capture_frame_img)
-        saved_frame_count += 1
-
-    cap.release()
-    video_writer.release()
-    logger.info(f"Processing complete. Extracted {saved_frame_count} individual wagon frames.")
-    return saved_frame_count, saved_frames
+                    probe_wagon_boxes = infer(window[-1:])[0]
+                    if len(probe_wagon_boxes) != len(last_wagon_boxes) or len(probe_wagon_boxes) == 1:
+                        if window[0] is None:
+                            window = decode_grabbed(window, window_start)
+                        window_wagon_boxes = infer(window[:-1]) + [probe_wagon_boxes]
+                    else:
+                        window_wagon_boxes = [last_wagon_boxes] * (len(window) - 1) + [probe_wagon_boxes]
+                        frames_skipped += len(window) - 1
+            else:
+                window = list(itertools.islice(frames, batch_size))
+                if not window:
+                    break
+                if motion_gate is not None:
+                    # Static frames take the boxes of the last inferred frame
+                    # before them; the changed ones are inferred in one call.
+                    needed = gate(window)
+                    inferred_wagon_boxes = iter(infer([frame for frame, needs in zip(window, needed) if needs]))
+                    window_wagon_boxes = []
+                    wagon_boxes = last_wagon_boxes
+                    for needs in needed:
+                        if needs:
+                            wagon_boxes = next(inferred_wagon_boxes)
+                        window_wagon_boxes.append(wagon_boxes)
+                    frames_gated += needed.count(False)
+                else:
+                    window_wagon_boxes = infer(window)
+
+            for frame, current_detected_wagon_boxes_coords in zip(window, window_wagon_boxes):
+                frame_idx += 1
+
+                # Frames are never modified downstream (boxes are drawn on the
+                # annotator's own canvas), so the decoded array is shared by the
+                # writer and the capture buffer. The state machine copies a
+                # frame only when it becomes a capture candidate.
+                if write_frame is not None and in_range(frame_idx) \
+                        and (frame_idx - start_frame - 1) % video_frame_step == 0:
+                    write_frame(frame, current_detected_wagon_boxes_coords)
+
+                start = time.perf_counter()
+                capture.push(frame, current_detected_wagon_boxes_coords, frame_idx)
+                timings['capture'] += time.perf_counter() - start
+            last_wagon_boxes = window_wagon_boxes[-1]
+
+            if reporter is not None and reporter.due():
+                wagons_captured = sum(saved is not _OUT_OF_RANGE for saved in capture.saved_frames)
+                reporter.report(frame_idx, wagons_captured, timings,
+                                frames_gated if motion_gate is not None else None)
+    finally:
+        if reporter is not None:
+            reporter.close()
+        if decoder_thread is not None:
+            decoder_thread.stop()
+        if writer is not None:
+            writer.close()
+        cap.release()
+        if video_writer is not None:
+            video_writer.release()
+
+    capture.finish()
+    saved_frames = [saved for saved in capture.saved_frames if saved is not _OUT_OF_RANGE]
+    saved_frame_count = len(saved_frames)
+    wall_time = time.perf_counter() - started_at
+
+    stats = {
+        'frames_processed': frame_idx - seek_frame,
+        'start_frame': start_frame,
+        'end_frame': end_frame,
+        'batch_size': batch_size,
+        'pipelined': pipelined,
+        'search_stride': search_stride,
+        'reuse_frame_buffers': reuse_frame_buffers,
+        'decoder': decoder,
+        'decode_scale': decode_scale,
+        'annotated_video': bool(output_video_path),
+        'roi': list(roi_box) if roi_box is not None else None,
+        'imgsz': imgsz,
+        'frames_inferred': frames_inferred,
+        'frames_skipped': frames_skipped,
+        'motion_threshold': motion_threshold,
+        'frames_gated': frames_gated,
+        'frames_grabbed': frames_grabbed,
+        'gated_fraction': round(frames_gated / (frame_idx - seek_frame), 3) if frame_idx > seek_frame else 0.0,
+        'wall_time': round(wall_time, 3),
+        'fps': round((frame_idx - seek_frame) / wall_time, 2) if wall_time > 0 else 0.0,
+        'stage_timings': {stage: round(seconds, 3) for stage, seconds in timings.items()},
+    }
+    logger.info(f"Processing complete. Extracted {saved_frame_count} individual wagon frames. Stats: {stats}")
+    return saved_frame_count, saved_frames, stats
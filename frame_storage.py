@@ -0,0 +1,125 @@
+"""
+Storage for captured wagon frames.
+
+Frames are JPEG-encoded and written out (to the local static folder or to S3)
+as soon as the extractor commits them, so a task only has to keep small
+references to its frames instead of the images themselves.
+"""
+
+import collections
+import io
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+
+from s3_utils import upload_file_to_s3, generate_presigned_url
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+JPEG_MIME_TYPES = {'jpg': 'image/jpeg'}
+
+
+class FrameStore:
+    """
+    Base class for captured frame stores.
+
+    `save` returns a reference to the frame immediately and does the encoding
+    and writing on a background thread, so the extraction loop is not blocked
+    on disk or network I/O. Every pending write holds a copy of its frame, so
+    once more than `max_pending` writes are waiting `save` blocks until the
+    oldest one is done. `close` waits for all pending writes.
+    """
+
+    def __init__(self, jpeg_quality=95, max_workers=2, max_pending=8):
+        self.jpeg_quality = jpeg_quality
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='frame-store')
+        self._pending = collections.deque()
+        self._saved_count = 0
+
+    def save(self, frame_img, frame_idx=None):
+        """
+        Queues a captured frame for writing.
+
+        Returns:
+            dict: Reference to the stored frame ('frame_index', 'url', ...).
+        """
+        self._saved_count += 1
+        filename = f"wagon_{self._saved_count:04d}.jpg"
+        if frame_idx is not None:
+            filename = f"wagon_{self._saved_count:04d}_f{frame_idx:07d}.jpg"
+        record = self._describe(filename)
+        record['frame_index'] = frame_idx
+        self._pending.append(self._executor.submit(self._encode_and_write, frame_img, filename))
+        self._collect(self.max_pending)
+        return record
+
+    def __call__(self, frame_img, frame_idx=None):
+        return self.save(frame_img, frame_idx)
+
+    def close(self):
+        """Waits for pending writes and raises the first write error, if any."""
+        try:
+            self._collect(0)
+        finally:
+            self._pending.clear()
+            self._executor.shutdown(wait=True)
+
+    def _collect(self, limit):
+        # Drops finished writes, raising their errors, and waits for the
+        # oldest ones while more than `limit` are pending.
+        while self._pending and (self._pending[0].done() or len(self._pending) > limit):
+            self._pending.popleft().result()
+
+    def _encode_and_write(self, frame_img, filename):
+        ok, buffer = cv2.imencode('.jpg', frame_img, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+        if not ok:
+            raise IOError(f"Could not JPEG-encode frame {filename}")
+        self._write(filename, buffer.tobytes())
+
+    def _describe(self, filename):
+        raise NotImplementedError
+
+    def _write(self, filename, data):
+        raise NotImplementedError
+
+
+class LocalFrameStore(FrameStore):
+    """Writes frames below a directory served from the Flask static folder."""
+
+    def __init__(self, output_dir, **kwargs):
+        super().__init__(**kwargs)
+        self.output_dir = output_dir
+        os.makedirs(output_dir, exist_ok=True)
+
+    def _describe(self, filename):
+        path = os.path.join(self.output_dir, filename)
+        return {'path': path, 'url': '/' + path.replace(os.sep, '/')}
+
+    def _write(self, filename, data):
+        with open(os.path.join(self.output_dir, filename), 'wb') as f:
+            f.write(data)
+
+
+class S3FrameStore(FrameStore):
+    """Uploads frames to S3 through `s3_utils`."""
+
+    def __init__(self, bucket_name, folder_path, url_expiration=3600, **kwargs):
+        super().__init__(**kwargs)
+        self.bucket_name = bucket_name
+        self.folder_path = folder_path
+        self.url_expiration = url_expiration
+
+    def _describe(self, filename):
+        s3_key = f"{self.folder_path}/{filename}" if self.folder_path else filename
+        success, url = generate_presigned_url(self.bucket_name, s3_key, expiration=self.url_expiration)
+        return {'bucket': self.bucket_name, 's3_key': s3_key, 'url': url if success else None}
+
+    def _write(self, filename, data):
+        success, message, _ = upload_file_to_s3(io.BytesIO(data), self.bucket_name, self.folder_path,
+                                                mime_types=JPEG_MIME_TYPES, filename=filename)
+        if not success:
+            raise IOError(f"Could not upload frame {filename}: {message}")
@@ -0,0 +1,86 @@
+"""
+Inference backends for the wagon detection model.
+
+The same YOLO weights can be run through native PyTorch, an exported ONNX
+Runtime graph or an exported OpenVINO model. ONNX Runtime and OpenVINO are
+usually much faster than PyTorch on CPU-only workers. Exported artifacts are
+cached next to the weights and re-exported only when the weights change.
+"""
+
+import importlib.util
+import logging
+import os
+
+import numpy as np
+from ultralytics import YOLO
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+BACKENDS = ('torch', 'onnx', 'openvino')
+
+# Python package each exported format needs at inference time.
+BACKEND_REQUIREMENTS = {'onnx': 'onnxruntime', 'openvino': 'openvino'}
+
+
+def get_artifact_path(weights_path, backend):
+    """Returns where the exported model for `backend` is cached."""
+    stem = os.path.splitext(weights_path)[0]
+    if backend == 'onnx':
+        return f"{stem}.onnx"
+    if backend == 'openvino':
+        return f"{stem}_openvino_model"
+    return weights_path
+
+
+def export_model(weights_path, backend, imgsz=640):
+    """
+    Exports the weights for `backend` unless an up-to-date export is cached.
+
+    Exports use dynamic input shapes so any batch size and inference image
+    size can be used with the same artifact.
+
+    Returns:
+        str: Path of the model to load for `backend`.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown inference backend '{backend}', expected one of {BACKENDS}")
+    if backend == 'torch':
+        return weights_path
+
+    requirement = BACKEND_REQUIREMENTS[backend]
+    if importlib.util.find_spec(requirement) is None:
+        raise ImportError(f"The '{backend}' inference backend requires the '{requirement}' package.")
+
+    artifact_path = get_artifact_path(weights_path, backend)
+    if os.path.exists(artifact_path) and os.path.getmtime(artifact_path) >= os.path.getmtime(weights_path):
+        logger.info(f"Using cached {backend} export {artifact_path}")
+        return artifact_path
+
+    logger.info(f"Exporting {weights_path} for the {backend} backend...")
+    exported_path = YOLO(weights_path).export(format=backend, imgsz=imgsz, dynamic=True, half=False)
+    logger.info(f"Exported {weights_path} to {exported_path}")
+    return str(exported_path)
+
+
+def load_model(weights_path, backend='torch', imgsz=640):
+    """
+    Loads the detection model for the given backend, exporting it first if
+    needed.
+
+    Returns:
+        YOLO: A model that can be called like the native PyTorch one.
+    """
+    model_path = export_model(weights_path, backend, imgsz=imgsz)
+    model = YOLO(model_path, task='detect')
+    logger.info(f"Loaded YOLO model from {model_path} with the {backend} backend")
+    return model
+
+
+def warm_up(model, imgsz=640, batch_size=1):
+    """
+    Runs the model on blank frames so graph compilation and memory allocation
+    happen before the first real job rather than during it.
+    """
+    blank_frames = [np.zeros((imgsz, imgsz, 3), dtype=np.uint8) for _ in range(max(1, batch_size))]
+    model(blank_frames, verbose=False)
@@ -0,0 +1,369 @@
+"""
+Node-local inference service with dynamic micro-batching.
+
+Every worker process normally runs its own model on its own frames, so the
+frames of videos processed at the same time on one node are never batched
+together. This service loads the model once per node and serves all worker
+processes over a Unix socket: frames from every running extraction are
+gathered into micro-batches of up to INFERENCE_SERVICE_MAX_BATCH frames. A
+batch is run as soon as it is full, or once its oldest frame has waited
+INFERENCE_SERVICE_MAX_WAIT_MS, which bounds the latency a frame can pick up
+from batching. Clients send one request at a time, so a batch also runs as
+soon as every active client is waiting for one.
+
+Start one service per node and point the workers at its socket:
+
+    python inference_service.py --socket /run/wagon-inference.sock
+    INFERENCE_SERVICE_SOCKET=/run/wagon-inference.sock celery -A celery_worker worker ...
+
+Workers then run detection through an InferenceClient and load no weights.
+"""
+
+import argparse
+import collections
+import json
+import logging
+import os
+import socket
+import socketserver
+import struct
+import threading
+import time
+
+import numpy as np
+
+from extraction_config import INFERENCE_BACKEND, INFERENCE_IMGSZ, INFERENCE_SERVICE_SOCKET
+from inference_backends import load_model, warm_up
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+INFERENCE_SERVICE_MAX_BATCH = int(os.getenv('INFERENCE_SERVICE_MAX_BATCH', 16))
+INFERENCE_SERVICE_MAX_WAIT_MS = float(os.getenv('INFERENCE_SERVICE_MAX_WAIT_MS', 10))
+# How long a client waits for the answer to one request.
+INFERENCE_SERVICE_TIMEOUT = float(os.getenv('INFERENCE_SERVICE_TIMEOUT', 60))
+STATS_INTERVAL = 60
+# A connection without a request for this long is idle (e.g. a worker process
+# between jobs) and no longer waited for.
+CLIENT_IDLE_SECONDS = 1.0
+
+# Every message is a (header length, payload length) prefix, a JSON header
+# and a payload of raw frame bytes.
+_PREFIX = struct.Struct('!II')
+
+
+def _recv_exact(sock, size):
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        count = sock.recv_into(view[received:])
+        if count == 0:
+            raise ConnectionError("Connection closed in the middle of a message")
+        received += count
+    return buffer
+
+
+def _send_message(sock, header, buffers=()):
+    header = json.dumps(header).encode()
+    sock.sendall(_PREFIX.pack(len(header), sum(buffer.nbytes for buffer in buffers)) + header)
+    for buffer in buffers:
+        sock.sendall(buffer)
+
+
+def _recv_message(sock):
+    """Returns (header, payload), or (None, None) if the peer closed the connection."""
+    prefix = sock.recv(_PREFIX.size, socket.MSG_WAITALL)
+    if not prefix:
+        return None, None
+    if len(prefix) < _PREFIX.size:
+        raise ConnectionError("Connection closed in the middle of a message")
+    header_size, payload_size = _PREFIX.unpack(prefix)
+    header = json.loads(_recv_exact(sock, header_size))
+    return header, _recv_exact(sock, payload_size)
+
+
+def result_boxes(result):
+    """Returns the boxes of one model result as [class id, confidence, x1, y1, x2, y2] lists."""
+    boxes = []
+    if result.boxes:
+        for box_obj in result.boxes:
+            x1, y1, x2, y2 = box_obj.xyxy.cpu().numpy().flatten().tolist()
+            boxes.append([int(box_obj.cls.item()), box_obj.conf.item(), x1, y1, x2, y2])
+    return boxes
+
+
+class _Request:
+    """The frames of one client call and the boxes found on them so far."""
+
+    def __init__(self, frames, conf, imgsz):
+        self.frames = frames
+        self.key = (conf, imgsz)
+        self.boxes = [None] * len(frames)
+        self.remaining = len(frames)
+        self.error = None
+        self.done = threading.Event()
+
+
+class MicroBatcher(threading.Thread):
+    """
+    Runs the model over frames submitted from many threads in shared batches.
+
+    Only frames with the same confidence threshold and inference size are
+    batched together. A request larger than `max_batch_size` is split over
+    several batches. Submitters that pass a `client` send one request at a
+    time; once every one of them that is not idle has a request waiting, no
+    more frames can arrive and the batch runs at once.
+    """
+
+    def __init__(self, model, max_batch_size=INFERENCE_SERVICE_MAX_BATCH,
+                 max_wait=INFERENCE_SERVICE_MAX_WAIT_MS / 1000):
+        super().__init__(name='micro-batcher', daemon=True)
+        self.model = model
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait
+        # (request, frame index, arrival time) of every frame not yet inferred
+        self.pending = collections.deque()
+        self.condition = threading.Condition()
+        self.closed = False
+        # Client -> time of its last request
+        self.last_seen = {}
+        self.waiting_requests = 0
+        self.batches = 0
+        self.frames_inferred = 0
+
+    def submit(self, frames, conf, imgsz=None, client=None):
+        """Blocks until the frames are inferred; returns their boxes (see result_boxes)."""
+        if not frames:
+            return []
+        request = _Request(frames, conf, imgsz)
+        arrived = time.monotonic()
+        with self.condition:
+            self.pending.extend((request, index, arrived) for index in range(len(frames)))
+            self.waiting_requests += 1
+            if client is not None:
+                self.last_seen[client] = arrived
+            self.condition.notify()
+        request.done.wait()
+        if request.error is not None:
+            raise RuntimeError(request.error)
+        return request.boxes
+
+    def forget_client(self, client):
+        with self.condition:
+            self.last_seen.pop(client, None)
+            self.condition.notify()
+
+    def _all_clients_waiting(self):
+        now = time.monotonic()
+        active = sum(1 for seen in self.last_seen.values() if now - seen < CLIENT_IDLE_SECONDS)
+        return bool(self.last_seen) and self.waiting_requests >= active
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+
+    def _next_batch(self):
+        with self.condition:
+            while not self.pending and not self.closed:
+                self.condition.wait()
+            if self.closed:
+                return None
+            # Wait for a full batch, but no longer than the oldest frame may wait.
+            deadline = self.pending[0][2] + self.max_wait
+            while len(self.pending) < self.max_batch_size and not self.closed:
+                if self._all_clients_waiting():
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+
+            key = self.pending[0][0].key
+            batch, others = [], []
+            while self.pending and len(batch) < self.max_batch_size:
+                item = self.pending.popleft()
+                (batch if item[0].key == key else others).append(item)
+            self.pending.extendleft(reversed(others))
+            return key, batch
+
+    def run(self):
+        stats_started_at = time.monotonic()
+        while True:
+            next_batch = self._next_batch()
+            if next_batch is None:
+                return
+            (conf, imgsz), batch = next_batch
+            frames = [request.frames[index] for request, index, _ in batch]
+            error = None
+            try:
+                if imgsz:
+                    results = self.model(frames, verbose=False, conf=conf, imgsz=imgsz)
+                else:
+                    results = self.model(frames, verbose=False, conf=conf)
+                boxes_per_frame = [result_boxes(result) for result in results]
+            except Exception as e:
+                logger.error(f"Inference failed on a batch of {len(frames)} frames: {e}", exc_info=True)
+                error = str(e)
+                boxes_per_frame = [None] * len(frames)
+
+            finished = []
+            for (request, index, _), boxes in zip(batch, boxes_per_frame):
+                request.boxes[index] = boxes
+                if error is not None:
+                    request.error = error
+                request.remaining -= 1
+                if request.remaining == 0:
+                    finished.append(request)
+            with self.condition:
+                self.waiting_requests -= len(finished)
+            for request in finished:
+                request.done.set()
+
+            self.batches += 1
+            self.frames_inferred += len(frames)
+            if time.monotonic() - stats_started_at >= STATS_INTERVAL:
+                logger.info(f"Inferred {self.frames_inferred} frames in {self.batches} batches "
+                            f"(average batch size {self.frames_inferred / self.batches:.1f})")
+                stats_started_at = time.monotonic()
+
+
+class _InferenceHandler(socketserver.BaseRequestHandler):
+    """Serves the requests of one client connection, one after the other."""
+
+    def finish(self):
+        self.server.batcher.forget_client(self)
+
+    def handle(self):
+        while True:
+            try:
+                header, payload = _recv_message(self.request)
+            except (ConnectionError, ValueError) as e:
+                logger.warning(f"Dropping inference client: {e}")
+                return
+            if header is None:
+                return
+
+            frames = []
+            offset = 0
+            for shape in header['frames']:
+                size = int(np.prod(shape))
+                frames.append(np.frombuffer(payload, dtype=np.uint8, count=size, offset=offset).reshape(shape))
+                offset += size
+            try:
+                response = {'boxes': self.server.batcher.submit(frames, header['conf'], header.get('imgsz'),
+                                                                client=self)}
+            except RuntimeError as e:
+                response = {'error': str(e)}
+            try:
+                _send_message(self.request, response)
+            except OSError:
+                return
+
+
+class InferenceServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Unix socket server handing the frames of all its clients to one MicroBatcher."""
+
+    daemon_threads = True
+
+    def __init__(self, socket_path, batcher):
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        self.batcher = batcher
+        super().__init__(socket_path, _InferenceHandler)
+
+
+class InferenceClient:
+    """
+    Runs detection through the node's inference service instead of a local
+    model. Used in place of the model by `frame_extractor.detect_wagon_boxes`.
+
+    The connection is opened on first use and again after a fork, so a client
+    created before a prefork pool starts is safe to inherit.
+    """
+
+    def __init__(self, socket_path, timeout=INFERENCE_SERVICE_TIMEOUT):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._socket = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def predict_boxes(self, frames, conf, imgsz=None):
+        """
+        Returns the boxes found on each frame as [class id, confidence, x1,
+        y1, x2, y2] lists, like `result_boxes` does for a local model.
+
+        Raises:
+            OSError: If the service cannot be reached.
+            RuntimeError: If inference failed in the service.
+        """
+        header = {'conf': conf, 'imgsz': imgsz, 'frames': [list(frame.shape) for frame in frames]}
+        # ROI crops are views with gaps between rows; send them packed.
+        buffers = [memoryview(np.ascontiguousarray(frame)).cast('B') for frame in frames]
+        with self._lock:
+            try:
+                sock = self._connect()
+                _send_message(sock, header, buffers)
+                response, _ = _recv_message(sock)
+            except OSError:
+                self._close()
+                raise
+            if response is None:
+                self._close()
+                raise ConnectionError(f"Inference service at {self.socket_path} closed the connection")
+        if 'error' in response:
+            raise RuntimeError(f"Inference service error: {response['error']}")
+        return response['boxes']
+
+    def _connect(self):
+        if self._socket is None or self._pid != os.getpid():
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+            self._socket, self._pid = sock, os.getpid()
+        return self._socket
+
+    def _close(self):
+        if self._socket is not None and self._pid == os.getpid():
+            self._socket.close()
+        self._socket = None
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Runs the node-local wagon detection inference service.')
+    parser.add_argument('--socket', default=INFERENCE_SERVICE_SOCKET or '/tmp/wagon-inference.sock')
+    parser.add_argument('--model', default='models/best_weights.pt')
+    parser.add_argument('--max-batch-size', type=int, default=INFERENCE_SERVICE_MAX_BATCH)
+    parser.add_argument('--max-wait-ms', type=float, default=INFERENCE_SERVICE_MAX_WAIT_MS)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    model = load_model(args.model, INFERENCE_BACKEND, imgsz=INFERENCE_IMGSZ)
+    warm_up(model, imgsz=INFERENCE_IMGSZ, batch_size=args.max_batch_size)
+
+    batcher = MicroBatcher(model, args.max_batch_size, args.max_wait_ms / 1000)
+    batcher.start()
+    # The socket only appears once the model is loaded and warmed up.
+    server = InferenceServer(args.socket, batcher)
+    logger.info(f"Inference service listening on {args.socket} (max batch {args.max_batch_size}, "
+                f"max wait {args.max_wait_ms:g} ms)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        batcher.close()
+        if os.path.exists(args.socket):
+            os.unlink(args.socket)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+"""
+Cache of extraction results keyed by video content.
+
+Operators often resubmit the same recording. A result is cached under a key
+made of the SHA-256 of the video, the SHA-256 of the model weights and the
+extraction settings that affect the output, so a resubmitted video is
+answered straight from the cache without queueing a task.
+
+Workers publish the SHA-256 of the weights they load, so web processes on
+hosts without the weights file can still build keys.
+
+Entries live in Redis. A sorted set of last-access times keeps the cache
+bounded: once it holds more than RESULT_CACHE_MAX_ENTRIES results, the least
+recently used ones are evicted.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+import redis
+
+from s3_utils import generate_presigned_url
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+RESULT_CACHE_ENABLED = os.getenv('RESULT_CACHE_ENABLED', '1') == '1'
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv('RESULT_CACHE_MAX_ENTRIES', 1000))
+RESULT_CACHE_TTL = int(os.getenv('RESULT_CACHE_TTL', 30 * 24 * 3600))
+# Presigned URLs of frames stored in S3 are regenerated on every hit.
+RESULT_CACHE_URL_EXPIRATION = int(os.getenv('RESULT_CACHE_URL_EXPIRATION', 3600))
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+RESULT_KEY_PREFIX = 'wagon:result:'
+LRU_KEY = 'wagon:result:lru'
+WEIGHTS_KEY_PREFIX = 'wagon:weights:'
+
+_weights_digests = {}
+_weights_digests_lock = threading.Lock()
+
+
+def file_sha256(path, chunk_size=HASH_CHUNK_SIZE):
+    """Returns the hex SHA-256 of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def save_and_hash(file, path, chunk_size=HASH_CHUNK_SIZE):
+    """
+    Writes an uploaded file to `path` and hashes it in the same pass.
+
+    Returns:
+        str: Hex SHA-256 of the file content
+    """
+    digest = hashlib.sha256()
+    with open(path, 'wb') as f:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            digest.update(chunk)
+            f.write(chunk)
+    return digest.hexdigest()
+
+
+def weights_sha256(path):
+    """Returns the SHA-256 of the model weights, rehashing only when the file changes."""
+    stat = os.stat(path)
+    signature = (stat.st_mtime_ns, stat.st_size)
+    with _weights_digests_lock:
+        cached = _weights_digests.get(path)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+    digest = file_sha256(path)
+    with _weights_digests_lock:
+        _weights_digests[path] = (signature, digest)
+    return digest
+
+
+def make_cache_key(video_digest, weights_digest, settings):
+    """Combines the video and weights hashes and the extraction settings into one key."""
+    payload = json.dumps({'video': video_digest, 'weights': weights_digest, 'settings': settings},
+                         sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class ResultCache:
+    """Redis-backed LRU cache of task results."""
+
+    def __init__(self, redis_url=REDIS_URL, max_entries=RESULT_CACHE_MAX_ENTRIES, ttl=RESULT_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._redis = redis.Redis.from_url(redis_url, socket_timeout=2, socket_connect_timeout=2)
+
+    def get(self, cache_key):
+        """
+        Returns the cached result for `cache_key`, or None. Results whose local
+        frames have been deleted are dropped; presigned URLs of S3 frames are
+        regenerated.
+        """
+        try:
+            payload = self._redis.get(RESULT_KEY_PREFIX + cache_key)
+            if payload is None:
+                return None
+            result = json.loads(payload)
+            if not self._refresh_references(result):
+                logger.info(f"Cached result {cache_key} refers to deleted files; dropping it.")
+                self.delete(cache_key)
+                return None
+            self._redis.zadd(LRU_KEY, {cache_key: time.time()})
+            return result
+        except (redis.RedisError, ValueError) as e:
+            logger.warning(f"Result cache lookup failed: {e}")
+            return None
+
+    def put(self, cache_key, result):
+        """Stores a result and evicts the least recently used entries beyond the limit."""
+        try:
+            with self._redis.pipeline() as pipe:
+                pipe.set(RESULT_KEY_PREFIX + cache_key, json.dumps(result, default=str), ex=self.ttl)
+                pipe.zadd(LRU_KEY, {cache_key: time.time()})
+                pipe.zcard(LRU_KEY)
+                entries = pipe.execute()[-1]
+            if entries > self.max_entries:
+                evicted = [key.decode() for key, _ in self._redis.zpopmin(LRU_KEY, entries - self.max_entries)]
+                if evicted:
+                    self._redis.delete(*(RESULT_KEY_PREFIX + key for key in evicted))
+                    logger.info(f"Evicted {len(evicted)} cached results")
+        except (redis.RedisError, TypeError, ValueError) as e:
+            logger.warning(f"Could not cache result {cache_key}: {e}")
+
+    def publish_weights_digest(self, model_path):
+        """Stores the SHA-256 of the weights at `model_path` for processes without the file."""
+        try:
+            self._redis.set(WEIGHTS_KEY_PREFIX + model_path, weights_sha256(model_path))
+        except (redis.RedisError, OSError) as e:
+            logger.warning(f"Could not publish the digest of {model_path}: {e}")
+
+    def weights_digest(self, model_path):
+        """
+        Returns the SHA-256 of the weights at `model_path` as published by the
+        workers, which run them, or else that of the local file. None if
+        neither is available.
+        """
+        try:
+            digest = self._redis.get(WEIGHTS_KEY_PREFIX + model_path)
+            if digest is not None:
+                return digest.decode()
+        except redis.RedisError as e:
+            logger.warning(f"Could not read the published digest of {model_path}: {e}")
+        if os.path.exists(model_path):
+            return weights_sha256(model_path)
+        return None
+
+    def delete(self, cache_key):
+        with self._redis.pipeline() as pipe:
+            pipe.delete(RESULT_KEY_PREFIX + cache_key)
+            pipe.zrem(LRU_KEY, cache_key)
+            pipe.execute()
+
+    @staticmethod
+    def _refresh_references(result):
+        annotated_video = result.get('annotated_video')
+        if annotated_video and not os.path.exists(annotated_video.lstrip('/')):
+            return False
+        for record in result.get('frames', []):
+            if 'path' in record and not os.path.exists(record['path']):
+                return False
+            if 's3_key' in record and record.get('bucket'):
+                success, url = generate_presigned_url(record['bucket'], record['s3_key'],
+                                                      expiration=RESULT_CACHE_URL_EXPIRATION)
+                if success:
+                    record['url'] = url
+        result['result'] = [record['url'] for record in result.get('frames', [])]
+        return True
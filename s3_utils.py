@@ -1,16 +1,35 @@
 """
 S3 Utility functions for wagon damage detection application.
 This module provides functions to interact with AWS S3 using only allowed operations:
-- put_object (upload)
-- get_object (download)
+- put_object (upload, including multipart uploads for large files and
+  multipart uploads assembled from client-sent chunks)
+- get_object (download, including ranged GETs for large files)
+- head_object (object metadata, authorized by the same s3:GetObject permission)
 - delete_object (delete)
 
 No ListBucket or HeadBucket operations are used.
+
+A single S3 client is shared by the whole process. boto3 clients are
+thread-safe, and sharing one keeps credential resolution, endpoint setup and
+pooled TLS connections alive between calls.
+
+Object metadata (size, ETag, last-modified) is kept in a small in-process
+TTL/LRU cache, so repeated existence and size checks do not hit S3 while an
+entry is fresh. Uploads and deletes through this module invalidate the entry.
+
+Callbacks registered with add_object_listener are told about every upload and
+delete made through this module, so derived data (such as the system status
+counters) can be kept up to date without listing the bucket.
 """
 
 import os
+import threading
+import time
+from collections import OrderedDict
 import boto3
 import logging
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 from botocore.exceptions import ClientError
 from werkzeug.utils import secure_filename
 from datetime import datetime
@@ -18,28 +37,147 @@ from datetime import datetime
 # Configure logging
 logger = logging.getLogger(__name__)
 
+# --- Client and transfer configuration ---
+S3_MAX_POOL_CONNECTIONS = int(os.getenv('S3_MAX_POOL_CONNECTIONS', 50))
+S3_MAX_ATTEMPTS = int(os.getenv('S3_MAX_ATTEMPTS', 5))
+S3_RETRY_MODE = os.getenv('S3_RETRY_MODE', 'standard')
+# Files above the threshold are transferred in parts, several at a time.
+S3_MULTIPART_THRESHOLD = int(os.getenv('S3_MULTIPART_THRESHOLD_MB', 64)) * 1024 * 1024
+S3_MULTIPART_CHUNKSIZE = int(os.getenv('S3_MULTIPART_CHUNKSIZE_MB', 16)) * 1024 * 1024
+S3_MAX_CONCURRENCY = int(os.getenv('S3_MAX_CONCURRENCY', 8))
+# Chunk size used when streaming an object with a single GET.
+S3_STREAM_CHUNKSIZE = int(os.getenv('S3_STREAM_CHUNKSIZE_KB', 1024)) * 1024
+
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=S3_MULTIPART_THRESHOLD,
+    multipart_chunksize=S3_MULTIPART_CHUNKSIZE,
+    max_concurrency=S3_MAX_CONCURRENCY,
+    use_threads=True
+)
+
+# Object metadata cache
+S3_METADATA_CACHE_TTL = float(os.getenv('S3_METADATA_CACHE_TTL', 60))
+S3_METADATA_CACHE_SIZE = int(os.getenv('S3_METADATA_CACHE_SIZE', 1024))
+
+_s3_client = None
+_s3_client_lock = threading.Lock()
+
+
+def _reset_s3_client():
+    # Pooled connections must not be shared with a forked child process.
+    global _s3_client, _s3_client_lock
+    _s3_client = None
+    _s3_client_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_s3_client)
+
+
+class _MetadataCache:
+    """Thread-safe LRU cache of object metadata with a per-entry TTL."""
+
+    def __init__(self, ttl, max_size):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, bucket_name, s3_key):
+        key = (bucket_name, s3_key)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, metadata = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return metadata
+
+    def put(self, bucket_name, s3_key, metadata):
+        if self.ttl <= 0 or self.max_size <= 0:
+            return
+        key = (bucket_name, s3_key)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, metadata)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, bucket_name, s3_key):
+        with self._lock:
+            self._entries.pop((bucket_name, s3_key), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_metadata_cache = _MetadataCache(S3_METADATA_CACHE_TTL, S3_METADATA_CACHE_SIZE)
+
+_object_listeners = []
+
+
+def add_object_listener(listener):
+    """
+    Register a callback for uploads and deletes made through this module.
+
+    The listener is called as listener(event, bucket_name, s3_key, size), where
+    event is 'upload' or 'delete' and size is the object size in bytes, or None
+    if it is not known. Listener errors are logged and never fail the operation.
+    """
+    _object_listeners.append(listener)
+
+
+def _notify_object_listeners(event, bucket_name, s3_key, size):
+    for listener in _object_listeners:
+        try:
+            listener(event, bucket_name, s3_key, size)
+        except Exception as e:
+            logger.error(f"S3 object listener failed for {event} of {s3_key}: {str(e)}")
+
+
 def get_s3_client():
     """
-    Initialize and return an S3 client using environment variables.
-    
+    Return the process-wide S3 client, creating it on first use from
+    environment variables.
+
+    The client keeps a connection pool of S3_MAX_POOL_CONNECTIONS and retries
+    throttling and transient errors up to S3_MAX_ATTEMPTS times. Set
+    S3_ENDPOINT_URL to talk to an S3-compatible store such as MinIO.
+
     Returns:
         boto3.client: The S3 client or None if initialization fails
     """
-    try:
-        s3_client = boto3.client(
-            's3',
-            aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
-            aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
-            region_name=os.getenv('AWS_REGION', 'us-east-1')
-        )
-        return s3_client
-    except Exception as e:
-        logger.error(f"Error initializing S3 client: {str(e)}")
-        return None
+    global _s3_client
+    if _s3_client is not None:
+        return _s3_client
+
+    with _s3_client_lock:
+        if _s3_client is None:
+            try:
+                _s3_client = boto3.client(
+                    's3',
+                    aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
+                    aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
+                    region_name=os.getenv('AWS_REGION', 'us-east-1'),
+                    endpoint_url=os.getenv('S3_ENDPOINT_URL') or None,
+                    config=Config(
+                        max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+                        retries={'max_attempts': S3_MAX_ATTEMPTS, 'mode': S3_RETRY_MODE}
+                    )
+                )
+            except Exception as e:
+                logger.error(f"Error initializing S3 client: {str(e)}")
+                return None
+    return _s3_client
 
 def upload_file_to_s3(file, bucket_name, folder_path, mime_types=None, filename=None):
     """
-    Upload a file to S3 using put_object operation.
+    Upload a file to S3. Large files are sent as a concurrent multipart
+    upload by the boto3 transfer manager, small ones with a single put.
     
     Args:
         file: File object to upload
@@ -82,15 +220,22 @@ def upload_file_to_s3(file, bucket_name, folder_path, mime_types=None, filename=
         extension = os.path.splitext(new_filename)[1].lower()[1:]  # Remove the dot
         content_type = mime_types.get(extension, 'application/octet-stream')
         
-        # Upload using put_object
+        # Measure the file for the object listeners
+        file.seek(0, os.SEEK_END)
+        size = file.tell()
+        
+        # Upload through the transfer manager (multipart above the threshold)
         file.seek(0)  # Ensure we're at the beginning of the file
-        s3_client.put_object(
-            Bucket=bucket_name,
-            Key=s3_key,
-            Body=file,
-            ContentType=content_type
+        s3_client.upload_fileobj(
+            file,
+            bucket_name,
+            s3_key,
+            ExtraArgs={'ContentType': content_type},
+            Config=TRANSFER_CONFIG
         )
         
+        _metadata_cache.invalidate(bucket_name, s3_key)
+        _notify_object_listeners('upload', bucket_name, s3_key, size)
         logger.info(f"Successfully uploaded {new_filename} to S3 folder {folder_path}")
         return True, f"File {new_filename} uploaded successfully", s3_key
         
@@ -104,14 +249,173 @@ def upload_file_to_s3(file, bucket_name, folder_path, mime_types=None, filename=
         logger.error(f"General error during upload: {str(e)}")
         return False, f"Error: {str(e)}", None
 
-def download_file_from_s3(bucket_name, s3_key, local_path=None):
+def create_multipart_upload(bucket_name, s3_key, content_type='application/octet-stream'):
+    """
+    Start a multipart upload whose parts are sent one by one with upload_part,
+    e.g. as the chunks of a resumable client upload arrive.
+    
+    Args:
+        bucket_name: Name of the S3 bucket
+        s3_key: Key of the object to create
+        content_type: Content type of the object
+        
+    Returns:
+        tuple: (bool success, str message, str upload_id or None)
+    """
+    try:
+        s3_client = get_s3_client()
+        if s3_client is None:
+            return False, "S3 client initialization failed", None
+        
+        response = s3_client.create_multipart_upload(
+            Bucket=bucket_name,
+            Key=s3_key,
+            ContentType=content_type
+        )
+        
+        logger.info(f"Started multipart upload of {s3_key}")
+        return True, f"Multipart upload of {s3_key} started", response['UploadId']
+        
+    except ClientError as e:
+        error_code = e.response.get('Error', {}).get('Code', 'Unknown')
+        error_message = e.response.get('Error', {}).get('Message', str(e))
+        logger.error(f"S3 client error ({error_code}): {error_message}")
+        return False, f"S3 error: {error_message}", None
+        
+    except Exception as e:
+        logger.error(f"General error starting multipart upload: {str(e)}")
+        return False, f"Error: {str(e)}", None
+
+def upload_part(bucket_name, s3_key, upload_id, part_number, data):
+    """
+    Upload one part of a multipart upload. All parts but the last must be at
+    least 5 MB.
+    
+    Args:
+        bucket_name: Name of the S3 bucket
+        s3_key: Key of the object being uploaded
+        upload_id: ID returned by create_multipart_upload
+        part_number: 1-based position of the part
+        data: Content of the part (bytes)
+        
+    Returns:
+        tuple: (bool success, str message, str etag or None)
+    """
+    try:
+        s3_client = get_s3_client()
+        if s3_client is None:
+            return False, "S3 client initialization failed", None
+        
+        response = s3_client.upload_part(
+            Bucket=bucket_name,
+            Key=s3_key,
+            UploadId=upload_id,
+            PartNumber=part_number,
+            Body=data
+        )
+        
+        return True, f"Part {part_number} of {s3_key} uploaded", response['ETag']
+        
+    except ClientError as e:
+        error_code = e.response.get('Error', {}).get('Code', 'Unknown')
+        error_message = e.response.get('Error', {}).get('Message', str(e))
+        logger.error(f"S3 client error ({error_code}): {error_message}")
+        return False, f"S3 error: {error_message}", None
+        
+    except Exception as e:
+        logger.error(f"General error uploading part: {str(e)}")
+        return False, f"Error: {str(e)}", None
+
+def complete_multipart_upload(bucket_name, s3_key, upload_id, parts, size=None):
+    """
+    Assemble the uploaded parts into the final object.
+    
+    Args:
+        bucket_name: Name of the S3 bucket
+        s3_key: Key of the object being uploaded
+        upload_id: ID returned by create_multipart_upload
+        parts: List of (part_number, etag) tuples
+        size: Total size in bytes, passed on to the object listeners (optional)
+        
+    Returns:
+        tuple: (bool success, str message)
+    """
+    try:
+        s3_client = get_s3_client()
+        if s3_client is None:
+            return False, "S3 client initialization failed"
+        
+        s3_client.complete_multipart_upload(
+            Bucket=bucket_name,
+            Key=s3_key,
+            UploadId=upload_id,
+            MultipartUpload={'Parts': [{'PartNumber': number, 'ETag': etag} for number, etag in sorted(parts)]}
+        )
+        _metadata_cache.invalidate(bucket_name, s3_key)
+        _notify_object_listeners('upload', bucket_name, s3_key, size)
+        
+        logger.info(f"Completed multipart upload of {s3_key} ({len(parts)} parts)")
+        return True, f"File {s3_key} uploaded successfully"
+        
+    except ClientError as e:
+        error_code = e.response.get('Error', {}).get('Code', 'Unknown')
+        error_message = e.response.get('Error', {}).get('Message', str(e))
+        logger.error(f"S3 client error ({error_code}): {error_message}")
+        return False, f"S3 error: {error_message}"
+        
+    except Exception as e:
+        logger.error(f"General error completing multipart upload: {str(e)}")
+        return False, f"Error: {str(e)}"
+
+def abort_multipart_upload(bucket_name, s3_key, upload_id):
+    """
+    Abort a multipart upload and discard its parts.
+    
+    Returns:
+        tuple: (bool success, str message)
+    """
+    try:
+        s3_client = get_s3_client()
+        if s3_client is None:
+            return False, "S3 client initialization failed"
+        
+        s3_client.abort_multipart_upload(
+            Bucket=bucket_name,
+            Key=s3_key,
+            UploadId=upload_id
+        )
+        
+        logger.info(f"Aborted multipart upload of {s3_key}")
+        return True, f"Multipart upload of {s3_key} aborted"
+        
+    except ClientError as e:
+        error_code = e.response.get('Error', {}).get('Code', 'Unknown')
+        error_message = e.response.get('Error', {}).get('Message', str(e))
+        logger.error(f"S3 client error ({error_code}): {error_message}")
+        return False, f"S3 error: {error_message}"
+        
+    except Exception as e:
+        logger.error(f"General error aborting multipart upload: {str(e)}")
+        return False, f"Error: {str(e)}"
+
+def download_file_from_s3(bucket_name, s3_key, local_path=None, parallel=True):
     """
     Download a file from S3 using get_object operation.
+
+    When saving to a local path the object is streamed to disk in chunks, so
+    memory use stays constant whatever the object size. With `parallel`, large
+    objects are fetched with concurrent ranged GETs by the boto3 transfer
+    manager; otherwise a single GET is streamed sequentially. The file only
+    appears at `local_path` once the download has completed.
+
+    Without a local path the whole object is read into memory and returned.
+    Use iter_file_from_s3 to process large objects without buffering them.
     
     Args:
         bucket_name: Name of the S3 bucket
         s3_key: Key of the object in S3
         local_path: Local path to save the file (optional)
+        parallel: Use concurrent ranged GETs for large objects (default: True)
         
     Returns:
         tuple: (bool success, str message, bytes file_content or None)
@@ -121,6 +425,25 @@ def download_file_from_s3(bucket_name, s3_key, local_path=None):
         if s3_client is None:
             return False, "S3 client initialization failed", None
         
+        # If local path is provided, stream the object to disk
+        if local_path:
+            os.makedirs(os.path.dirname(local_path) or '.', exist_ok=True)
+            if parallel:
+                # The transfer manager writes to a temporary file and renames it
+                s3_client.download_file(bucket_name, s3_key, local_path, Config=TRANSFER_CONFIG)
+            else:
+                partial_path = f"{local_path}.part"
+                try:
+                    with open(partial_path, 'wb') as f:
+                        for chunk in iter_file_from_s3(bucket_name, s3_key):
+                            f.write(chunk)
+                    os.replace(partial_path, local_path)
+                finally:
+                    if os.path.exists(partial_path):
+                        os.remove(partial_path)
+            logger.info(f"Successfully downloaded {s3_key} to {local_path}")
+            return True, f"File {s3_key} downloaded successfully", None
+        
         # Get the object from S3
         response = s3_client.get_object(
             Bucket=bucket_name,
@@ -130,14 +453,6 @@ def download_file_from_s3(bucket_name, s3_key, local_path=None):
         # Read the content
         file_content = response['Body'].read()
         
-        # If local path is provided, save the file
-        if local_path:
-            os.makedirs(os.path.dirname(local_path), exist_ok=True)
-            with open(local_path, 'wb') as f:
-                f.write(file_content)
-            logger.info(f"Successfully downloaded {s3_key} to {local_path}")
-            return True, f"File {s3_key} downloaded successfully", None
-        
         # Otherwise return the content
         logger.info(f"Successfully retrieved {s3_key} from S3")
         return True, f"File {s3_key} retrieved successfully", file_content
@@ -152,6 +467,43 @@ def download_file_from_s3(bucket_name, s3_key, local_path=None):
         logger.error(f"General error during download: {str(e)}")
         return False, f"Error: {str(e)}", None
 
+def iter_file_from_s3(bucket_name, s3_key, chunk_size=None, start=0, end=None):
+    """
+    Stream an object from S3 using get_object operation, yielding its bytes
+    chunk by chunk. Only one chunk is held in memory at a time.
+
+    Unlike the other helpers this is a generator and raises on failure, since
+    errors can happen after some bytes have already been consumed.
+
+    Args:
+        bucket_name: Name of the S3 bucket
+        s3_key: Key of the object in S3
+        chunk_size: Size of the yielded chunks in bytes (default: S3_STREAM_CHUNKSIZE)
+        start: First byte to read (default: 0)
+        end: Last byte to read, inclusive (default: end of the object)
+
+    Yields:
+        bytes: Consecutive chunks of the object
+
+    Raises:
+        RuntimeError: If the S3 client could not be created
+        ClientError: If the object cannot be read
+    """
+    s3_client = get_s3_client()
+    if s3_client is None:
+        raise RuntimeError("S3 client initialization failed")
+
+    request = {'Bucket': bucket_name, 'Key': s3_key}
+    if start or end is not None:
+        request['Range'] = f"bytes={start}-{'' if end is None else end}"
+
+    body = s3_client.get_object(**request)['Body']
+    try:
+        for chunk in body.iter_chunks(chunk_size or S3_STREAM_CHUNKSIZE):
+            yield chunk
+    finally:
+        body.close()
+
 def delete_file_from_s3(bucket_name, s3_key):
     """
     Delete a file from S3 using delete_object operation.
@@ -168,11 +520,16 @@ def delete_file_from_s3(bucket_name, s3_key):
         if s3_client is None:
             return False, "S3 client initialization failed"
         
+        # The size is only known if the metadata happens to be cached
+        metadata = _metadata_cache.get(bucket_name, s3_key)
+        
         # Delete the object
         s3_client.delete_object(
             Bucket=bucket_name,
             Key=s3_key
         )
+        _metadata_cache.invalidate(bucket_name, s3_key)
+        _notify_object_listeners('delete', bucket_name, s3_key, metadata['size'] if metadata else None)
         
         logger.info(f"Successfully deleted {s3_key} from S3")
         return True, f"File {s3_key} deleted successfully"
@@ -187,45 +544,73 @@ def delete_file_from_s3(bucket_name, s3_key):
         logger.error(f"General error during deletion: {str(e)}")
         return False, f"Error: {str(e)}"
 
-def check_file_exists(bucket_name, s3_key):
+def get_file_metadata(bucket_name, s3_key, use_cache=True):
     """
-    Check if a file exists in S3 using get_object operation with a try/except pattern
-    instead of using HeadBucket.
-    
+    Get the metadata of an object in S3 using head_object operation, which
+    does not transfer the object body. Results are served from the metadata
+    cache while they are fresh.
+
     Args:
         bucket_name: Name of the S3 bucket
         s3_key: Key of the object in S3
-        
+        use_cache: Use and refresh the metadata cache (default: True)
+
     Returns:
-        bool: True if file exists, False otherwise
+        dict: size, etag, last_modified and content_type of the object, or
+        None if it does not exist or cannot be read
     """
+    if use_cache:
+        metadata = _metadata_cache.get(bucket_name, s3_key)
+        if metadata is not None:
+            return metadata
+
     try:
         s3_client = get_s3_client()
         if s3_client is None:
-            return False
-        
-        # Try to get the object metadata
-        s3_client.get_object(
+            return None
+
+        response = s3_client.head_object(
             Bucket=bucket_name,
             Key=s3_key
         )
-        
-        # If no exception is raised, the file exists
-        return True
-        
+        metadata = {
+            'size': response['ContentLength'],
+            'etag': response['ETag'].strip('"'),
+            'last_modified': response['LastModified'],
+            'content_type': response.get('ContentType')
+        }
+        _metadata_cache.put(bucket_name, s3_key, metadata)
+        return metadata
+
     except ClientError as e:
-        # If the error code is 404 (NoSuchKey), the file doesn't exist
+        # HEAD responses have no body, so a missing key only shows up as a 404.
+        # Without s3:ListBucket, S3 answers 403 for missing keys instead.
         error_code = e.response.get('Error', {}).get('Code', '')
-        if error_code == 'NoSuchKey':
-            return False
-        
-        # For other errors, log and return False
+        if error_code in ('404', 'NoSuchKey', 'NotFound', '403'):
+            return None
+
+        # For other errors, log and return None
         logger.error(f"S3 client error ({error_code}): {str(e)}")
-        return False
-        
+        return None
+
     except Exception as e:
-        logger.error(f"General error checking file existence: {str(e)}")
-        return False
+        logger.error(f"General error reading file metadata: {str(e)}")
+        return None
+
+def check_file_exists(bucket_name, s3_key, use_cache=True):
+    """
+    Check if a file exists in S3 using head_object operation, without
+    downloading the object or using HeadBucket.
+    
+    Args:
+        bucket_name: Name of the S3 bucket
+        s3_key: Key of the object in S3
+        use_cache: Answer from the metadata cache when possible (default: True)
+        
+    Returns:
+        bool: True if file exists, False otherwise
+    """
+    return get_file_metadata(bucket_name, s3_key, use_cache=use_cache) is not None
 
 def generate_presigned_url(bucket_name, s3_key, expiration=3600):
     """
@@ -264,3 +649,23 @@ def generate_presigned_url(bucket_name, s3_key, expiration=3600):
     except Exception as e:
         logger.error(f"General error generating presigned URL: {str(e)}")
         return False, f"Error: {str(e)}"
+
+
+def make_s3_uri(bucket_name, s3_key):
+    """Returns the s3://bucket/key URI of an object."""
+    return f"s3://{bucket_name}/{s3_key}"
+
+
+def parse_s3_uri(uri):
+    """
+    Splits an s3://bucket/key URI.
+
+    Returns:
+        tuple: (str bucket, str key), or None if `uri` is not an S3 URI
+    """
+    if not isinstance(uri, str) or not uri.startswith('s3://'):
+        return None
+    bucket_name, _, s3_key = uri[len('s3://'):].partition('/')
+    if not bucket_name or not s3_key:
+        return None
+    return bucket_name, s3_key
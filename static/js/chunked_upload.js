@@ -0,0 +1,58 @@
+// Resumable chunked uploads through the /uploads API.
+//
+// The file is sent as a sequence of PUT requests, one per chunk. When a chunk
+// fails the current offset is fetched from the server and the upload resumes
+// from there, so a dropped connection never restarts the whole file.
+function uploadInChunks(file, options = {}) {
+    const maxRetries = options.maxRetries || 5;
+    const onProgress = options.onProgress || function () {};
+
+    function request(url, init) {
+        return fetch(url, Object.assign({ credentials: 'same-origin' }, init))
+            .then(response => response.json().then(data => {
+                if (!response.ok && !(response.status === 409 && data.offset !== undefined)) {
+                    throw new Error(data.error || `Server responded with status: ${response.status}`);
+                }
+                return data;
+            }));
+    }
+
+    function sendFrom(uploadId, chunkSize, offset, retries) {
+        if (offset >= file.size) {
+            return request(`/uploads/${uploadId}/complete`, { method: 'POST' });
+        }
+        const chunk = file.slice(offset, Math.min(offset + chunkSize, file.size));
+        return request(`/uploads/${uploadId}?offset=${offset}`, {
+            method: 'PUT',
+            headers: { 'Content-Type': 'application/octet-stream' },
+            body: chunk
+        })
+            .then(data => {
+                // A 409 carries the offset the server actually has
+                onProgress(data.offset, file.size);
+                return sendFrom(uploadId, chunkSize, data.offset, maxRetries);
+            })
+            .catch(error => {
+                if (retries <= 0) throw error;
+                const delay = 1000 * (maxRetries - retries + 1);
+                return new Promise(resolve => setTimeout(resolve, delay))
+                    .then(() => request(`/uploads/${uploadId}`, { method: 'GET' }))
+                    .then(status => sendFrom(uploadId, chunkSize, status.offset, retries - 1));
+            });
+    }
+
+    return request('/uploads', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({
+            filename: file.name,
+            size: file.size,
+            target: options.target || 'local',
+            folder: options.folder || null,
+            process: options.process !== false
+        })
+    }).then(data => {
+        if (!data.success) throw new Error(data.error);
+        return sendFrom(data.upload_id, data.chunk_size, 0, maxRetries);
+    });
+}
@@ -63,10 +63,14 @@ document.addEventListener('DOMContentLoaded', function () {
         })
         .then(response => response.json())
         .then(data => {
-            if (data.success) {
+            if (data.success && data.cached) {
+                // Same video processed before: show the cached result
+                processingCard.style.display = 'none';
+                displayResults(data.result);
+            } else if (data.success) {
                 const taskId = data.task_id;
-                // Start polling for task status
-                pollTaskStatus(taskId);
+                // Follow the task status
+                watchTaskStatus(taskId);
             } else {
                 alert('Error starting process: ' + data.error);
                 resetToUploadState();
@@ -79,22 +83,53 @@ document.addEventListener('DOMContentLoaded', function () {
         });
     });
 
+    // Follows the task through Server-Sent Events, falling back to polling
+    // when the browser has no EventSource or the stream cannot be opened.
+    function watchTaskStatus(taskId) {
+        if (!window.EventSource) {
+            pollTaskStatus(taskId);
+            return;
+        }
+        const source = new EventSource(`/task-events/${taskId}`);
+        let received = false;
+        source.onmessage = event => {
+            received = true;
+            if (handleTaskStatus(JSON.parse(event.data))) {
+                source.close();
+            }
+        };
+        source.onerror = () => {
+            // After the first event the browser reconnects by itself.
+            if (!received) {
+                source.close();
+                pollTaskStatus(taskId);
+            }
+        };
+    }
+
+    // Updates the page for one status update; returns true once the task is done.
+    function handleTaskStatus(data) {
+        if (data.state === 'SUCCESS') {
+            processingCard.style.display = 'none';
+            displayResults(data.result);
+            return true;
+        } else if (data.state === 'FAILURE') {
+            alert('Processing failed: ' + data.status);
+            resetToUploadState();
+            return true;
+        }
+        // Update progress bar
+        updateProgressBar(data.progress, data.status);
+        return false;
+    }
+
     function pollTaskStatus(taskId) {
         const interval = setInterval(() => {
             fetch(`/task-status/${taskId}`)
                 .then(response => response.json())
                 .then(data => {
-                    if (data.state === 'SUCCESS') {
-                        clearInterval(interval);
-                        processingCard.style.display = 'none';
-                        displayResults(data.result);
-                    } else if (data.state === 'FAILURE') {
+                    if (handleTaskStatus(data)) {
                         clearInterval(interval);
-                        alert('Processing failed: ' + data.status);
-                        resetToUploadState();
-                    } else {
-                        // Update progress bar
-                        updateProgressBar(data.progress, data.status);
                     }
                 })
                 .catch(error => {
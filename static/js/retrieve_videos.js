@@ -191,7 +191,73 @@ document.addEventListener('DOMContentLoaded', function() {
                 formData.append('selected_videos[]', video);
             });
             
-                        // Get processing status element            const processingStatus = document.getElementById('processingStatus');                        // Send request to process videos            fetch('/process_videos', {                method: 'POST',                body: formData            })            .then(response => response.json())            .then(data => {                // Hide loading spinner                if (loadingSpinner) loadingSpinner.style.display = 'none';                                if (data.success) {                    // Hide form sections and show processing status                    if (folderSelectContainer) folderSelectContainer.style.display = 'none';                    if (videoListContainer) videoListContainer.style.display = 'none';                    if (processingStatus) processingStatus.style.display = 'block';                                        // Log the details for verification                    console.log(`Processing started for ${data.processed_videos.length} videos`);                    data.processed_videos.forEach(video => {                        console.log(`- ${video.name}: ${video.status}`);                    });                } else {                    alert(`Error: ${data.error || 'Failed to process videos.'}`);                }            })            .catch(error => {                console.error('Error processing videos:', error);                                // Hide loading spinner                if (loadingSpinner) loadingSpinner.style.display = 'none';                                alert('Error processing videos. Please try again.');            });
+            // Get processing status element
+            const processingStatus = document.getElementById('processingStatus');
+            
+            // Send request to process videos
+            fetch('/process_videos', {
+                method: 'POST',
+                body: formData
+            })
+            .then(response => response.json())
+            .then(data => {
+                // Hide loading spinner
+                if (loadingSpinner) loadingSpinner.style.display = 'none';
+                
+                if (data.success) {
+                    // Hide form sections and show processing status
+                    if (folderSelectContainer) folderSelectContainer.style.display = 'none';
+                    if (videoListContainer) videoListContainer.style.display = 'none';
+                    if (processingStatus) processingStatus.style.display = 'block';
+                    
+                    // Log the details for verification
+                    console.log(`Processing started for ${data.processed_videos.length} videos`);
+                    data.processed_videos.forEach(video => {
+                        console.log(`- ${video.name}: ${video.status}`);
+                    });
+                    pollBatchJob(data.job_id);
+                } else {
+                    alert(`Error: ${data.error || 'Failed to process videos.'}`);
+                }
+            })
+            .catch(error => {
+                console.error('Error processing videos:', error);
+                
+                // Hide loading spinner
+                if (loadingSpinner) loadingSpinner.style.display = 'none';
+                
+                alert('Error processing videos. Please try again.');
+            });
+        });
+    }
+    
+    // Polls the aggregated progress of a batch job until every video is done
+    function pollBatchJob(jobId) {
+        const batchStatus = document.getElementById('batchStatus');
+        const batchProgressBar = document.getElementById('batchProgressBar');
+        
+        fetch(`/batch-jobs/${jobId}`)
+        .then(response => response.json())
+        .then(job => {
+            if (!job.success) {
+                if (batchStatus) batchStatus.textContent = job.error || 'Batch job not found.';
+                return;
+            }
+            if (batchStatus) batchStatus.textContent = job.status;
+            if (batchProgressBar) {
+                batchProgressBar.style.width = `${job.progress}%`;
+                batchProgressBar.setAttribute('aria-valuenow', job.progress);
+                batchProgressBar.textContent = `${job.progress}%`;
+            }
+            if (job.state !== 'SUCCESS') {
+                setTimeout(() => pollBatchJob(jobId), 5000);
+            } else if (batchProgressBar) {
+                batchProgressBar.classList.remove('progress-bar-animated');
+            }
+        })
+        .catch(error => {
+            console.error('Error polling batch job:', error);
+            setTimeout(() => pollBatchJob(jobId), 10000);
         });
     }
 }); 
\ No newline at end of file
@@ -0,0 +1,195 @@
+"""
+Cached system status for the home page and the dashboard.
+
+Counting the stored videos and their total size means listing every object
+under the upload folder, which gets slower as the bucket grows. The status is
+therefore computed by a background refresh and stored in Redis with a TTL, so
+page renders only read a precomputed value and never wait on S3.
+
+Between full refreshes the counters are updated incrementally from the
+uploads and deletes made through s3_utils. A Redis lock makes sure only one
+web process rescans the bucket at a time. If Redis is unreachable, the last
+status computed by this process is used instead.
+"""
+
+import logging
+import os
+import threading
+import time
+
+import redis
+
+from s3_utils import add_object_listener, get_s3_client
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+# Seconds after which the status is rescanned in the background.
+STATUS_REFRESH_INTERVAL = int(os.getenv('STATUS_REFRESH_INTERVAL', 300))
+# Seconds the status is kept in Redis. Stale values are still served while a
+# refresh runs, so this is longer than the refresh interval.
+STATUS_CACHE_TTL = int(os.getenv('STATUS_CACHE_TTL', 3600))
+# After a Redis error, page renders skip Redis for this many seconds so they
+# do not each wait for a connection timeout.
+STATUS_REDIS_RETRY_SECONDS = 30
+
+STATUS_KEY = 'wagon:system_status'
+STATUS_LOCK_KEY = 'wagon:system_status:lock'
+
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov')
+
+
+def format_storage_usage(storage_bytes):
+    """Formats a byte count for display, e.g. '1.5 GB'."""
+    if storage_bytes < 1024:
+        return f"{storage_bytes} B"
+    elif storage_bytes < 1024**2:
+        return f"{storage_bytes/1024:.1f} KB"
+    elif storage_bytes < 1024**3:
+        return f"{storage_bytes/(1024**2):.1f} MB"
+    return f"{storage_bytes/(1024**3):.1f} GB"
+
+
+def scan_bucket(bucket_name, prefix):
+    """
+    Counts the videos and adds up the object sizes under `prefix` with a
+    single list_objects_v2 paginator pass.
+
+    Returns:
+        dict: storage_bytes and total_videos
+    """
+    storage_bytes = 0
+    total_videos = 0
+    paginator = get_s3_client().get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
+        for item in page.get('Contents', []):
+            storage_bytes += item.get('Size', 0)
+            if item['Key'].lower().endswith(VIDEO_EXTENSIONS):
+                total_videos += 1
+    return {'storage_bytes': storage_bytes, 'total_videos': total_videos}
+
+
+class SystemStatusCache:
+    """
+    Serves the system status from Redis and keeps it fresh in the background.
+
+    The counters are stored in a Redis hash (storage_bytes, total_videos,
+    refreshed_at) so incremental updates from several processes are atomic.
+    """
+
+    def __init__(self, bucket_name, prefix, redis_url=REDIS_URL,
+                 refresh_interval=STATUS_REFRESH_INTERVAL, cache_ttl=STATUS_CACHE_TTL):
+        self.bucket_name = bucket_name
+        self.prefix = prefix
+        self.refresh_interval = refresh_interval
+        self.cache_ttl = cache_ttl
+        self._redis = redis.Redis.from_url(redis_url, socket_timeout=1, socket_connect_timeout=1)
+        self._local_counters = None
+        self._redis_retry_at = 0
+        self._refresh_thread = None
+        self._thread_lock = threading.Lock()
+        add_object_listener(self._on_object_changed)
+
+    def get(self):
+        """
+        Returns the status dict used by the templates. Never blocks on S3: a
+        missing or stale value schedules a background refresh and the last
+        known value (or a placeholder) is returned meanwhile.
+        """
+        counters = self._read_counters()
+        if counters is None or time.time() - counters['refreshed_at'] > self.refresh_interval:
+            self.refresh_async()
+        if counters is None:
+            return {"last_upload_time": None, "processing_speed": "Unknown", "system_status": "Online",
+                    "storage_usage": "Calculating...", "total_videos": 0, "total_detections": 0}
+        return {
+            "last_upload_time": None, "processing_speed": "Optimal",
+            "system_status": "Online" if get_s3_client() else "Offline",
+            "storage_usage": format_storage_usage(counters['storage_bytes']),
+            "total_videos": counters['total_videos'],
+            "total_detections": 0
+        }
+
+    def refresh_async(self):
+        """Starts a background refresh unless one is already running in this process."""
+        with self._thread_lock:
+            if self._refresh_thread is not None and self._refresh_thread.is_alive():
+                return
+            self._refresh_thread = threading.Thread(target=self.refresh, name='system-status-refresh', daemon=True)
+            self._refresh_thread.start()
+
+    def refresh(self):
+        """Rescans the bucket and stores the counters, unless another process is already doing so."""
+        try:
+            if not self._redis.set(STATUS_LOCK_KEY, os.getpid(), nx=True, ex=self.refresh_interval):
+                return
+        except redis.RedisError as e:
+            logger.warning(f"Redis unavailable for the system status lock: {e}")
+
+        try:
+            start = time.time()
+            counters = scan_bucket(self.bucket_name, self.prefix)
+            counters['refreshed_at'] = time.time()
+            self._local_counters = counters
+            self._write_counters(counters)
+            logger.info(f"System status refreshed in {time.time() - start:.2f}s: {counters['total_videos']} videos")
+        except Exception as e:
+            logger.error(f"Error refreshing system status: {str(e)}")
+        finally:
+            try:
+                self._redis.delete(STATUS_LOCK_KEY)
+            except redis.RedisError:
+                pass
+
+    def _read_counters(self):
+        if time.time() < self._redis_retry_at:
+            return self._local_counters
+        try:
+            values = self._redis.hgetall(STATUS_KEY)
+        except redis.RedisError as e:
+            logger.warning(f"Redis unavailable for the system status: {e}")
+            self._redis_retry_at = time.time() + STATUS_REDIS_RETRY_SECONDS
+            return self._local_counters
+        if not values:
+            return None
+        return {
+            'storage_bytes': int(values.get(b'storage_bytes', 0)),
+            'total_videos': int(values.get(b'total_videos', 0)),
+            'refreshed_at': float(values.get(b'refreshed_at', 0))
+        }
+
+    def _write_counters(self, counters):
+        try:
+            with self._redis.pipeline() as pipe:
+                pipe.delete(STATUS_KEY)
+                pipe.hset(STATUS_KEY, mapping=counters)
+                pipe.expire(STATUS_KEY, self.cache_ttl)
+                pipe.execute()
+        except redis.RedisError as e:
+            logger.warning(f"Could not store the system status in Redis: {e}")
+
+    def _on_object_changed(self, event, bucket_name, s3_key, size):
+        if bucket_name != self.bucket_name or not s3_key.startswith(self.prefix):
+            return
+        if size is None:
+            # Without the size the counters cannot be adjusted; rescan instead.
+            self.refresh_async()
+            return
+
+        sign = 1 if event == 'upload' else -1
+        is_video = s3_key.lower().endswith(VIDEO_EXTENSIONS)
+        if self._local_counters is not None:
+            self._local_counters['storage_bytes'] += sign * size
+            self._local_counters['total_videos'] += sign * is_video
+        try:
+            if not self._redis.exists(STATUS_KEY):
+                return
+            with self._redis.pipeline() as pipe:
+                pipe.hincrby(STATUS_KEY, 'storage_bytes', sign * size)
+                if is_video:
+                    pipe.hincrby(STATUS_KEY, 'total_videos', sign)
+                pipe.execute()
+        except redis.RedisError as e:
+            logger.warning(f"Could not update the system status in Redis: {e}")
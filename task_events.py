@@ -0,0 +1,106 @@
+"""
+Task progress events over Redis pub/sub.
+
+Workers publish every progress update, and the final result or failure, of a
+task on a per-task channel. The web app relays that channel to the browser as
+Server-Sent Events, so a client holds one connection per task instead of
+polling the result backend.
+
+Pub/sub does not keep messages, so the latest progress update is also stored
+under a short-lived key for clients that connect mid-task. The final result
+is read from the Celery result backend.
+
+A task whose video is split into chunks is followed under its own id; its
+chunks record their progress here and publish the combined progress as
+events of that task.
+"""
+
+import json
+import logging
+import os
+
+import redis
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+# How long the latest progress update of a task is kept.
+TASK_EVENT_TTL = int(os.getenv('TASK_EVENT_TTL', 24 * 3600))
+
+FINAL_STATES = ('SUCCESS', 'FAILURE', 'REVOKED')
+
+_redis_client = None
+
+
+def get_redis():
+    """Returns the process-wide Redis client used for task events."""
+    global _redis_client
+    if _redis_client is None:
+        _redis_client = redis.Redis.from_url(REDIS_URL, socket_connect_timeout=2)
+    return _redis_client
+
+
+def channel_name(task_id):
+    return f"wagon:task:{task_id}:events"
+
+
+def last_event_key(task_id):
+    return f"wagon:task:{task_id}:last"
+
+
+def publish_task_event(task_id, event):
+    """
+    Publishes one event (a dict with at least 'state') for a task. Progress
+    events are also stored as the task's latest event. Errors are logged and
+    never raised, so a Redis outage cannot fail a task.
+    """
+    try:
+        payload = json.dumps(event, default=str)
+        client = get_redis()
+        with client.pipeline() as pipe:
+            if event.get('state') not in FINAL_STATES:
+                pipe.set(last_event_key(task_id), payload, ex=TASK_EVENT_TTL)
+            else:
+                pipe.delete(last_event_key(task_id))
+            pipe.publish(channel_name(task_id), payload)
+            pipe.execute()
+    except (redis.RedisError, TypeError, ValueError) as e:
+        logger.warning(f"Could not publish event for task {task_id}: {e}")
+
+
+def chunk_progress_key(task_id):
+    return f"wagon:task:{task_id}:chunks"
+
+
+def record_chunk_progress(task_id, chunk_id, frames_done, wagons_captured):
+    """
+    Stores the progress of one chunk of a task whose video is processed in
+    chunks, and returns the totals over all chunks that reported so far as
+    (frames done, wagons captured), or None if Redis is unavailable.
+    """
+    key = chunk_progress_key(task_id)
+    try:
+        with get_redis().pipeline() as pipe:
+            pipe.hset(key, chunk_id, json.dumps([frames_done, wagons_captured]))
+            pipe.expire(key, TASK_EVENT_TTL)
+            pipe.hvals(key)
+            chunks = [json.loads(payload) for payload in pipe.execute()[-1]]
+    except (redis.RedisError, ValueError) as e:
+        logger.warning(f"Could not record chunk progress of task {task_id}: {e}")
+        return None
+    return sum(frames for frames, _ in chunks), sum(wagons for _, wagons in chunks)
+
+
+def get_last_event(task_id):
+    """Returns the latest progress event of a task, or None."""
+    payload = get_redis().get(last_event_key(task_id))
+    return json.loads(payload) if payload else None
+
+
+def subscribe(task_id):
+    """Returns a pub/sub object subscribed to the task's events."""
+    pubsub = get_redis().pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(channel_name(task_id))
+    return pubsub
@@ -0,0 +1,20 @@
+import os
+import sys
+
+import pytest
+import redis
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    """Points every Redis client created during the test at one in-memory server."""
+    fakeredis = pytest.importorskip('fakeredis')
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(redis.Redis, 'from_url',
+                        classmethod(lambda cls, url, **kwargs: fakeredis.FakeRedis(server=server)))
+
+    import task_events
+    monkeypatch.setattr(task_events, '_redis_client', None)
+    return fakeredis.FakeRedis(server=server)
@@ -0,0 +1,133 @@
+import pytest
+
+from batch_jobs import PROCESS_VIDEO_TASK, BatchJobs
+from task_events import publish_task_event
+
+
+class RecordingCelery:
+    """Collects the tasks a BatchJobs sends instead of queueing them."""
+
+    def __init__(self):
+        self.sent = []
+
+    def send_task(self, name, args=None, kwargs=None, task_id=None, queue=None):
+        self.sent.append({'name': name, 'args': args, 'kwargs': kwargs, 'task_id': task_id, 'queue': queue})
+
+
+@pytest.fixture
+def celery_app():
+    return RecordingCelery()
+
+
+@pytest.fixture
+def jobs(fake_redis, celery_app):
+    return BatchJobs(celery_app, 'bulk', redis_url='redis://test', user_concurrency=2)
+
+
+def videos(*names):
+    return [{'video': f's3://bucket/{name}.mp4', 'cache_key': name} for name in names]
+
+
+def finish(jobs, job_id, sent, error=None):
+    jobs.child_finished(job_id, sent['task_id'], sent['args'][0],
+                        result=None if error else {'count': 3}, error=error)
+
+
+def test_only_user_concurrency_children_are_sent(jobs, celery_app):
+    job_id = jobs.create('admin', 'models/best_weights.pt', videos('a', 'b', 'c', 'd', 'e'))
+    assert [sent['args'][0] for sent in celery_app.sent] == ['s3://bucket/a.mp4', 's3://bucket/b.mp4']
+    assert celery_app.sent[0]['name'] == PROCESS_VIDEO_TASK
+    assert celery_app.sent[0]['queue'] == 'bulk'
+    assert celery_app.sent[0]['kwargs'] == {'cache_key': 'a', 'camera_id': None, 'batch_id': job_id}
+
+    status = jobs.status(job_id)
+    assert (status['total'], status['pending'], status['state']) == (5, 3, 'PROGRESS')
+    # Status requests do not send more children while the slots are held
+    assert len(celery_app.sent) == 2
+
+
+def test_finished_children_free_their_slot(jobs, celery_app):
+    job_id = jobs.create('admin', 'models/best_weights.pt', videos('a', 'b', 'c'))
+    finish(jobs, job_id, celery_app.sent[0])
+    assert len(celery_app.sent) == 3
+
+    finish(jobs, job_id, celery_app.sent[1], error='Model could not be loaded')
+    finish(jobs, job_id, celery_app.sent[2])
+    status = jobs.status(job_id)
+    assert (status['completed'], status['failed'], status['pending']) == (2, 1, 0)
+    assert status['state'] == 'SUCCESS'
+    assert status['progress'] == 100
+    assert status['status'] == '3 of 3 videos processed, 1 failed'
+    children = {child['video']: child for child in status['children']}
+    assert children['s3://bucket/b.mp4']['error'] == 'Model could not be loaded'
+    assert children['s3://bucket/c.mp4']['count'] == 3
+
+
+def test_cached_and_duplicate_videos_are_not_sent(jobs, celery_app):
+    items = videos('a', 'b', 'a')
+    items[1]['result'] = {'count': 7}
+    job_id = jobs.create('admin', 'models/best_weights.pt', items)
+    assert [sent['args'][0] for sent in celery_app.sent] == ['s3://bucket/a.mp4']
+
+    status = jobs.status(job_id)
+    assert (status['total'], status['completed'], status['pending']) == (2, 1, 0)
+    finish(jobs, job_id, celery_app.sent[0])
+    assert jobs.status(job_id)['state'] == 'SUCCESS'
+
+
+def test_jobs_of_one_user_share_slots_and_take_turns(jobs, celery_app):
+    first = jobs.create('admin', 'models/best_weights.pt', videos('a', 'b', 'c'))
+    second = jobs.create('admin', 'models/best_weights.pt', videos('x', 'y'))
+    assert len(celery_app.sent) == 2
+
+    finish(jobs, first, celery_app.sent[0])
+    finish(jobs, first, celery_app.sent[1])
+    assert [sent['kwargs']['batch_id'] for sent in celery_app.sent[2:]] == [second, first]
+
+    # Another user has slots of their own
+    jobs.create('operator', 'models/best_weights.pt', videos('p', 'q'))
+    assert len(celery_app.sent) == 6
+
+
+def test_expired_slot_leases_are_freed_on_status(jobs, celery_app, fake_redis):
+    job_id = jobs.create('admin', 'models/best_weights.pt', videos('a', 'b', 'c'))
+    # The workers running the first two children died
+    slots_key = 'wagon:batch:user:admin:slots'
+    fake_redis.zadd(slots_key, {member: 0 for member in fake_redis.zrange(slots_key, 0, -1)})
+
+    assert jobs.status(job_id)['pending'] == 0
+    assert len(celery_app.sent) == 3
+
+
+def test_status_reports_running_children(jobs, celery_app):
+    job_id = jobs.create('admin', 'models/best_weights.pt', videos('a', 'b'))
+    publish_task_event(celery_app.sent[0]['task_id'], {'state': 'PROGRESS', 'progress': 50})
+
+    status = jobs.status(job_id)
+    assert status['running'] == 1
+    assert status['progress'] == 25
+
+
+def test_unknown_job(jobs):
+    assert jobs.status('missing') is None
+    # Late results of a deleted job are ignored
+    jobs.child_finished('missing', 'task', 's3://bucket/a.mp4', result={'count': 1})
+
+
+def test_task_failing_to_load_the_model_counts_as_failed(jobs, celery_app, monkeypatch):
+    import celery_worker
+    monkeypatch.setattr(celery_worker, 'batch_jobs', jobs)
+
+    def fail_to_load(model_path):
+        raise FileNotFoundError(model_path)
+
+    monkeypatch.setattr(celery_worker, 'ensure_model_loaded', fail_to_load)
+    job_id = jobs.create('admin', 'missing.pt', videos('a'))
+    sent = celery_app.sent[0]
+
+    outcome = celery_worker.process_video_task.apply(args=sent['args'], kwargs=sent['kwargs'],
+                                                     task_id=sent['task_id'])
+    assert outcome.failed()
+    status = jobs.status(job_id)
+    assert (status['failed'], status['state']) == (1, 'SUCCESS')
+    assert status['children'][0]['state'] == 'FAILURE'
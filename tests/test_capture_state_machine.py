@@ -0,0 +1,69 @@
+import numpy as np
+
+from frame_extractor import WagonCaptureStateMachine
+
+WAGON = [[10, 10, 50, 50]]
+TWO_WAGONS = [[10, 10, 50, 50], [60, 10, 90, 50]]
+
+
+def run(wagon_counts, capture_delay=2, finish=True):
+    """Pushes one frame per count (filled with its 1-based index) and returns the indices of the kept frames."""
+    machine = WagonCaptureStateMachine(capture_delay)
+    for idx, count in enumerate(wagon_counts, start=1):
+        machine.push(np.full((4, 4), idx, dtype=np.uint8), {0: [], 1: WAGON, 2: TWO_WAGONS}[count])
+    if finish:
+        machine.finish()
+    return [int(image[0, 0]) for image in machine.saved_frames]
+
+
+def test_keeps_the_frame_capture_delay_before_the_wagon_leaves():
+    # Frames 3-6 show the wagon; the last single-wagon frame is 6, so 4 is kept.
+    assert run([0, 0, 1, 1, 1, 1, 0, 0]) == [4]
+
+
+def test_every_wagon_is_captured_once():
+    counts = [0, 0] + ([1] * 5 + [0] * 3) * 3
+    assert run(counts) == [5, 13, 21]
+
+
+def test_wagon_seen_for_fewer_frames_than_the_delay_is_not_captured():
+    assert run([0, 0, 1, 0, 0, 0]) == []
+
+
+def test_two_wagons_in_view_end_the_single_wagon_run():
+    assert run([0, 0, 1, 1, 1, 1, 2, 2, 0, 0]) == [4]
+
+
+def test_finish_commits_the_wagon_still_passing():
+    assert run([0, 0, 1, 1, 1, 1], finish=False) == []
+    assert run([0, 0, 1, 1, 1, 1]) == [4]
+
+
+def test_kept_frame_is_a_copy():
+    capture_delay = 1
+    machine = WagonCaptureStateMachine(capture_delay)
+    frames = [np.full((4, 4), idx, dtype=np.uint8) for idx in range(6)]
+    for idx, count in enumerate([0, 1, 1, 1, 0, 0]):
+        machine.push(frames[idx], WAGON if count else [])
+        # Once a frame has left the capture_delay + 1 window its array may be reused
+        if idx > capture_delay:
+            frames[idx - capture_delay - 1][:] = 255
+    assert len(machine.saved_frames) == 1
+    assert machine.saved_frames[0][0, 0] == 2
+
+
+def test_on_capture_gets_the_kept_frame_and_its_index():
+    captures = []
+    machine = WagonCaptureStateMachine(2, on_capture=lambda image, idx: captures.append((idx, int(image[0, 0]))))
+    for idx, count in enumerate([0, 0, 1, 1, 1, 1, 0, 0, 1, 1, 1, 0], start=1):
+        machine.push(np.full((4, 4), idx, dtype=np.uint8), WAGON if count else [], idx)
+    machine.finish()
+    assert captures == [(4, 4), (9, 9)]
+
+
+def test_on_capture_result_replaces_the_image():
+    machine = WagonCaptureStateMachine(2, on_capture=lambda image, idx: f'wagon_f{idx}.jpg')
+    for idx, count in enumerate([0, 0, 1, 1, 1, 1, 0, 0], start=1):
+        machine.push(np.full((4, 4), idx, dtype=np.uint8), WAGON if count else [], idx)
+    machine.finish()
+    assert machine.saved_frames == ['wagon_f4.jpg']
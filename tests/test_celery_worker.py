@@ -0,0 +1,45 @@
+import pytest
+
+
+@pytest.fixture
+def worker(fake_redis, monkeypatch, tmp_path):
+    """celery_worker with a stand-in model and no result backend, writing its output under tmp_path."""
+    import celery_worker
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(celery_worker, 'ensure_model_loaded', lambda model_path: object())
+    for task in (celery_worker.process_video_task, celery_worker.process_video_parallel_task):
+        monkeypatch.setattr(task, 'update_state', lambda *args, **kwargs: None)
+    return celery_worker
+
+
+def test_tasks_started_in_the_same_second_get_their_own_output(worker, monkeypatch):
+    runs = []
+
+    def record_run(task, video_path, output_dir, run_id, *args, **kwargs):
+        runs.append((output_dir, run_id))
+        return 0, [], {}
+
+    monkeypatch.setattr(worker, 'run_extraction', record_run)
+    monkeypatch.setattr(worker.time, 'strftime', lambda fmt, *args: '20250606-162410')
+    for _ in range(2):
+        assert worker.process_video_task.apply(args=['video.mp4', 'model.pt']).successful()
+
+    (first_dir, first_id), (second_dir, second_id) = runs
+    assert first_id != second_id
+    assert first_dir != second_dir
+    assert first_id.startswith('20250606-162410-')
+
+
+def test_parallel_tasks_started_in_the_same_second_get_their_own_output(worker, monkeypatch):
+    monkeypatch.setattr(worker, 'get_video_info', lambda source: {'fps': 25, 'frame_count': 25 * 600})
+    monkeypatch.setattr(worker.process_video_parallel_task, 'replace', lambda signature: signature)
+    monkeypatch.setattr(worker.time, 'strftime', lambda fmt, *args: '20250606-162410')
+
+    output_dirs = []
+    for _ in range(2):
+        workflow = worker.process_video_parallel_task.apply(args=['video.mp4', 'model.pt']).get()
+        # Every chunk and the merge step use the output directory of their own job
+        chunk_dirs = {chunk.args[5] for chunk in workflow.tasks}
+        assert chunk_dirs == {workflow.body.args[0]}
+        output_dirs.append(chunk_dirs.pop())
+    assert output_dirs[0] != output_dirs[1]
@@ -0,0 +1,99 @@
+import cv2
+import numpy as np
+import pytest
+
+from frame_extractor import extract_and_annotate_wagons
+
+# Wagon count per frame: wagons of different lengths with gaps between them,
+# long enough that chunk boundaries can fall inside a passing wagon.
+WAGON_COUNTS = [0] * 6
+for length, gap in ((12, 6), (20, 4), (9, 10), (15, 3), (30, 8), (11, 5)):
+    WAGON_COUNTS += [1] * length + [0] * gap
+WAGON_COUNTS += [1] * 6 + [2] * 4 + [1] * 10 + [0] * 12
+
+
+class _Value:
+    def __init__(self, value):
+        self.value = np.asarray(value, dtype=float)
+
+    def item(self):
+        return float(self.value)
+
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return self.value
+
+
+class _Box:
+    def __init__(self, xyxy):
+        self.xyxy = _Value(xyxy)
+        self.conf = _Value(0.9)
+        self.cls = _Value(1)
+
+
+class _Result:
+    def __init__(self, boxes):
+        self.boxes = boxes
+
+
+class MarkerModel:
+    """Detects as many wagons as the brightness of the frame's top-left marker encodes."""
+
+    def __call__(self, frames, **kwargs):
+        frames = frames if isinstance(frames, list) else [frames]
+        return [_Result([_Box([20 * i, 10, 20 * i + 15, 50]) for i in range(round(frame[:16, :16].mean() / 60))])
+                for frame in frames]
+
+
+@pytest.fixture(scope='module')
+def video_path(tmp_path_factory):
+    # MJPG has no inter-frame prediction, so every chunk can seek to its exact start frame
+    path = str(tmp_path_factory.mktemp('video') / 'wagons.avi')
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), 25, (160, 120))
+    for idx, count in enumerate(WAGON_COUNTS):
+        frame = np.full((120, 160, 3), (idx * 7) % 200, dtype=np.uint8)
+        frame[:16, :16] = count * 60
+        writer.write(frame)
+    writer.release()
+    return path
+
+
+def captured_indices(video_path, **kwargs):
+    captured = []
+    extract_and_annotate_wagons(video_path, video_path + '.annotated.mp4', MarkerModel(),
+                                on_capture=lambda image, idx: captured.append(idx) or idx, **kwargs)
+    return captured
+
+
+def chunked_indices(video_path, boundaries, overlap_frames):
+    captured = []
+    for start_frame, end_frame in zip(boundaries, boundaries[1:]):
+        captured += captured_indices(video_path, start_frame=start_frame, end_frame=end_frame,
+                                     overlap_frames=overlap_frames)
+    return captured
+
+
+def test_whole_video_captures_every_wagon(video_path):
+    # The last group is two wagons coupled closely enough to be in view together: captured once each
+    assert len(captured_indices(video_path)) == 8
+
+
+@pytest.mark.parametrize('boundaries', [
+    [0, 60, 120, len(WAGON_COUNTS)],
+    # Boundaries inside passing wagons and right after one leaves
+    [0, 12, 33, 47, 96, 130, len(WAGON_COUNTS)],
+    list(range(0, len(WAGON_COUNTS), 25)) + [len(WAGON_COUNTS)],
+])
+def test_chunks_capture_each_wagon_exactly_once(video_path, boundaries):
+    expected = captured_indices(video_path)
+    captured = chunked_indices(video_path, boundaries, overlap_frames=40)
+    assert sorted(captured) == expected
+    assert len(set(captured)) == len(captured)
+
+
+def test_chunks_without_enough_overlap_differ(video_path):
+    # A wagon longer than the overlap cannot be settled, which is why the overlap is configurable
+    boundaries = [0, 100, len(WAGON_COUNTS)]
+    assert sorted(chunked_indices(video_path, boundaries, overlap_frames=0)) != captured_indices(video_path)
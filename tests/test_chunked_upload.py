@@ -0,0 +1,143 @@
+import io
+import os
+import time
+
+import pytest
+
+import s3_utils
+from chunked_upload import S3_MIN_PART_SIZE, ChunkedUploads, UploadError
+
+BUCKET = 'wagon-test'
+DATA = bytes(range(256)) * 40
+
+
+@pytest.fixture
+def uploads(fake_redis, tmp_path):
+    return ChunkedUploads(str(tmp_path / 'uploads'), BUCKET, 'videos', redis_url='redis://test')
+
+
+@pytest.fixture
+def s3_bucket(monkeypatch):
+    moto = pytest.importorskip('moto')
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    monkeypatch.delenv('S3_ENDPOINT_URL', raising=False)
+    with moto.mock_aws():
+        s3_utils._reset_s3_client()
+        s3_utils.get_s3_client().create_bucket(Bucket=BUCKET)
+        yield s3_utils.get_s3_client()
+    s3_utils._reset_s3_client()
+
+
+def send(uploads, upload_id, offset, data):
+    return uploads.write_chunk(upload_id, offset, io.BytesIO(data), len(data))
+
+
+def test_local_upload_in_chunks(uploads):
+    session = uploads.create('train 1.mp4', len(DATA), folder='2024-10-05/left_entry', metadata={'user': 'admin'})
+    offset = 0
+    for start in range(0, len(DATA), 4096):
+        offset = send(uploads, session['upload_id'], offset, DATA[start:start + 4096])
+    assert offset == len(DATA)
+
+    completed = uploads.complete(session['upload_id'])
+    assert completed['path'].endswith('_train_1.mp4')
+    assert os.path.dirname(completed['path']).endswith(os.path.join('2024-10-05', 'left_entry'))
+    assert not os.path.exists(completed['path'] + '.part')
+    with open(completed['path'], 'rb') as f:
+        assert f.read() == DATA
+    assert uploads.get(session['upload_id'])['metadata'] == {'user': 'admin'}
+
+
+def test_resume_after_dropped_chunk(uploads):
+    upload_id = uploads.create('train.mp4', len(DATA))['upload_id']
+    send(uploads, upload_id, 0, DATA[:4000])
+
+    # The connection dropped after part of the next chunk arrived
+    with pytest.raises(UploadError) as error:
+        uploads.write_chunk(upload_id, 4000, io.BytesIO(DATA[4000:5000]), 4000)
+    assert error.value.offset == 5000
+
+    # Resending from the old offset is refused with the offset to resume from
+    with pytest.raises(UploadError) as error:
+        send(uploads, upload_id, 4000, DATA[4000:8000])
+    assert error.value.status == 409
+    assert error.value.offset == 5000
+
+    offset = uploads.get(upload_id)['offset']
+    assert send(uploads, upload_id, offset, DATA[offset:]) == len(DATA)
+    with open(uploads.complete(upload_id)['path'], 'rb') as f:
+        assert f.read() == DATA
+
+
+def test_complete_requires_every_byte(uploads):
+    upload_id = uploads.create('train.mp4', len(DATA))['upload_id']
+    send(uploads, upload_id, 0, DATA[:100])
+    with pytest.raises(UploadError) as error:
+        uploads.complete(upload_id)
+    assert (error.value.status, error.value.offset) == (409, 100)
+
+
+def test_completed_upload_accepts_nothing_more(uploads):
+    upload_id = uploads.create('train.mp4', len(DATA))['upload_id']
+    send(uploads, upload_id, 0, DATA)
+    uploads.complete(upload_id)
+    with pytest.raises(UploadError) as error:
+        uploads.complete(upload_id)
+    assert error.value.status == 409
+    with pytest.raises(UploadError) as error:
+        send(uploads, upload_id, len(DATA), b'x')
+    assert error.value.status == 409
+
+
+def test_chunk_past_the_end_is_refused(uploads):
+    upload_id = uploads.create('train.mp4', 10)['upload_id']
+    with pytest.raises(UploadError) as error:
+        send(uploads, upload_id, 0, b'x' * 11)
+    assert error.value.status == 400
+    assert uploads.get(upload_id)['offset'] == 0
+
+
+def test_abort_removes_partial_data(uploads):
+    session = uploads.create('train.mp4', len(DATA))
+    send(uploads, session['upload_id'], 0, DATA[:100])
+    uploads.abort(session['upload_id'])
+    assert not os.path.exists(session['path'] + '.part')
+    assert uploads.get(session['upload_id']) is None
+    with pytest.raises(UploadError) as error:
+        send(uploads, session['upload_id'], 100, DATA[100:200])
+    assert error.value.status == 404
+
+
+def test_sweep_deletes_only_expired_parts(uploads):
+    expired = uploads.create('old.mp4', len(DATA))
+    active = uploads.create('new.mp4', len(DATA))
+    finished = uploads.create('done.mp4', len(DATA))
+    send(uploads, finished['upload_id'], 0, DATA)
+    uploads.complete(finished['upload_id'])
+
+    day_ago = time.time() - 25 * 3600
+    os.utime(expired['path'] + '.part', (day_ago, day_ago))
+    os.utime(finished['path'], (day_ago, day_ago))
+
+    assert uploads.sweep_expired_parts(max_age=24 * 3600) == 1
+    assert not os.path.exists(expired['path'] + '.part')
+    assert os.path.exists(active['path'] + '.part')
+    assert os.path.exists(finished['path'])
+
+
+def test_s3_upload_in_parts(uploads, s3_bucket):
+    data = os.urandom(S3_MIN_PART_SIZE) + DATA
+    session = uploads.create('train.mp4', len(data), target='s3', folder='2024-10-05/top_exit',
+                             content_type='video/mp4')
+    assert session['s3_key'] == 'videos/2024-10-05/top_exit/train.mp4'
+
+    # Parts other than the last must meet the S3 minimum
+    with pytest.raises(UploadError):
+        send(uploads, session['upload_id'], 0, data[:1024])
+    offset = send(uploads, session['upload_id'], 0, data[:S3_MIN_PART_SIZE])
+    offset = send(uploads, session['upload_id'], offset, data[offset:])
+    assert offset == len(data)
+
+    uploads.complete(session['upload_id'])
+    assert s3_bucket.get_object(Bucket=BUCKET, Key=session['s3_key'])['Body'].read() == data
@@ -0,0 +1,75 @@
+import threading
+
+import numpy as np
+import pytest
+
+from frame_storage import FrameStore, LocalFrameStore
+
+
+class BlockingStore(FrameStore):
+    """Keeps its writes waiting until `release` is set."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.release = threading.Event()
+        self.written = []
+
+    def _describe(self, filename):
+        return {'name': filename}
+
+    def _write(self, filename, data):
+        self.release.wait()
+        if filename == 'wagon_0002.jpg' and getattr(self, 'fail_second', False):
+            raise IOError('disk full')
+        self.written.append(filename)
+
+
+FRAME = np.zeros((8, 8, 3), dtype=np.uint8)
+
+
+def test_save_waits_once_max_pending_writes_are_queued():
+    store = BlockingStore(max_workers=1, max_pending=3)
+    returned = []
+    saver = threading.Thread(target=lambda: [returned.append(store.save(FRAME)) for _ in range(10)])
+    saver.start()
+    saver.join(timeout=0.5)
+    # The fourth save waits for the first write
+    assert saver.is_alive()
+    assert len(returned) == 3
+
+    store.release.set()
+    saver.join(timeout=5)
+    store.close()
+    assert len(returned) == 10
+    assert store.written == [f'wagon_{idx:04d}.jpg' for idx in range(1, 11)]
+
+
+def test_finished_writes_are_not_kept():
+    store = BlockingStore(max_workers=1, max_pending=100)
+    store.release.set()
+    for _ in range(20):
+        store.save(FRAME)
+        store._executor.submit(lambda: None).result()
+    assert len(store._pending) <= 1
+    store.close()
+
+
+def test_write_errors_are_raised():
+    store = BlockingStore(max_workers=1)
+    store.fail_second = True
+    store.release.set()
+    store.save(FRAME)
+    store.save(FRAME)
+    with pytest.raises(IOError):
+        store.close()
+
+
+def test_local_store_writes_jpegs(tmp_path):
+    store = LocalFrameStore(str(tmp_path / 'frames'), max_pending=1)
+    records = [store.save(FRAME, frame_idx) for frame_idx in (12, 40, 77)]
+    store.close()
+    assert [record['frame_index'] for record in records] == [12, 40, 77]
+    assert records[0]['path'].endswith('wagon_0001_f0000012.jpg')
+    for record in records:
+        with open(record['path'], 'rb') as f:
+            assert f.read(2) == b'\xff\xd8'
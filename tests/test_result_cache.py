@@ -0,0 +1,107 @@
+import pytest
+
+import extraction_config
+from extraction_config import extraction_settings
+from result_cache import ResultCache, file_sha256, make_cache_key
+
+VIDEO = 'a' * 64
+WEIGHTS = 'b' * 64
+
+
+@pytest.fixture
+def cameras(monkeypatch):
+    monkeypatch.setattr(extraction_config, 'CAMERA_SETTINGS', {
+        'default': {'roi': None, 'imgsz': 640},
+        'left': {'roi': [0.0, 0.2, 1.0, 0.8], 'imgsz': 640},
+        'top': {'roi': None, 'imgsz': 480},
+    })
+
+
+def key(**kwargs):
+    return make_cache_key(VIDEO, WEIGHTS, extraction_settings(**kwargs))
+
+
+def test_key_is_stable_for_identical_inputs(cameras):
+    assert key() == key()
+    assert make_cache_key(VIDEO, WEIGHTS, {'a': 1, 'b': 2}) == make_cache_key(VIDEO, WEIGHTS, {'b': 2, 'a': 1})
+
+
+def test_key_depends_on_video_weights_and_settings():
+    settings = {'search_stride': 1}
+    assert make_cache_key(VIDEO, WEIGHTS, settings) != make_cache_key('c' * 64, WEIGHTS, settings)
+    assert make_cache_key(VIDEO, WEIGHTS, settings) != make_cache_key(VIDEO, 'c' * 64, settings)
+    assert make_cache_key(VIDEO, WEIGHTS, settings) != make_cache_key(VIDEO, WEIGHTS, {'search_stride': 4})
+
+
+@pytest.mark.parametrize('name, value', [
+    ('INFERENCE_IMGSZ', 320),
+    ('VIDEO_DECODER', 'pyav'),
+    ('INFERENCE_BACKEND', 'onnx'),
+    ('FRAME_JPEG_QUALITY', 50),
+])
+def test_key_changes_with_output_affecting_settings(cameras, monkeypatch, name, value):
+    default_key = key()
+    monkeypatch.setattr(extraction_config, name, value)
+    assert key() != default_key
+
+
+def test_key_changes_with_camera_settings(cameras):
+    assert key(camera_id='left') != key()
+    assert key(camera_id='top') != key()
+    # Cameras without their own settings use the default ones
+    assert key(camera_id='right') == key()
+
+
+def test_key_changes_with_stride_and_annotation(cameras):
+    assert key(search_stride=4) != key(search_stride=1)
+    assert key(annotate_video=True) != key(annotate_video=False)
+
+
+def test_key_ignores_throughput_settings(cameras):
+    assert key(batch_size=1, pipelined=False) == key(batch_size=32, pipelined=True)
+
+
+def test_cache_round_trip_and_lru_eviction(fake_redis, tmp_path):
+    cache = ResultCache('redis://test', max_entries=2)
+    frame = tmp_path / 'wagon_1.jpg'
+    frame.write_bytes(b'jpeg')
+    result = {'status': 'Completed', 'frames': [{'frame_index': 1, 'path': str(frame), 'url': '/wagon_1.jpg'}]}
+
+    cache.put('first', result)
+    cache.put('second', result)
+    assert cache.get('first')['result'] == ['/wagon_1.jpg']
+    # 'second' is now the least recently used entry
+    cache.put('third', result)
+    assert cache.get('second') is None
+    assert cache.get('first') is not None
+    assert cache.get('third') is not None
+
+
+def test_cache_drops_results_whose_frames_were_deleted(fake_redis, tmp_path):
+    cache = ResultCache('redis://test')
+    frame = tmp_path / 'wagon_1.jpg'
+    frame.write_bytes(b'jpeg')
+    cache.put('key', {'frames': [{'frame_index': 1, 'path': str(frame), 'url': '/wagon_1.jpg'}]})
+
+    frame.unlink()
+    assert cache.get('key') is None
+    assert fake_redis.zcard('wagon:result:lru') == 0
+
+
+def test_weights_digest_published_by_workers_is_used(fake_redis, tmp_path):
+    weights = tmp_path / 'best_weights.pt'
+    weights.write_bytes(b'worker weights')
+    ResultCache('redis://test').publish_weights_digest(str(weights))
+    published = ResultCache('redis://test').weights_digest(str(weights))
+
+    # A web host without the weights file uses the workers' digest
+    weights.unlink()
+    assert ResultCache('redis://test').weights_digest(str(weights)) == published
+
+
+def test_weights_digest_falls_back_to_the_local_file(fake_redis, tmp_path):
+    cache = ResultCache('redis://test')
+    weights = tmp_path / 'best_weights.pt'
+    assert cache.weights_digest(str(weights)) is None
+    weights.write_bytes(b'local weights')
+    assert cache.weights_digest(str(weights)) == file_sha256(str(weights))
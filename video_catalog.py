@@ -0,0 +1,237 @@
+"""
+Local catalog of the recordings stored in S3.
+
+Looking videos up by date and camera through S3 listings gets slow with a
+day's worth of recordings per camera, so every video key is indexed in a
+SQLite database instead. The catalog is kept up to date from the uploads and
+deletes made through s3_utils, and can be (re)built from the bucket with:
+
+    python video_catalog.py backfill
+
+The recording date, camera (left/right/top) and video type (entry/exit) are
+taken from the key: from path segments or filename tokens such as
+`2024-10-05/left_entry/train.mp4`, then from the timestamp that
+upload_file_to_s3 appends to filenames, and finally from the object's
+last-modified time.
+"""
+
+import argparse
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+
+from dotenv import load_dotenv
+
+from s3_utils import add_object_listener, get_s3_client
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+VIDEO_CATALOG_PATH = os.getenv('VIDEO_CATALOG_PATH', 'video_catalog.db')
+
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov')
+CAMERAS = ('left', 'right', 'top')
+VIDEO_TYPES = ('entry', 'exit')
+
+_DATE_PATTERN = re.compile(r'(?<!\d)(\d{4})[-_]?(\d{2})[-_]?(\d{2})(?!\d)')
+_UPLOAD_TIMESTAMP_PATTERN = re.compile(r'_(\d{4})(\d{2})(\d{2})_\d{6}$')
+_TOKEN_SEPARATORS = re.compile(r'[/_\-. ]+')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS videos (
+    bucket TEXT NOT NULL,
+    s3_key TEXT NOT NULL,
+    folder TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    recorded_date TEXT,
+    camera TEXT,
+    video_type TEXT,
+    size INTEGER,
+    last_modified TEXT,
+    PRIMARY KEY (bucket, s3_key)
+);
+CREATE INDEX IF NOT EXISTS idx_videos_date_camera ON videos (recorded_date, camera, video_type, folder, filename);
+CREATE INDEX IF NOT EXISTS idx_videos_folder ON videos (folder, filename);
+"""
+
+
+def _parse_date(text):
+    match = _DATE_PATTERN.search(text)
+    if match is None:
+        return None
+    try:
+        return datetime(*map(int, match.groups())).strftime('%Y-%m-%d')
+    except ValueError:
+        return None
+
+
+def parse_video_key(s3_key, prefix='', last_modified=None):
+    """
+    Works out where a video belongs in the catalog from its S3 key.
+
+    Args:
+        s3_key: Key of the video in S3
+        prefix: Upload folder the key lives under; it is not part of `folder`
+        last_modified: datetime used as the recording date if the key has none
+
+    Returns:
+        dict: folder, filename, recorded_date (YYYY-MM-DD or None), camera and
+        video_type (None when the key does not say)
+    """
+    relative_key = s3_key[len(prefix):].lstrip('/') if prefix and s3_key.startswith(prefix) else s3_key
+    folder, filename = os.path.split(relative_key)
+    stem = os.path.splitext(filename)[0]
+
+    recorded_date = _parse_date(folder)
+    if recorded_date is None:
+        match = _UPLOAD_TIMESTAMP_PATTERN.search(stem)
+        recorded_date = _parse_date(''.join(match.groups())) if match else _parse_date(stem)
+    if recorded_date is None and last_modified is not None:
+        recorded_date = last_modified.strftime('%Y-%m-%d')
+
+    tokens = set(_TOKEN_SEPARATORS.split(relative_key.lower()))
+    camera = next((name for name in CAMERAS if name in tokens), None)
+    video_type = next((name for name in VIDEO_TYPES if name in tokens), None)
+
+    return {'folder': folder, 'filename': filename, 'recorded_date': recorded_date,
+            'camera': camera, 'video_type': video_type}
+
+
+class VideoCatalog:
+    """
+    SQLite index of the videos under `prefix` in `bucket_name`.
+
+    Each thread gets its own connection; the database runs in WAL mode so the
+    web workers can read while an upload or a backfill is writing.
+    """
+
+    def __init__(self, bucket_name, prefix, db_path=VIDEO_CATALOG_PATH):
+        self.bucket_name = bucket_name
+        self.prefix = prefix
+        self.db_path = db_path
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+        add_object_listener(self._on_object_changed)
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _row(self, s3_key, size=None, last_modified=None):
+        entry = parse_video_key(s3_key, self.prefix, last_modified)
+        return (self.bucket_name, s3_key, entry['folder'], entry['filename'], entry['recorded_date'],
+                entry['camera'], entry['video_type'], size,
+                last_modified.isoformat() if last_modified else None)
+
+    def add(self, s3_key, size=None, last_modified=None):
+        """Adds or updates one video."""
+        self.add_many([(s3_key, size, last_modified)])
+
+    def add_many(self, videos):
+        """Adds or updates (s3_key, size, last_modified) tuples in one transaction."""
+        rows = [self._row(*video) for video in videos]
+        with self._connect() as conn:
+            conn.executemany('INSERT OR REPLACE INTO videos VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+        return len(rows)
+
+    def remove(self, s3_key):
+        """Removes one video."""
+        with self._connect() as conn:
+            conn.execute('DELETE FROM videos WHERE bucket = ? AND s3_key = ?', (self.bucket_name, s3_key))
+
+    def find(self, recorded_date, camera=None, video_type=None, folder=None, page=1, per_page=50):
+        """
+        Looks up the videos recorded on a date, optionally for one camera,
+        video type or folder, ordered by folder and filename.
+
+        Returns:
+            tuple: (list of video dicts for the page, int total matching videos)
+        """
+        conditions = ['bucket = ?', 'recorded_date = ?']
+        params = [self.bucket_name, recorded_date]
+        for column, value in (('camera', camera), ('video_type', video_type), ('folder', folder)):
+            if value is not None:
+                conditions.append(f'{column} = ?')
+                params.append(value)
+        where = ' AND '.join(conditions)
+
+        conn = self._connect()
+        total = conn.execute(f'SELECT COUNT(*) FROM videos WHERE {where}', params).fetchone()[0]
+        rows = conn.execute(
+            f'SELECT s3_key, folder, filename, recorded_date, camera, video_type, size, last_modified '
+            f'FROM videos WHERE {where} ORDER BY folder, filename LIMIT ? OFFSET ?',
+            params + [per_page, (page - 1) * per_page]).fetchall()
+        return [dict(row) for row in rows], total
+
+    def backfill(self, batch_size=1000):
+        """
+        Indexes every video under the prefix with one paginated listing of the
+        bucket. Videos that are no longer in the bucket are dropped.
+
+        Returns:
+            int: Number of videos indexed
+        """
+        start = time.time()
+        indexed = 0
+        seen_keys = set()
+        batch = []
+        paginator = get_s3_client().get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket_name, Prefix=self.prefix):
+            for item in page.get('Contents', []):
+                if not item['Key'].lower().endswith(VIDEO_EXTENSIONS):
+                    continue
+                seen_keys.add(item['Key'])
+                batch.append((item['Key'], item.get('Size'), item.get('LastModified')))
+                if len(batch) >= batch_size:
+                    indexed += self.add_many(batch)
+                    batch = []
+        indexed += self.add_many(batch)
+
+        with self._connect() as conn:
+            stale_keys = [row[0] for row in conn.execute('SELECT s3_key FROM videos WHERE bucket = ?',
+                                                          (self.bucket_name,))
+                          if row[0] not in seen_keys]
+            conn.executemany('DELETE FROM videos WHERE bucket = ? AND s3_key = ?',
+                             [(self.bucket_name, key) for key in stale_keys])
+        logger.info(f"Indexed {indexed} videos in {time.time() - start:.1f}s ({len(stale_keys)} stale removed)")
+        return indexed
+
+    def _on_object_changed(self, event, bucket_name, s3_key, size):
+        if bucket_name != self.bucket_name or not s3_key.startswith(self.prefix):
+            return
+        if not s3_key.lower().endswith(VIDEO_EXTENSIONS):
+            return
+        if event == 'upload':
+            self.add(s3_key, size, datetime.now(timezone.utc))
+        else:
+            self.remove(s3_key)
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description='Maintain the local video catalog.')
+    parser.add_argument('command', choices=['backfill'])
+    parser.add_argument('--bucket', default=os.getenv('S3_BUCKET_NAME', 'aispry-project'))
+    parser.add_argument('--prefix', default=os.getenv('S3_UPLOAD_FOLDER', '2024_Oct_CR_WagonDamageDetection/Wagon_H'))
+    parser.add_argument('--db', default=VIDEO_CATALOG_PATH)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    catalog = VideoCatalog(args.bucket, args.prefix, db_path=args.db)
+    catalog.backfill()
+
+
+if __name__ == '__main__':
+    main()
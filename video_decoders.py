@@ -0,0 +1,182 @@
+"""
+Video decoders for the frame extractor.
+
+Both decoders read a video as BGR frames with the `isOpened()`, `read()`,
+`grab()` and `release()` methods of cv2.VideoCapture, and add what the
+extractor needs on top:
+
+- `seek(frame_index)` positions the decoder on an exact frame;
+- `grab()` advances one frame without converting it to BGR, for frames the
+  pipeline does not look at;
+- `scale` downscales frames as they are decoded.
+
+'opencv' wraps cv2.VideoCapture. 'pyav' decodes through FFmpeg with PyAV,
+using frame and slice threads, and downscales frames while they are still
+planar YUV, before the BGR conversion. It needs the 'av' package.
+"""
+
+import importlib.util
+import logging
+
+import cv2
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+DECODERS = ('opencv', 'pyav')
+
+# Python package each decoder needs.
+DECODER_REQUIREMENTS = {'pyav': 'av'}
+
+
+def _scaled_size(width, height, scale):
+    if scale == 1.0:
+        return width, height
+    # Even sizes keep the chroma planes aligned for swscale and the encoders.
+    return max(2, int(width * scale) // 2 * 2), max(2, int(height * scale) // 2 * 2)
+
+
+class OpenCVDecoder:
+    """Decodes with cv2.VideoCapture; downscaling happens after decoding."""
+
+    def __init__(self, source, scale=1.0):
+        self.cap = cv2.VideoCapture(source)
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS)
+        self.frame_count = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.scale = scale
+        self.width, self.height = _scaled_size(int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                                               int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT)), scale)
+
+    def isOpened(self):
+        return self.cap.isOpened()
+
+    def read(self, image=None):
+        if self.scale == 1.0:
+            return self.cap.read(image)
+        ret, frame = self.cap.read()
+        if not ret:
+            return False, None
+        return True, cv2.resize(frame, (self.width, self.height), dst=image, interpolation=cv2.INTER_AREA)
+
+    def grab(self):
+        return self.cap.grab()
+
+    def seek(self, frame_index):
+        self.cap.set(cv2.CAP_PROP_POS_FRAMES, frame_index)
+
+    def release(self):
+        self.cap.release()
+
+
+class PyAVDecoder:
+    """
+    Decodes with FFmpeg through PyAV.
+
+    `threads` is the number of decoding threads, 0 letting FFmpeg choose.
+    Frames are always returned as new arrays, so `read()` ignores `image`.
+    """
+
+    def __init__(self, source, scale=1.0, threads=0):
+        import av
+
+        self._errors = (av.error.FFmpegError,)
+        self.container = None
+        self.fps = 0.0
+        self.frame_count = 0
+        self.width = self.height = 0
+        try:
+            self.container = av.open(source)
+            self.stream = self.container.streams.video[0]
+        except (av.error.FFmpegError, IndexError) as e:
+            logger.error(f"PyAV could not open {source}: {e}")
+            self.release()
+            return
+
+        self.stream.thread_type = 'AUTO'
+        self.stream.codec_context.thread_count = threads
+        rate = self.stream.average_rate or self.stream.guessed_rate
+        self.fps = float(rate) if rate else 0.0
+        self.frame_count = self.stream.frames
+        if not self.frame_count and self.stream.duration:
+            self.frame_count = int(self.stream.duration * self.stream.time_base * self.fps)
+        self.scale = scale
+        self.width, self.height = _scaled_size(self.stream.codec_context.width,
+                                               self.stream.codec_context.height, scale)
+        self.start_pts = self.stream.start_time or 0
+        self._frames = self.container.decode(self.stream)
+        self._pending = None
+
+    def isOpened(self):
+        return self.container is not None
+
+    def _next_frame(self):
+        if self._pending is not None:
+            frame, self._pending = self._pending, None
+            return frame
+        try:
+            return next(self._frames)
+        except StopIteration:
+            return None
+        except self._errors as e:
+            logger.warning(f"Stopped decoding at a corrupt frame: {e}")
+            return None
+
+    def read(self, image=None):
+        frame = self._next_frame() if self.container is not None else None
+        if frame is None:
+            return False, None
+        if self.scale == 1.0:
+            return True, frame.to_ndarray(format='bgr24')
+        # Scaling the YUV planes before the conversion keeps a scaled read as
+        # cheap as a full-size one, unlike resizing the BGR frame afterwards.
+        frame = frame.reformat(width=self.width, height=self.height, interpolation='AREA')
+        return True, frame.to_ndarray(format='bgr24')
+
+    def grab(self):
+        return self.container is not None and self._next_frame() is not None
+
+    def _frame_index(self, frame):
+        return round(float((frame.pts - self.start_pts) * self.stream.time_base) * self.fps)
+
+    def seek(self, frame_index):
+        """
+        Seeks to the keyframe at or before `frame_index`, then decodes up to
+        the frame itself without converting the frames in between.
+        """
+        if self.container is None or not self.fps:
+            return
+        target_pts = self.start_pts + int(frame_index / self.fps / self.stream.time_base)
+        self.container.seek(target_pts, stream=self.stream, backward=True)
+        self._frames = self.container.decode(self.stream)
+        self._pending = None
+        while True:
+            frame = self._next_frame()
+            if frame is None:
+                return
+            if frame.pts is None or self._frame_index(frame) >= frame_index:
+                self._pending = frame
+                return
+
+    def release(self):
+        if self.container is not None:
+            self.container.close()
+            self.container = None
+
+
+def open_video(source, decoder='opencv', scale=1.0, threads=0):
+    """
+    Opens `source` (a path or URL) with the given decoder. Check `isOpened()`
+    on the result, as with cv2.VideoCapture.
+
+    Args:
+        scale (float, optional): Size of the decoded frames relative to the video.
+        threads (int, optional): Decoding threads of the 'pyav' decoder, 0 for automatic.
+    """
+    if decoder not in DECODERS:
+        raise ValueError(f"Unknown video decoder '{decoder}', expected one of {DECODERS}")
+    requirement = DECODER_REQUIREMENTS.get(decoder)
+    if requirement and importlib.util.find_spec(requirement) is None:
+        raise ImportError(f"The '{decoder}' video decoder requires the '{requirement}' package.")
+    if decoder == 'pyav':
+        return PyAVDecoder(source, scale=scale, threads=threads)
+    return OpenCVDecoder(source, scale=scale)